@@ -0,0 +1,32 @@
+"""add sprite frame digest table
+
+Revision ID: 3b9e0c1d7a52
+Revises: c394cca72816
+Create Date: 2026-10-17 10:12:41.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e0c1d7a52'
+down_revision = 'c394cca72816'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # same layout as sprite_frame_hash. WITHOUT ROWID keeps rows clustered by floor frame
+    op.execute("""CREATE TABLE sprite_frame_digest (
+        sprite_frame_id INTEGER NOT NULL,
+        floor_sprite_frame_id INTEGER NOT NULL,
+        digest INTEGER NOT NULL,
+        PRIMARY KEY (floor_sprite_frame_id,digest),
+        FOREIGN KEY(floor_sprite_frame_id) REFERENCES sprite_frame (id),
+        FOREIGN KEY(sprite_frame_id) REFERENCES sprite_frame (id)
+) WITHOUT ROWID;""")
+
+
+def downgrade():
+    op.drop_table('sprite_frame_digest')
@@ -0,0 +1,34 @@
+"""add indexes for the queries run by the bot
+
+Revision ID: 6e2d8f4a1c93
+Revises: 3b9e0c1d7a52
+Create Date: 2026-10-17 14:03:27.514870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6e2d8f4a1c93'
+down_revision = '3b9e0c1d7a52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sprite_frame_hash is WITHOUT ROWID, the index also holds the primary key columns so hash lookups stay in it
+    op.create_index(op.f('ix_sprite_frame_hash_sprite_frame_id'), 'sprite_frame_hash', ['sprite_frame_id'], unique=False)
+    op.create_index(op.f('ix_sprite_frame_sprite_id'), 'sprite_frame', ['sprite_id'], unique=False)
+    # sprites of a quest type are loaded by their polymorphic type
+    op.create_index(op.f('ix_sprite_type_id'), 'sprite', ['type_id'], unique=False)
+    op.create_index('ix_quest_title_first_line_id', 'quest', ['title_first_line', 'id'], unique=False)
+    # statistics for the query planner
+    op.execute("ANALYZE;")
+
+
+def downgrade():
+    op.drop_index('ix_quest_title_first_line_id', table_name='quest')
+    op.drop_index(op.f('ix_sprite_type_id'), table_name='sprite')
+    op.drop_index(op.f('ix_sprite_frame_sprite_id'), table_name='sprite_frame')
+    op.drop_index(op.f('ix_sprite_frame_hash_sprite_frame_id'), table_name='sprite_frame_hash')
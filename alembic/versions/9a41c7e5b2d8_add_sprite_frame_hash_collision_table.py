@@ -0,0 +1,32 @@
+"""add sprite frame hash collision table
+
+Revision ID: 9a41c7e5b2d8
+Revises: 6e2d8f4a1c93
+Create Date: 2026-10-17 15:41:09.772314
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a41c7e5b2d8'
+down_revision = '6e2d8f4a1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""CREATE TABLE sprite_frame_hash_collision (
+        floor_sprite_frame_id INTEGER NOT NULL,
+        phash INTEGER NOT NULL,
+        sprite_frame_id INTEGER NOT NULL,
+        signature BLOB NOT NULL,
+        PRIMARY KEY (floor_sprite_frame_id,phash,sprite_frame_id),
+        FOREIGN KEY(floor_sprite_frame_id) REFERENCES sprite_frame (id),
+        FOREIGN KEY(sprite_frame_id) REFERENCES sprite_frame (id)
+) WITHOUT ROWID;""")
+
+
+def downgrade():
+    op.drop_table('sprite_frame_hash_collision')
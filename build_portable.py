@@ -1,6 +1,8 @@
 import subprocess
 from generate_version_info import gen_and_write_info
+from subot.asset_queries import export_runtime_bundle
 
 if __name__ == "__main__":
     gen_and_write_info()
+    export_runtime_bundle()
     subprocess.run(["pyinstaller", "cli.spec", "cli.py", "--noconfirm", "--clean"])
\ No newline at end of file
@@ -0,0 +1,11 @@
+import logging
+import time
+
+from subot.asset_queries import export_runtime_bundle
+from subot.settings import HASH_PACK_PATH
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    start = time.time()
+    export_runtime_bundle()
+    print(f"exported the runtime bundle to {HASH_PACK_PATH} in {time.time() - start:.1f}s")
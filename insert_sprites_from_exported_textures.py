@@ -12,10 +12,11 @@ from numpy.typing import ArrayLike
 from sqlalchemy import update
 from sqlalchemy.exc import NoResultFound
 
-from subot.hash_image import Overlay, compute_phash
+from subot.hash_image import Overlay, compose_tile_gray, compute_hash, compute_digest, compute_signatures, \
+    image_cache
 from subot.models import MasterNPCSprite, SpriteFrame, AltarSprite, Realm, RealmLookup, ProjectItemSprite, \
     NPCSprite, FloorSprite, OverlaySprite, Sprite, HashFrameWithFloor, WallSprite, SpriteType, ChestType, ChestSprite, \
-    CastleSprite, CreatureSprite
+    CastleSprite, CreatureSprite, DigestFrameWithFloor, HashCollisionWithFloor
 from subot.settings import Session
 
 import subot.settings as settings
@@ -228,18 +229,34 @@ def should_skip_hashing(filepath: str) -> bool:
     return False
 
 
+def collision_entry(phash_reuse, sprite_frame_id: int, composed_tile_gray: np.ndarray) -> dict:
+    return {
+        "floor_sprite_frame_id": phash_reuse.floor_frame_id,
+        "phash": phash_reuse.phash,
+        "sprite_frame_id": sprite_frame_id,
+        "signature": compute_signatures(composed_tile_gray)[0].tobytes(),
+    }
+
+
 def hash_items(sprite_type: Optional[SpriteType] = None):
     @dataclass(frozen=True)
     class PHashReuse:
         phash: int
         floor_frame_id: int
         sprite_canonical_name: Path = field(hash=False, compare=False)
+        sprite_frame_id: int = field(hash=False, compare=False, default=None)
 
     with Session() as session:
         existing_phashes: dict[PHashReuse, PHashReuse] = {}
+        existing_digests: set[tuple[int, int]] = set()
+        # hashes shared by different sprites on the same floor frame, told apart at runtime by their signatures
+        collisions: dict[PHashReuse, dict[str, dict]] = {}
+        # grayscale composing inputs of each floor frame
+        floor_frames: dict[int, tuple[np.ndarray, Optional[Overlay]]] = {}
 
         hash_time_taken = 0
         bulk_hash_entries = []
+        bulk_digest_entries = []
 
         ct = 1
         similar_ct = 0
@@ -257,6 +274,7 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
             query_result = session.query(SpriteFrame).all()
         else:
             query_result = session.query(SpriteFrame).join(Sprite).filter_by(type_id=sprite_type.value).all()
+        sprite_frames_by_id = {sprite_frame.id: sprite_frame for sprite_frame in query_result}
 
         hps_start = time.time()
         for floortile in floortiles:
@@ -272,6 +290,7 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
                 floor_frame_data_color = floor_frame.data_color
                 if floor_frame.sprite.long_name == "Where the Dead Ships Dwell floor tile test with overlay":
                     continue
+                floor_frames[floor_frame_id] = (floor_frame_data_color, overlay)
 
                 for sprite_frame in query_result:
                     if sprite_frame.id in only_seen_in_castle_sprite_frame_ids:
@@ -289,7 +308,9 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
                         print(f"not padded tile -skipping - {sprite_frame.filepath}")
                         continue
 
-                    phash = compute_phash(floor_frame_data_color, one_tile_worth_img, overlay)
+                    composed_tile_gray = compose_tile_gray(floor_frame_data_color, one_tile_worth_img, overlay)
+                    phash = compute_hash(composed_tile_gray)
+                    digest = compute_digest(composed_tile_gray)
 
                     hash_entry = {
                         "floor_sprite_frame_id": floor_frame_id,
@@ -299,10 +320,30 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
 
                     if not sprite_frame.sprite:
                         continue
+
+                    # identical pixels are the same tile no matter the sprite, keep the first seen
+                    if (digest, floor_frame_id) not in existing_digests:
+                        existing_digests.add((digest, floor_frame_id))
+                        bulk_digest_entries.append({
+                            "floor_sprite_frame_id": floor_frame_id,
+                            "sprite_frame_id": sprite_frame.id,
+                            "digest": digest,
+                        })
                     new_hash = PHashReuse(phash=hash_entry["phash"], floor_frame_id=hash_entry["floor_sprite_frame_id"],
-                                          sprite_canonical_name=sprite_frame.sprite.long_name)
+                                          sprite_canonical_name=sprite_frame.sprite.long_name,
+                                          sprite_frame_id=sprite_frame.id)
                     if existing_hash := existing_phashes.get(new_hash):
                         similar_ct += 1
+                        if existing_hash.sprite_canonical_name != new_hash.sprite_canonical_name:
+                            bucket = collisions.setdefault(existing_hash, {})
+                            if not bucket:
+                                existing_frame = sprite_frames_by_id[existing_hash.sprite_frame_id]
+                                existing_tile_gray = compose_tile_gray(floor_frame_data_color,
+                                                                       existing_frame.data_color[-32:, :32, :], overlay)
+                                bucket[existing_hash.sprite_canonical_name] = collision_entry(
+                                    existing_hash, existing_frame.id, existing_tile_gray)
+                            bucket.setdefault(new_hash.sprite_canonical_name,
+                                              collision_entry(new_hash, sprite_frame.id, composed_tile_gray))
                         # print(f"similar hash detected. old={existing_hash=} new {new_hash=}")
                         continue
                     existing_phashes[new_hash] = new_hash
@@ -311,8 +352,10 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
                     commit_threshold = 10000
                     if ct % commit_threshold == 0:
                         session.bulk_insert_mappings(HashFrameWithFloor, bulk_hash_entries)
+                        session.bulk_insert_mappings(DigestFrameWithFloor, bulk_digest_entries)
                         session.flush()
                         bulk_hash_entries.clear()
+                        bulk_digest_entries.clear()
                         hps_end = time.time()
                         took = hps_end - hps_start
                         hps = commit_threshold / took
@@ -320,10 +363,30 @@ def hash_items(sprite_type: Optional[SpriteType] = None):
                         hps_start = time.time()
 
                     ct += 1
+        shared_hash_count = len(collisions)
+        # a realm's table holds the hashes of all its floor frames, so a tile with a shared hash is compared against
+        # every sprite with that hash on any floor frame. Sprites which have it alone on a floor frame need a signature
+        shared_phashes = {reuse.phash for reuse in collisions}
+        for reuse in existing_phashes.values():
+            if reuse.phash not in shared_phashes or reuse in collisions:
+                continue
+            floor_frame_data_color, overlay = floor_frames[reuse.floor_frame_id]
+            frame = sprite_frames_by_id[reuse.sprite_frame_id]
+            tile_gray = compose_tile_gray(floor_frame_data_color, frame.data_color[-32:, :32, :], overlay)
+            collisions[reuse] = {reuse.sprite_canonical_name: collision_entry(reuse, frame.id, tile_gray)}
+
         session.bulk_insert_mappings(HashFrameWithFloor, bulk_hash_entries)
+        session.bulk_insert_mappings(DigestFrameWithFloor, bulk_digest_entries)
+        session.bulk_insert_mappings(HashCollisionWithFloor,
+                                     [entry for bucket in collisions.values() for entry in bucket.values()])
         session.commit()
         bulk_hash_entries.clear()
+        bulk_digest_entries.clear()
         print(f"total hashes = {ct},similar hashes={similar_ct}, similar% = {(similar_ct / ct) * 100}%")
+        print(f"hashes shared by different sprites = {shared_hash_count}, "
+              f"with the floor frames they are not shared on = {len(collisions)}")
+        print(f"image cache hit rate = {image_cache.hit_rate:.1%}, evictions = {image_cache.evictions}, "
+              f"size = {image_cache.size / 2 ** 20:.0f}MiB")
 
 
 def drop_existing_phashes(sprite_type: Optional[SpriteType] = None):
@@ -337,10 +400,18 @@ def drop_existing_phashes(sprite_type: Optional[SpriteType] = None):
             rows_deleted = session.query(HashFrameWithFloor) \
                 .filter(HashFrameWithFloor.sprite_frame_id.in_(frame_ids)) \
                 .delete()
+            session.query(DigestFrameWithFloor) \
+                .filter(DigestFrameWithFloor.sprite_frame_id.in_(frame_ids)) \
+                .delete()
+            session.query(HashCollisionWithFloor) \
+                .filter(HashCollisionWithFloor.sprite_frame_id.in_(frame_ids)) \
+                .delete()
             session.commit()
             print(f"cleared {sprite_type.name} type from phash table, deleted {rows_deleted} rows")
         else:
             rows_deleted = session.query(HashFrameWithFloor).delete()
+            session.query(DigestFrameWithFloor).delete()
+            session.query(HashCollisionWithFloor).delete()
             session.commit()
             print(f"cleared table, deleted {rows_deleted} rows")
 
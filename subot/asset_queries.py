@@ -0,0 +1,172 @@
+"""Queries of the asset database the bot used to run at startup, and the export of their results
+
+Only used to export the runtime bundle, or when the bot runs without one. See `subot.runtime_bundle`.
+"""
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from subot.hash_image import SortedSpriteHasher, RealmSpriteHasher, intern_image_info, SIGNATURE_SIZE
+from subot.hash_packs import pack_name, save_pack
+from subot.models import Realm, RealmLookup, FloorSprite, HashFrameWithFloor, DigestFrameWithFloor, SpriteFrame, \
+    HashCollisionWithFloor, Sprite, SpriteTypeLookup, WallSprite, Quest, QuestType, NPCSprite, ResourceNodeSprite, \
+    ChestSprite
+from subot.quests import QuestInfo
+from subot.runtime_bundle import RuntimeBundle, FloorInfo, BackgroundFrame, save_runtime_bundle
+from subot.settings import Session, HASH_PACK_PATH
+
+root = logging.getLogger()
+
+
+def floor_frame_ids(session, realm: Optional[Realm]) -> list[int]:
+    """Sprite frame ids of the floor tiles of a realm, or the castle's if `realm` is None"""
+    if realm:
+        realm_id = session.query(RealmLookup).filter_by(enum=realm).one().id
+        floors = session.query(FloorSprite).filter_by(realm_id=realm_id).all()
+    else:
+        floors = session.query(FloorSprite).filter_by(long_name="floor_standard1").all()
+    return [floor_tile.id for floor in floors for floor_tile in floor.frames]
+
+
+def query_sprite_hasher(session, floor_ids: list[int], max_distance: int = 0) -> SortedSpriteHasher:
+    """Loads the hashes and digests of sprites drawn on `floor_ids` as arrays, with one `ImageInfo` per sprite"""
+    phash_rows = session.query(HashFrameWithFloor.phash, SpriteFrame.sprite_id) \
+        .join(SpriteFrame, SpriteFrame.id == HashFrameWithFloor.sprite_frame_id) \
+        .filter(HashFrameWithFloor.floor_sprite_frame_id.in_(floor_ids)).all()
+    digest_rows = session.query(DigestFrameWithFloor.digest, SpriteFrame.sprite_id) \
+        .join(SpriteFrame, SpriteFrame.id == DigestFrameWithFloor.sprite_frame_id) \
+        .filter(DigestFrameWithFloor.floor_sprite_frame_id.in_(floor_ids)).all()
+    collision_rows = session.query(HashCollisionWithFloor.phash, SpriteFrame.sprite_id,
+                                   HashCollisionWithFloor.signature) \
+        .join(SpriteFrame, SpriteFrame.id == HashCollisionWithFloor.sprite_frame_id) \
+        .filter(HashCollisionWithFloor.floor_sprite_frame_id.in_(floor_ids)).all()
+
+    phashes = np.array(phash_rows, dtype=np.int64).reshape(-1, 2)
+    digests = np.array(digest_rows, dtype=np.int64).reshape(-1, 2)
+    collisions = np.array([(phash, sprite_id) for phash, sprite_id, _ in collision_rows], dtype=np.int64).reshape(-1, 2)
+    collision_signatures = np.array([np.frombuffer(signature, dtype=np.uint8) for _, _, signature in collision_rows],
+                                    dtype=np.uint8).reshape(-1, SIGNATURE_SIZE)
+    sprite_ids, sprite_indices = np.unique(np.concatenate([phashes[:, 1], digests[:, 1], collisions[:, 1]]),
+                                           return_inverse=True)
+    collisions_start = len(phashes) + len(digests)
+
+    sprite_infos = {}
+    sprites_query = session.query(Sprite.id, Sprite.short_name, Sprite.long_name, SpriteTypeLookup.name) \
+        .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
+        .filter(Sprite.id.in_(sprite_ids.tolist()))
+    for sprite_id, short_name, long_name, sprite_type in sprites_query.all():
+        sprite_infos[sprite_id] = intern_image_info(sprite_id, short_name, long_name, sprite_type)
+
+    return SortedSpriteHasher(hashes=phashes[:, 0], sprite_indices=sprite_indices[:len(phashes)],
+                              sprites=[sprite_infos[sprite_id] for sprite_id in sprite_ids.tolist()],
+                              digests=digests[:, 0], digest_sprite_indices=sprite_indices[len(phashes):collisions_start],
+                              collision_hashes=collisions[:, 0],
+                              collision_sprite_indices=sprite_indices[collisions_start:],
+                              collision_signatures=collision_signatures, max_distance=max_distance)
+
+
+def query_realm_sprite_hasher(session, floor_ids: list[int], max_distance: int = 0) -> RealmSpriteHasher:
+    """Same as `query_sprite_hasher` as a dict of every hash"""
+    hasher = RealmSpriteHasher(floor_tiles=None, max_distance=max_distance)
+    realm_phashes_query = session.query(HashFrameWithFloor.phash, Sprite.id, Sprite.short_name,
+                                        Sprite.long_name, SpriteTypeLookup.name) \
+        .join(SpriteFrame, SpriteFrame.id == HashFrameWithFloor.sprite_frame_id) \
+        .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
+        .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
+        .filter(HashFrameWithFloor.floor_sprite_frame_id.in_(floor_ids))
+    for realm_phash, sprite_id, short_name, long_name, sprite_type in realm_phashes_query.all():
+        hasher[realm_phash] = intern_image_info(sprite_id, short_name, long_name, sprite_type)
+
+    realm_digests_query = session.query(DigestFrameWithFloor.digest, Sprite.id, Sprite.short_name,
+                                        Sprite.long_name, SpriteTypeLookup.name) \
+        .join(SpriteFrame, SpriteFrame.id == DigestFrameWithFloor.sprite_frame_id) \
+        .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
+        .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
+        .filter(DigestFrameWithFloor.floor_sprite_frame_id.in_(floor_ids))
+    for realm_digest, sprite_id, short_name, long_name, sprite_type in realm_digests_query.all():
+        hasher.digests[realm_digest] = intern_image_info(sprite_id, short_name, long_name, sprite_type)
+
+    realm_collisions_query = session.query(HashCollisionWithFloor.phash, HashCollisionWithFloor.signature, Sprite.id,
+                                           Sprite.short_name, Sprite.long_name, SpriteTypeLookup.name) \
+        .join(SpriteFrame, SpriteFrame.id == HashCollisionWithFloor.sprite_frame_id) \
+        .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
+        .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
+        .filter(HashCollisionWithFloor.floor_sprite_frame_id.in_(floor_ids))
+    for realm_phash, signature, sprite_id, short_name, long_name, sprite_type in realm_collisions_query.all():
+        hasher.collisions.setdefault(realm_phash, []).append(
+            (np.frombuffer(signature, dtype=np.uint8), intern_image_info(sprite_id, short_name, long_name, sprite_type)))
+    return hasher
+
+
+def query_floor_hashes(session) -> dict[int, FloorInfo]:
+    """Floor tile of each hash of a floor tile drawn on a floor tile"""
+    floor_ids = [floor_id[0] for floor_id in session.query(HashFrameWithFloor.floor_sprite_frame_id).distinct()]
+    floor_phashes_query = session.query(HashFrameWithFloor.phash, Sprite.long_name, RealmLookup.enum) \
+        .join(SpriteFrame, SpriteFrame.id == HashFrameWithFloor.sprite_frame_id) \
+        .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
+        .join(FloorSprite, Sprite.id == FloorSprite.sprite_id) \
+        .outerjoin(RealmLookup, FloorSprite.realm_id == RealmLookup.id) \
+        .filter(HashFrameWithFloor.sprite_frame_id.in_(floor_ids)) \
+        .group_by(HashFrameWithFloor.phash, Sprite.long_name, RealmLookup.enum)
+    return {phash: FloorInfo(realm=realm, long_name=long_name) for phash, long_name, realm in floor_phashes_query.all()}
+
+
+def query_background_frames(session, realm: Optional[Realm]) -> list[BackgroundFrame]:
+    """Floor and wall frames of a realm, or the castle's floor if `realm` is None"""
+    frame_ids = floor_frame_ids(session, realm)
+    if realm:
+        wall_frames_query = session.query(SpriteFrame.id) \
+            .join(WallSprite, WallSprite.sprite_id == SpriteFrame.sprite_id) \
+            .join(RealmLookup, RealmLookup.id == WallSprite.realm_id) \
+            .filter(RealmLookup.enum == realm)
+        frame_ids.extend(frame_id for frame_id, in wall_frames_query.all())
+
+    frames_query = session.query(SpriteFrame._filepath, Sprite.id, Sprite.short_name, Sprite.long_name,
+                                 SpriteTypeLookup.name) \
+        .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
+        .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
+        .filter(SpriteFrame.id.in_(frame_ids))
+    return [BackgroundFrame(filepath=filepath,
+                            img_info=intern_image_info(sprite_id, short_name, long_name, sprite_type))
+            for filepath, sprite_id, short_name, long_name, sprite_type in frames_query.all()]
+
+
+def query_quests(session) -> list[QuestInfo]:
+    return [QuestInfo(id=quest.id, title=quest.title, title_first_line=quest.title_first_line,
+                      quest_type=quest.quest_type, supported=quest.supported, description=quest.description,
+                      sprite_long_names=frozenset(sprite.long_name for sprite in quest.sprites))
+            for quest in session.query(Quest).all()]
+
+
+def query_quest_type_sprites(session) -> dict[QuestType, frozenset[str]]:
+    """Sprites any quest of a type looks for, instead of the sprites of the quest"""
+    # Performance: only the names are loaded, not the sprites with their frames
+    quest_type_queries = {
+        QuestType.rescue: session.query(NPCSprite.long_name),
+        QuestType.resource_node: session.query(ResourceNodeSprite.long_name),
+        QuestType.cursed_chest: session.query(ChestSprite.long_name).filter(ChestSprite.realm_id.is_not(None)),
+    }
+    return {quest_type: frozenset(long_name for long_name, in query)
+            for quest_type, query in quest_type_queries.items()}
+
+
+def export_runtime_bundle(directory: Path = HASH_PACK_PATH):
+    """Export the hash pack of every realm and the castle, and the rest of the data the bot reads"""
+    with Session() as session:
+        realms: list[Optional[Realm]] = [None]
+        realms.extend(realm for realm, in session.query(RealmLookup.enum).all())
+        for realm in realms:
+            hasher = query_sprite_hasher(session, floor_frame_ids(session, realm))
+            save_pack(hasher, pack_name(realm), directory)
+            root.info(f"exported {pack_name(realm)} pack with {len(hasher)} hashes and {len(hasher.digests)} digests")
+
+        bundle = RuntimeBundle(
+            floor_hashes=query_floor_hashes(session),
+            quests=query_quests(session),
+            quest_type_sprites=query_quest_type_sprites(session),
+            background_frames={pack_name(realm): query_background_frames(session, realm) for realm in realms},
+        )
+        save_runtime_bundle(bundle, directory)
+        root.info(f"exported runtime bundle with {len(bundle.quests)} quests and {len(bundle.floor_hashes)} floor hashes")
@@ -0,0 +1,123 @@
+"""When the capture process grabs the screen and which part of a grab each consumer gets"""
+from __future__ import annotations
+import zlib
+from typing import Optional
+
+import numpy as np
+
+
+def crop_slices(outer: dict, inner: dict) -> Optional[tuple[slice, slice]]:
+    """Rows and columns of a grab of the mss area `outer` which hold the mss area `inner`
+    :return: None if `inner` is not entirely within `outer`
+    """
+    top = inner["top"] - outer["top"]
+    left = inner["left"] - outer["left"]
+    bottom = top + inner["height"]
+    right = left + inner["width"]
+    if top < 0 or left < 0 or bottom > outer["height"] or right > outer["width"]:
+        return None
+    return slice(top, bottom), slice(left, right)
+
+
+class CaptureRateController:
+    """How often a part of the screen is captured
+
+    Performance: the rate jumps to `ceiling_fps` as soon as a captured frame differs from the last (walking, moving
+    through a menu) and halves its distance to `floor_fps` every `half_life_seconds` while the screen stays the same.
+    Rates are raised to at least one capture per `FrameChangeFilter.HEARTBEAT_SECONDS`, so the heartbeat still goes
+    out while the screen stays the same.
+    """
+    HALF_LIFE_SECONDS: float = 1.0
+
+    def __init__(self, floor_fps: float, ceiling_fps: float, half_life_seconds: float = HALF_LIFE_SECONDS):
+        min_fps = 1 / FrameChangeFilter.HEARTBEAT_SECONDS
+        self.ceiling_fps = max(ceiling_fps, min_fps)
+        self.floor_fps = min(max(floor_fps, min_fps), self.ceiling_fps)
+        self.half_life_seconds = half_life_seconds
+        self.fps: float = ceiling_fps
+        self.next_capture: float = 0.0
+        self.last_capture: Optional[float] = None
+        self.first_capture: Optional[float] = None
+        self.captures: int = 0
+        self.changes: int = 0
+
+    @property
+    def seconds(self) -> float:
+        return 1 / self.fps
+
+    def due(self, now: float) -> bool:
+        return now >= self.next_capture
+
+    def update(self, changed: bool, now: float) -> float:
+        """Records a capture made at `now`
+        :param changed: if the frame differed from the last one
+        :return: the new rate
+        """
+        if changed:
+            self.fps = self.ceiling_fps
+            self.changes += 1
+        elif self.last_capture is not None:
+            decay = 0.5 ** ((now - self.last_capture) / self.half_life_seconds)
+            self.fps = self.floor_fps + (self.fps - self.floor_fps) * decay
+        self.last_capture = now
+        if self.first_capture is None:
+            self.first_capture = now
+        self.captures += 1
+
+        self.next_capture += self.seconds
+        # after falling behind, start over instead of capturing the missed frames back to back
+        if self.next_capture <= now:
+            self.next_capture = now + self.seconds
+        return self.fps
+
+    def report(self, name: str, now: float) -> str:
+        elapsed = now - self.first_capture if self.first_capture is not None else 0.0
+        mean_fps = self.captures / elapsed if elapsed > 0 else 0.0
+        return (f"{name} capture: {self.fps:.1f} fps now, {mean_fps:.1f} fps mean, "
+                f"{self.changes}/{self.captures} frames changed")
+
+
+def seconds_until_due(now: float, rates: list[CaptureRateController]) -> float:
+    """How long to sleep before the next capture of any of `rates`"""
+    return max(0.0, min(rate.next_capture for rate in rates) - now)
+
+
+class FrameChangeFilter:
+    """Skips publishing frames which are the same as the last one published
+
+    Performance: when the game is standing still nothing downstream has to run again. A frame is still published every
+    `heartbeat_seconds` so the analyzers know the capture process is alive.
+    """
+    HEARTBEAT_SECONDS: float = 1.0
+
+    def __init__(self, row_step: int = 2, heartbeat_seconds: float = HEARTBEAT_SECONDS):
+        """:param row_step: only every `row_step` row is compared. Sprites and text span many rows"""
+        self.row_step = row_step
+        self.heartbeat_seconds = heartbeat_seconds
+        self.last_digest: Optional[int] = None
+        self.last_published: float = 0.0
+        # the last frame was published only because the heartbeat was due
+        self.heartbeat: bool = False
+        self.published: int = 0
+        self.skipped: int = 0
+
+    def digest(self, frame: np.ndarray) -> int:
+        sampled = np.ascontiguousarray(frame[::self.row_step])
+        return zlib.crc32(memoryview(sampled).cast("B"), zlib.crc32(repr(frame.shape).encode()))
+
+    def changed(self, frame: np.ndarray, now: float) -> bool:
+        """If `frame` should be published. It counts as published when True is returned"""
+        digest = self.digest(frame)
+        unchanged = digest == self.last_digest
+        if unchanged and now - self.last_published < self.heartbeat_seconds:
+            self.skipped += 1
+            return False
+        self.heartbeat = unchanged
+        self.last_digest = digest
+        self.last_published = now
+        self.published += 1
+        return True
+
+    def reset(self):
+        """The next frame is published even if it has not changed"""
+        self.last_digest = None
@@ -0,0 +1,127 @@
+"""Game data types shared by the bot and the asset database, usable without SQLAlchemy"""
+from __future__ import annotations
+import enum
+
+
+class SpriteType(enum.Enum):
+    """How is the sprite commonly used in the game"""
+    # all sprites in the game that could be inspected
+    CREATURE = 1
+    # A catch-all for every other graphic asset in the game
+    DECORATION = 2
+    ENEMY = 3
+    # Decoration that only appears in the castle
+    CASTLE_DECORATION = 4
+    NPC = 5
+    FLOOR = 6
+    ALTAR = 7
+    # Sprite of each creature race's master
+    MASTER_NPC = 8
+    # Sprite for an item of a project
+    PROJ_ITEM = 9
+
+    # sprite used to overlay onto a rendered realm (rare)
+    OVERLAY = 10
+    RESOURCE_NODE = 11
+    WALL = 12
+    CHEST = 13
+
+
+class QuestType(enum.Enum):
+    """What type of object is the quest looking for"""
+    # Just asks to collect a set of decorations in any order
+    decoration = "decoration"
+    enemy = "normal enemy"
+    nemesis = "nemesis"
+    rescue = "rescue"
+    false_god = "false god"
+    nether_boss = "nether boss"
+    story = "story"
+    renegade = "renegade"
+    rebel = "rebel"
+    citizen = "citizen"
+    resource_node = "resource node"
+    # Defeat enemies that invade the realm by intereating with a cursed/haunted item
+    invasion = "invasion"
+    # stationary creatures must be found
+    creature = "creature"
+
+    # one of the chest in the realm is cursed
+    cursed_chest = "cursed chest"
+
+
+class Realm(enum.Enum):
+    ARACHNID_NEST = ('Arachnid Nest', 'Cave', 'Regalis')
+    AZURE_DREAM = ('Azure Dream', 'Life', "Surathli")
+    BASTION_OF_THE_VOID = ('Bastion of the Void', 'Void', 'Tenebris')
+    CAUSTIC_REACTOR = ('Caustic Reactor', 'Reactor', 'Venedon')
+    CUTTHROAT_JUNGLE = ('Cutthroat Jungle', "Jungle", "Torun")
+    BLOOD_GROVE = ('Blood Grove', "Autumn", "Apocranox")
+    DEAD_SHIPS = ('Where the Dead Ships Dwell', "Underwater", "Friden")
+    ETERNITY_END = ("Eternity's End", "Space", "Vertraag")
+    FARAWAY_ENCLAVE = ('Faraway Enclave', "Island", "Lister")
+    FROSTBITE_CAVERNS = ('Frostbite Caverns', "Snow", "Azural")
+    GREAT_PANDEMONIUM = ('Great Pandemonium', "Chaos", "Vulcanar")
+    KINGDOM_OF_HERETICS = ('Kingdom of Heretics', "Haunted", "Gonfurian")
+    PATH_OF_THE_DAMNED = ('Path of the Damned', "Death", "Erebyss")
+    REFUGE_OF_THE_MAGI = ('Refuge of the Magi', "Sorcery", "Zonte")
+    SANCTUM_UMBRA = ('Sanctum Umbra', "Purgatory", "Perdition")
+    TEMPLE_OF_LIES = ('Temple of Lies', "Gem", "Aurum")
+    THE_BARRENS = ('The Barrens', "Desert", "Yseros")
+    THE_SWAMPLANDS = ('The Swamplands', "Nature", "Meraxis")
+    TITAN_WOUND = ("Titan's Wound", "BloodBone", "Mortem")
+    TORTURE_CHAMBER = ('Torture Chamber', "Dungeon", "Tartarith")
+    UNSULLIED_MEADOWS = ('Unsullied Meadows', "Grassland", "Aeolian")
+
+    # new realms
+    THE_FAE_LANDS = ('Fae Lands', 'Fairy', 'Shallan')
+    AMALGAM_GARDENS = ('Amalgum Gardens', 'Amalgam', 'TMere Mrgo')
+    ASTRAL_GALLERY = ('Astral Gallery', "Astral", "Muse")
+    DAMAREL = ('Damarel', 'Damarel', "Alexandria")
+    FORBIDDEN_DEPTHS = ('Forbidden Depths', "ForbiddenDepths", "Anneltha")
+    FORGOTTEN_LAB = ('Forgotten Lab', "ForgottenLab", "Robo")
+    GAMBLERS_HIVE = ("Gambler's Hive", 'Beehive', "Reclusa")
+    LAND_OF_BALANCE = ('Land of Breath & Balance', "LandOfBalance", "Ariamaki")
+    OVERGROWN_TEMPLE = ('Overgrown Temple', "OvergrownTemple", "Genaros")
+
+    _ignore_ = ['god_to_realm_mapping', 'internal_realm_name_to_god_mapping', 'from_ingame_realm_name']
+    god_to_realm_mapping: dict[str, Realm] = {}
+    internal_realm_name_to_god_mapping: dict[str, Realm] = {}
+    from_ingame_realm_name: dict[str, Realm] = {}
+
+    def __init__(self, realm_name: str, internal_realm_name: str, god_name: str):
+        self.realm_name = realm_name
+        self.internal_realm_name = internal_realm_name
+        self.god_name = god_name
+
+    @classmethod
+    def generic_realm_name_to_ingame_realm(cls, generic_realm_name: str) -> Realm:
+        god_name = cls.internal_realm_name_to_god_mapping[generic_realm_name]
+        return cls.god_to_realm_mapping[god_name]
+
+
+Realm.god_to_realm_mapping = {realm.god_name: realm for realm in Realm}
+
+Realm.internal_realm_name_to_god_mapping = {realm.internal_realm_name: realm for realm in Realm}
+Realm.from_ingame_realm_name = {realm.realm_name: realm for realm in Realm}
+
+UNSUPPORTED_REALMS = {
+
+}
+
+
+class ChestType(enum.Enum):
+    """Type of chest a sprite is"""
+    # Normal chest placed on realm creation
+    NORMAL = 1
+    # Spawned from enemy defeat
+    SPAWNED = 2
+    # Large chest in realm
+    LARGE = 3
+    # A haunted/cursed chest that is part of a specific quest
+    HAUNTED = 4
+
+
+class ProjectType(enum.Enum):
+    MISSION = "mission"
+    SPECIAL_PROJECT = "special_project"
@@ -0,0 +1,263 @@
+"""Frames shared between the capture process and the analyzer threads without pickling them
+
+The capture process writes each frame into the next slot of a `FrameRing` and only sends a small `FrameReady` through
+the `FrameMailbox`'s queue. The analyzer reads the newest slot as a numpy view of the shared memory.
+"""
+from __future__ import annotations
+import multiprocessing
+import queue
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional, Any
+
+import numpy as np
+
+from subot.messageTypes import FrameReady
+
+# slots, slot_bytes, latest_seq, then seq, height, width, channels, capture time in ns of each slot
+_RING_FIELDS = 3
+_SLOT_FIELDS = 5
+_LATEST_SEQ = 2
+# frames start on a cache line
+_DATA_ALIGNMENT = 64
+
+
+def _header_size(slots: int) -> int:
+    size = (_RING_FIELDS + _SLOT_FIELDS * slots) * np.dtype(np.int64).itemsize
+    return -(-size // _DATA_ALIGNMENT) * _DATA_ALIGNMENT
+
+
+class FrameRing:
+    """Ring of uint8 frames in shared memory, numbered by a sequence which starts at 1
+
+    There is a single writer. A slot is rewritten every `slots` frames, so a reader should copy or finish with a view
+    before then. `is_valid` tells afterwards if that happened, a slot stops being valid as soon as its rewrite starts.
+    Pickling a ring attaches to the same shared memory, so it can be passed
+    to a `multiprocessing.Process`.
+    """
+    SLOTS: int = 3
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self._fields: np.ndarray = np.ndarray((_RING_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        self.slots: int = int(self._fields[0])
+        self.slot_bytes: int = int(self._fields[1])
+        self._header: np.ndarray = np.ndarray((_RING_FIELDS + _SLOT_FIELDS * self.slots,), dtype=np.int64,
+                                              buffer=shm.buf)
+        self._slot_headers: np.ndarray = self._header[_RING_FIELDS:].reshape(self.slots, _SLOT_FIELDS)
+        self._data: np.ndarray = np.ndarray((self.slots, self.slot_bytes), dtype=np.uint8, buffer=shm.buf,
+                                            offset=_header_size(self.slots))
+
+    @classmethod
+    def create(cls, slot_bytes: int, slots: int = SLOTS, name: Optional[str] = None) -> FrameRing:
+        """:param slot_bytes: size of the largest frame which will be written"""
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_header_size(slots) + slots * slot_bytes)
+        header = np.ndarray((_RING_FIELDS + _SLOT_FIELDS * slots,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[0] = slots
+        header[1] = slot_bytes
+        del header
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> FrameRing:
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def __reduce__(self):
+        return FrameRing.attach, (self.name,)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @property
+    def latest_seq(self) -> int:
+        """0 before the first frame"""
+        return int(self._header[_LATEST_SEQ])
+
+    def write(self, frame: np.ndarray, captured_at: Optional[float] = None) -> int:
+        """Copies `frame` into the next slot
+        :param captured_at: `time.time()` the frame was captured, now if not given
+        :return: sequence number of the frame
+        :raises ValueError: the frame is larger than a slot
+        """
+        if frame.nbytes > self.slot_bytes:
+            raise ValueError(f"frame of {frame.nbytes} bytes does not fit in a {self.slot_bytes} byte slot")
+        seq = self.latest_seq + 1
+        slot = seq % self.slots
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 0
+        captured_ns = time.time_ns() if captured_at is None else int(captured_at * 1e9)
+        # readers of the slot's old frame can tell it is being overwritten
+        self._slot_headers[slot, 0] = 0
+        np.copyto(self._data[slot, :frame.nbytes].reshape(frame.shape), frame, casting="no")
+        # the frame is written before it is numbered, and numbered before it is published
+        self._slot_headers[slot] = (seq, height, width, channels, captured_ns)
+        self._header[_LATEST_SEQ] = seq
+        return seq
+
+    def read(self, seq: int) -> Optional[np.ndarray]:
+        """View of frame `seq`. None if it was never written or its slot has been rewritten since"""
+        slot = seq % self.slots
+        slot_seq, height, width, channels, _ = (int(field) for field in self._slot_headers[slot])
+        if seq <= 0 or slot_seq != seq:
+            return None
+        shape = (height, width, channels) if channels else (height, width)
+        return self._data[slot, :height * width * max(channels, 1)].reshape(shape)
+
+    def is_valid(self, seq: int) -> bool:
+        """If frame `seq` is still in its slot. Check after using a view from `read` to know it was not overwritten"""
+        return seq > 0 and int(self._slot_headers[seq % self.slots, 0]) == seq
+
+    def captured_at(self, seq: int) -> Optional[float]:
+        """`time.time()` frame `seq` was captured. None if its slot has been rewritten"""
+        slot_seq, *_, captured_ns = (int(field) for field in self._slot_headers[seq % self.slots])
+        if seq <= 0 or slot_seq != seq:
+            return None
+        return captured_ns / 1e9
+
+    def latest(self) -> Optional[tuple[int, np.ndarray]]:
+        """The newest frame and its sequence number. None before the first frame"""
+        while seq := self.latest_seq:
+            frame = self.read(seq)
+            if frame is not None:
+                return seq, frame
+            # the writer went around the ring while reading, try the newer frame
+        return None
+
+    def close(self):
+        """Views handed out must be released before closing"""
+        del self._fields, self._header, self._slot_headers, self._data
+        self.shm.close()
+
+    def unlink(self):
+        """Frees the shared memory once every process closed it. Only done by the creator"""
+        if self.owner:
+            self.shm.unlink()
+
+
+@dataclass(frozen=True)
+class MailboxFrame:
+    seq: int
+    # a view of the ring's slot, see `FrameRing`
+    frame: np.ndarray
+    captured_at: float
+    # seconds from being captured to being taken out of the mailbox
+    age: float
+    # frames posted since the previously taken one which were replaced before being taken
+    dropped: int
+
+
+@dataclass(frozen=True)
+class _MessageSent:
+    """Wakes the analyzer for a message put in the mailbox's message queue"""
+
+
+class FrameMailbox:
+    """Hands the newest frame from the capture process to a single analyzer, counting the frames it never saw
+
+    Posting never blocks. A slow analyzer skips straight to the newest frame instead of working through stale ones.
+    Messages other than frames (`Minimized`, `Pause`, None to shut down) have their own queue so they are never dropped.
+    Messages which arrived are handed out before the frame waiting to be taken.
+    """
+
+    # most time a message waits while no frames arrive
+    MESSAGE_POLL_SECONDS: float = 0.1
+
+    def __init__(self, name: str, ring: FrameRing, notifications: multiprocessing.Queue,
+                 messages: multiprocessing.Queue):
+        self.name = name
+        self.ring = ring
+        self._notifications = notifications
+        self._messages = messages
+        # read by the analyzer only
+        self.last_seq: int = 0
+        self.frames: int = 0
+        self.dropped: int = 0
+        self.total_age: float = 0.0
+        self.max_age: float = 0.0
+
+    @classmethod
+    def create(cls, name: str, slot_bytes: int, slots: int = FrameRing.SLOTS) -> FrameMailbox:
+        # a couple of messages is enough, a frame notification only has to wake the analyzer
+        return cls(name, FrameRing.create(slot_bytes=slot_bytes, slots=slots), multiprocessing.Queue(maxsize=2),
+                   multiprocessing.Queue())
+
+    def post(self, frame: np.ndarray, captured_at: Optional[float] = None) -> int:
+        """Replaces the frame in the mailbox. Called by the capture process"""
+        seq = self.ring.write(frame, captured_at)
+        try:
+            self._notifications.put_nowait(FrameReady(seq))
+        except queue.Full:
+            # the analyzer has not woken up for an older frame yet, it will find this one instead
+            pass
+        return seq
+
+    def send(self, msg: Any):
+        """Sends a message which is not a frame. Called by the capture process, never blocks or drops the message"""
+        self._messages.put(msg)
+        try:
+            self._notifications.put_nowait(_MessageSent())
+        except queue.Full:
+            # the analyzer is woken for a frame already and checks for messages first
+            pass
+
+    def get(self, timeout: float) -> Any:
+        """The next message which is not a frame, otherwise the newest frame as a `MailboxFrame`
+        :raises queue.Empty: nothing new for `timeout` seconds
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                return self._messages.get_nowait()
+            except queue.Empty:
+                pass
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise queue.Empty
+            try:
+                # a message whose wake up did not fit in the queue, or is still on its way, is found on the next pass
+                msg = self._notifications.get(timeout=min(remaining, self.MESSAGE_POLL_SECONDS))
+            except queue.Empty:
+                continue
+            if isinstance(msg, _MessageSent):
+                continue
+            latest = self.ring.latest()
+            if latest is None or latest[0] <= self.last_seq:
+                # already taken when an earlier notification was handled
+                continue
+            seq, frame = latest
+            captured_at = self.ring.captured_at(seq)
+            if captured_at is None:
+                continue
+            age = time.time() - captured_at
+            dropped = seq - self.last_seq - 1 if self.last_seq else 0
+            self.last_seq = seq
+            self.frames += 1
+            self.dropped += dropped
+            self.total_age += age
+            self.max_age = max(self.max_age, age)
+            return MailboxFrame(seq=seq, frame=frame, captured_at=captured_at, age=age, dropped=dropped)
+
+    def is_valid(self, frame: MailboxFrame) -> bool:
+        """If the view in `frame` has not been overwritten by a newer frame. Check it after reading the view"""
+        return self.ring.is_valid(frame.seq)
+
+    def clear(self):
+        """Discards the current frame and pending frame notifications, messages are kept. Called by the analyzer"""
+        while True:
+            try:
+                self._notifications.get_nowait()
+            except queue.Empty:
+                break
+        self.last_seq = self.ring.latest_seq
+
+    def report(self) -> str:
+        mean_age = self.total_age / self.frames if self.frames else 0.0
+        return (f"{self.name} frames: {self.frames} taken, {self.dropped} dropped, "
+                f"age {mean_age * 1000:.1f}ms mean {self.max_age * 1000:.1f}ms max")
+
+    def unlink(self):
+        self.ring.unlink()
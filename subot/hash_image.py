@@ -1,13 +1,17 @@
+import hashlib
+import threading
 import time
 from pathlib import Path
 import cv2
 from collections import UserDict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import numpy as np
 from typing import NewType, Optional
 from numpy.typing import ArrayLike
 
-from subot.models import SpriteType
+from subot.hash_index import HammingIndex
+from subot.lru import LRUCache
+from subot.enums import SpriteType
 
 
 @dataclass(frozen=True)
@@ -15,6 +19,66 @@ class ImageInfo:
     short_name: str
     long_name: str
     sprite_type: SpriteType
+    # database id of the sprite, None for sprites which do not come from the database
+    sprite_id: Optional[int] = field(default=None, compare=False)
+
+
+# one ImageInfo per sprite shared by every table, tables only hold references to them
+_interned_image_infos: dict[int, ImageInfo] = {}
+_interned_image_infos_lock = threading.Lock()
+
+
+def intern_image_info(sprite_id: int, short_name: str, long_name: str, sprite_type: SpriteType) -> ImageInfo:
+    """The shared `ImageInfo` of a database sprite"""
+    with _interned_image_infos_lock:
+        try:
+            return _interned_image_infos[sprite_id]
+        except KeyError:
+            img_info = ImageInfo(short_name=short_name, long_name=long_name, sprite_type=sprite_type,
+                                 sprite_id=sprite_id)
+            _interned_image_infos[sprite_id] = img_info
+            return img_info
+
+
+def interned_image_info_count() -> int:
+    return len(_interned_image_infos)
+
+
+def interned_image_infos() -> list[ImageInfo]:
+    """Every database sprite's shared `ImageInfo` handed out so far"""
+    with _interned_image_infos_lock:
+        return list(_interned_image_infos.values())
+
+
+IMAGE_CACHE_BUDGET_BYTES = 256 * 1024 * 1024
+# decoded sprite images by (path, gray). Bounded, tools going over every sprite frame would otherwise keep every image
+image_cache: LRUCache[tuple[str, bool], Optional[np.ndarray]] = LRUCache(
+    max_size=IMAGE_CACHE_BUDGET_BYTES, size_of=lambda img: img.nbytes if img is not None else 0)
+_image_cache_lock = threading.Lock()
+
+
+def _read_cached(filepath: str, gray: bool) -> Optional[np.ndarray]:
+    with _image_cache_lock:
+        try:
+            return image_cache[(filepath, gray)]
+        except KeyError:
+            pass
+    if gray:
+        img = cv2.cvtColor(_read_cached(filepath, gray=False), cv2.COLOR_BGRA2GRAY)
+    else:
+        img = cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
+    with _image_cache_lock:
+        image_cache[(filepath, gray)] = img
+    return img
+
+
+def read_data_color(filepath: str) -> ArrayLike:
+    """:return: None if the image can't be read"""
+    return _read_cached(filepath, gray=False)
+
+
+def read_data_gray(filepath: str) -> ArrayLike:
+    return _read_cached(filepath, gray=True)
 
 
 def img_float32(img):
@@ -121,25 +185,54 @@ class FloorTilesInfo:
 
 hasher = cv2.img_hash.PHash_create()
 
+TILE_SIZE = 32
 
-def compute_phash(floor_tile: np.typing.ArrayLike, img_bgra, overlay: Optional[Overlay]) -> int:
+# pHash only keeps the top-left 8x8 DCT coefficients, so only the first 8 rows of the
+# orthonormal DCT-II basis OpenCV uses are needed
+_PHASH_DCT_SIZE = 8
+_dct_freq = np.arange(_PHASH_DCT_SIZE, dtype=np.float64)[:, np.newaxis]
+_dct_pos = np.arange(TILE_SIZE, dtype=np.float64)
+PHASH_DCT_BASIS = np.sqrt(2 / TILE_SIZE) * np.cos(np.pi * (2 * _dct_pos + 1) * _dct_freq / (2 * TILE_SIZE))
+PHASH_DCT_BASIS[0] /= np.sqrt(2)
+
+# OpenCV computes the DCT in float32 and differs from the float64 version by ~5e-4.
+# Coefficients closer than this to the mean could land on either side of it, so those tiles are
+# rehashed with OpenCV to stay bit-identical with the stored hashes
+PHASH_TIE_TOLERANCE = 1e-2
+
+
+def compose_tile_gray(floor_tile: np.typing.ArrayLike, img_bgra, overlay: Optional[Overlay]) -> np.ndarray:
+    """Grayscale tile of the sprite drawn on top of the floor tile, the way the game renders it"""
     if img_bgra.shape != (32, 32, 4):
         raise ValueError(f"image to hash is not one tile worth (32,32,4) !={img_bgra.shape=}")
 
     pasted_img_color = overlay_transparent(background_img=floor_tile, img_to_overlay_t=img_bgra)
-    pasted_img_gray = cv2.cvtColor(pasted_img_color, cv2.COLOR_BGR2GRAY)
 
     # blend overlay image on top of bg tile + fg sprite
     if overlay:
         overlay_tile = overlay.tile
         alpha = overlay.alpha
         pasted_img_color = cv2.addWeighted(pasted_img_color, alpha, overlay_tile, 1 - alpha, 0.0)
-        pasted_img_gray = cv2.cvtColor(pasted_img_color, cv2.COLOR_BGR2GRAY)
 
-    img_hash = hasher.compute(pasted_img_gray)
+    return cv2.cvtColor(pasted_img_color, cv2.COLOR_BGR2GRAY)
+
+
+def compute_phash(floor_tile: np.typing.ArrayLike, img_bgra, overlay: Optional[Overlay]) -> int:
+    return compute_hash(compose_tile_gray(floor_tile, img_bgra, overlay))
+
+
+def compute_digest(img_gray: np.ndarray) -> int:
+    """Exact 64 bit fingerprint of a tile's grayscale pixels. Signed to fit in a SQLite INTEGER"""
+    digest = hashlib.blake2b(np.ascontiguousarray(img_gray).data, digest_size=8).digest()
+    return int.from_bytes(digest, byteorder='big', signed=True)
 
-    # convert to int
-    return int.from_bytes(img_hash, byteorder='big', signed=True)
+
+def compute_digests(tiles_gray: np.ndarray) -> np.ndarray:
+    """`compute_digest` of each of (..., 32, 32) grayscale tiles, a flat int64 array
+    BLAKE2b has no batch form, but digesting the rows of one contiguous copy skips a copy per tile
+    """
+    tiles = np.ascontiguousarray(tiles_gray, dtype=np.uint8).reshape(-1, TILE_SIZE * TILE_SIZE)
+    return np.fromiter((compute_digest(tile) for tile in tiles), dtype=np.int64, count=len(tiles))
 
 
 def compute_hash(img_gray: ArrayLike) -> int:
@@ -148,6 +241,60 @@ def compute_hash(img_gray: ArrayLike) -> int:
     return hash_int
 
 
+def tile_grid_view(img_gray: np.ndarray, tile_size: int = TILE_SIZE) -> np.ndarray:
+    """View of a grayscale image as a (rows, cols, tile_size, tile_size) grid of tiles. No pixels are copied.
+    Partial tiles on the right and bottom edges are dropped.
+    """
+    rows = img_gray.shape[0] // tile_size
+    cols = img_gray.shape[1] // tile_size
+    row_stride, col_stride = img_gray.strides
+    return np.lib.stride_tricks.as_strided(
+        img_gray,
+        shape=(rows, cols, tile_size, tile_size),
+        strides=(row_stride * tile_size, col_stride * tile_size, row_stride, col_stride),
+        writeable=False,
+    )
+
+
+def compute_hashes(tiles_gray: np.ndarray) -> np.ndarray:
+    """pHash every 32x32 grayscale tile in one pass.
+
+    :param tiles_gray: uint8 array of shape (..., 32, 32). Usually a view from `tile_grid_view`
+    :return: int64 array of shape tiles_gray.shape[:-2]. Each value equals `compute_hash` of that tile
+    """
+    if tiles_gray.shape[-2:] != (TILE_SIZE, TILE_SIZE):
+        raise ValueError(f"tiles to hash are not (..., 32, 32) {tiles_gray.shape=}")
+
+    batch_shape = tiles_gray.shape[:-2]
+    tiles = tiles_gray.reshape(-1, TILE_SIZE, TILE_SIZE)
+
+    coefficients = PHASH_DCT_BASIS @ tiles.astype(np.float64) @ PHASH_DCT_BASIS.T
+    coefficients[:, 0, 0] = 0
+    from_mean = coefficients - coefficients.mean(axis=(1, 2), keepdims=True)
+
+    # byte j of the hash is row j of the coefficients, column k is bit k
+    hash_bytes = np.packbits(from_mean > 0, axis=2, bitorder='little').reshape(-1, _PHASH_DCT_SIZE)
+    hashes = hash_bytes.view('>i8').reshape(-1).astype(np.int64)
+
+    for idx in np.flatnonzero((np.abs(from_mean) < PHASH_TIE_TOLERANCE).any(axis=(1, 2))):
+        hashes[idx] = compute_hash(tiles[idx])
+
+    return hashes.reshape(batch_shape)
+
+
+SIGNATURE_BLOCK = 4
+SIGNATURE_SIZE = (TILE_SIZE // SIGNATURE_BLOCK) ** 2
+
+
+def compute_signatures(tiles_gray: np.ndarray) -> np.ndarray:
+    """Mean of each 4x4 block of (..., 32, 32) grayscale tiles, an (n, 64) uint8 array
+    Tells apart the sprites whose tiles share a pHash
+    """
+    blocks = TILE_SIZE // SIGNATURE_BLOCK
+    tiles = np.asarray(tiles_gray, dtype=np.float64).reshape(-1, blocks, SIGNATURE_BLOCK, blocks, SIGNATURE_BLOCK)
+    return tiles.mean(axis=(2, 4)).round().astype(np.uint8).reshape(-1, SIGNATURE_SIZE)
+
+
 class RealmSpriteHasher(UserDict):
     """Stores castle decorations for exact matching
     On get and set it will set any pixels that match the castle tile to 0.
@@ -155,12 +302,21 @@ class RealmSpriteHasher(UserDict):
     the pixel value in a position
     """
 
-    def __init__(self, val=None, floor_tiles: Optional[FloorTilesInfo]=None):
-        """:param floor_tiles: numpy array of grayscale image of the current castle tile"""
+    def __init__(self, val=None, floor_tiles: Optional[FloorTilesInfo]=None, max_distance: int = 0):
+        """:param floor_tiles: numpy array of grayscale image of the current castle tile
+        :param max_distance: max Hamming distance a hash can be from a stored hash to still be matched to it
+        """
         if val is None:
             val = {}
         self.floor_info = floor_tiles
         self.similar_hashes = 0
+        self.max_distance = max_distance
+        # exact digests of every sprite frame drawn on the floor tiles. Checked before hashing (see `compute_digest`)
+        self.digests: dict[int, ImageInfo] = {}
+        # hashes shared by the tiles of several sprites, with each sprite's signature (see `compute_signatures`).
+        # A tile matching one goes to the sprite with the closest signature
+        self.collisions: dict[int, list[tuple[np.ndarray, ImageInfo]]] = {}
+        self._nearest_index: Optional[HammingIndex] = None
         super().__init__(val)
 
     def insert_transparent_bgra_image(self, img_bgra: np.typing.ArrayLike, img_info: ImageInfo) -> Optional[list[int]]:
@@ -181,9 +337,301 @@ class RealmSpriteHasher(UserDict):
         :param img_gray The unaltered grayscale image that hasn't had same pixels stripped
         according to `self.castle_tile_gray`
         """
-        img_hash = hasher.compute(img_gray)
-        hash_int = int.from_bytes(img_hash, byteorder='big', signed=True)
-        return self.data[hash_int]
+        return self.get_phash(compute_hash(img_gray))
+
+    def get_many_greyscale(self, tiles_gray: np.ndarray, digests: Optional[np.ndarray] = None) \
+            -> list[Optional[ImageInfo]]:
+        """Lookup a batch of (..., 32, 32) grayscale tiles
+        Tiles whose exact pixels are known skip pHashing, the rest are hashed together
+        :param digests: `compute_digests` of the tiles if the caller has them already
+        """
+        return self.match_many_greyscale(tiles_gray, digests)[0]
+
+    def match_many_greyscale(self, tiles_gray: np.ndarray, digests: Optional[np.ndarray] = None) \
+            -> tuple[list[Optional[ImageInfo]], np.ndarray]:
+        """`get_many_greyscale`, also telling which tiles matched exactly
+        :return: the matches and whether each tile matched by its digest or by a stored hash, not a near one
+        """
+        tiles = tiles_gray.reshape(-1, TILE_SIZE, TILE_SIZE)
+        if digests is None:
+            digests = compute_digests(tiles)
+        found: list[Optional[ImageInfo]] = [self.digests.get(digest) for digest in digests.tolist()]
+        exact = np.array([img_info is not None for img_info in found], dtype=bool)
+
+        missing = np.flatnonzero(~exact)
+        if not len(missing):
+            return found, exact
+        phashes = compute_hashes(tiles[missing])
+        matched_hashes = self._matched_hashes(phashes)
+        for idx, phash, matched_hash in zip(missing.tolist(), phashes.tolist(), matched_hashes):
+            found[idx] = self.data[matched_hash] if matched_hash is not None else None
+            exact[idx] = phash == matched_hash
+        self._resolve_collisions(tiles, missing.tolist(), matched_hashes, found)
+        return found, exact
+
+    def _resolve_collisions(self, tiles: np.ndarray, tile_ids: list[int], matched_hashes: list[Optional[int]],
+                            found: list[Optional[ImageInfo]]):
+        """Tiles which matched a hash shared by several sprites go to the sprite with the closest signature"""
+        colliding = [(tile_idx, matched_hash) for tile_idx, matched_hash in zip(tile_ids, matched_hashes)
+                     if matched_hash in self.collisions]
+        if not colliding:
+            return
+        signatures = compute_signatures(tiles[[tile_idx for tile_idx, _ in colliding]]).astype(np.int16)
+        for (tile_idx, matched_hash), signature in zip(colliding, signatures):
+            candidates = self.collisions[matched_hash]
+            distances = [int(np.abs(candidate.astype(np.int16) - signature).sum()) for candidate, _ in candidates]
+            found[tile_idx] = candidates[int(np.argmin(distances))][1]
+
+    def _matched_hashes(self, phashes: np.ndarray) -> list[Optional[int]]:
+        """The stored hash each hash matched, None without a match within `self.max_distance`"""
+        matched: list[Optional[int]] = [phash if phash in self.data else None for phash in phashes.reshape(-1).tolist()]
+        if not self.max_distance:
+            return matched
+
+        missing = [idx for idx, matched_hash in enumerate(matched) if matched_hash is None]
+        if not missing:
+            return matched
+        index = self._hamming_index()
+        nearest = index.query(phashes.reshape(-1)[missing])
+        for idx, nearest_idx in zip(missing, nearest.tolist()):
+            if nearest_idx >= 0:
+                matched[idx] = int(index.hashes[nearest_idx])
+        return matched
+
+    def get_phash(self, phash: int) -> ImageInfo:
+        """Lookup an already computed hash (see `compute_hashes`)
+        Falls back to the nearest hash within `self.max_distance`
+        """
+        try:
+            return self.data[int(phash)]
+        except KeyError:
+            if not self.max_distance:
+                raise
+        img_info = self.get_many(np.asarray([phash], dtype=np.int64))[0]
+        if img_info is None:
+            raise KeyError(phash)
+        return img_info
+
+    def get_many(self, phashes: np.ndarray) -> list[Optional[ImageInfo]]:
+        """Lookup a batch of hashes. None for any hash without a match within `self.max_distance`"""
+        return [self.data[matched_hash] if matched_hash is not None else None
+                for matched_hash in self._matched_hashes(phashes)]
+
+    def _hamming_index(self) -> HammingIndex:
+        # hashes are inserted one at a time while a realm loads, so (re)build on first use after a change
+        if self._nearest_index is None or len(self._nearest_index) != len(self.data):
+            self._nearest_index = HammingIndex(np.fromiter(self.data.keys(), dtype=np.int64, count=len(self.data)),
+                                               self.max_distance)
+        return self._nearest_index
+
+
+class BackgroundModel:
+    """Floor and wall tiles of the current realm, which are most of any screen
+
+    Each realm only has a handful of them, so a whole batch of tiles is compared exactly against all of them at once.
+    A few sampled pixels rule out most pairs before the full comparison.
+    """
+    SPRITE_TYPES = {SpriteType.FLOOR, SpriteType.WALL}
+    MAX_FRAMES = 64
+    SAMPLE_POINTS = 16
+
+    def __init__(self):
+        self.frames: np.ndarray = np.empty((0, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+        self.infos: list[ImageInfo] = []
+        sample_rng = np.random.default_rng(0)
+        self._sample_ys = sample_rng.integers(0, TILE_SIZE, self.SAMPLE_POINTS)
+        self._sample_xs = sample_rng.integers(0, TILE_SIZE, self.SAMPLE_POINTS)
+        self._frame_samples: np.ndarray = self.frames[:, self._sample_ys, self._sample_xs]
+
+    def __len__(self) -> int:
+        return len(self.infos)
+
+    def add(self, tile_gray: np.ndarray, img_info: ImageInfo) -> bool:
+        """Add a floor or wall tile's exact pixels
+        :return: whether it was added. Not if it is already known, the wrong size or the model is full
+        """
+        if tile_gray.shape != (TILE_SIZE, TILE_SIZE) or len(self) >= self.MAX_FRAMES:
+            return False
+        if (self.match(tile_gray[np.newaxis]) >= 0).any():
+            return False
+        self.frames = np.concatenate([self.frames, tile_gray[np.newaxis].astype(np.uint8)])
+        self._frame_samples = self.frames[:, self._sample_ys, self._sample_xs]
+        self.infos.append(img_info)
+        return True
+
+    def match(self, tiles_gray: np.ndarray) -> np.ndarray:
+        """:param tiles_gray: (N, 32, 32) grayscale tiles
+        :return: index into `self.infos` of each tile, -1 if the tile is not a known background
+        """
+        matched = np.full(len(tiles_gray), -1, dtype=np.int64)
+        if not len(self) or not len(tiles_gray):
+            return matched
+
+        samples = tiles_gray[:, self._sample_ys, self._sample_xs]
+        tile_ids, frame_ids = np.nonzero((samples[:, np.newaxis] == self._frame_samples[np.newaxis]).all(axis=2))
+        exact = (tiles_gray[tile_ids] == self.frames[frame_ids]).all(axis=(1, 2))
+        matched[tile_ids[exact]] = frame_ids[exact]
+        return matched
+
+
+class SortedSpriteHasher:
+    """Read only alternative to `RealmSpriteHasher` for a realm's hashes which are all loaded at once
+
+    Hashes are a sorted int64 array with a parallel int32 index into `sprites`, so a whole frame is looked up with one
+    `np.searchsorted`. There is no python int and dict entry per hash, making it quicker to build and smaller.
+    """
+
+    def __init__(self, hashes: ArrayLike, sprite_indices: ArrayLike, sprites: list[ImageInfo],
+                 digests: ArrayLike = (), digest_sprite_indices: ArrayLike = (), max_distance: int = 0,
+                 presorted: bool = False, collision_hashes: ArrayLike = (), collision_sprite_indices: ArrayLike = (),
+                 collision_signatures: ArrayLike = ()):
+        """:param sprite_indices: index into `sprites` of each hash in `hashes`
+        :param digests: exact digests of the composed tiles (see `compute_digest`). Checked before hashing
+        :param collision_hashes: hashes shared by the tiles of several sprites, once per sprite. A tile matching one
+        of them goes to the sprite with the closest signature (see `compute_signatures`) in `collision_signatures`
+        :param max_distance: max Hamming distance a hash can be from a stored hash to still be matched to it
+        :param presorted: hashes and digests are already sorted, use the arrays as is. Keeps memory mapped arrays
+        mapped instead of copying them
+        """
+        self.sprites = sprites
+        self.max_distance = max_distance
+        if presorted:
+            self.hashes, self.sprite_indices = hashes, sprite_indices
+            self.digests, self.digest_sprite_indices = digests, digest_sprite_indices
+        else:
+            self.hashes, self.sprite_indices = self._sort(hashes, sprite_indices)
+            self.digests, self.digest_sprite_indices = self._sort(digests, digest_sprite_indices)
+        self.collision_hashes = np.asarray(collision_hashes, dtype=np.int64)
+        self.collision_sprite_indices = np.asarray(collision_sprite_indices, dtype=np.int32)
+        self.collision_signatures = np.asarray(collision_signatures, dtype=np.uint8).reshape(-1, SIGNATURE_SIZE)
+        if not presorted:
+            order = np.argsort(self.collision_hashes, kind="stable")
+            self.collision_hashes = self.collision_hashes[order]
+            self.collision_sprite_indices = self.collision_sprite_indices[order]
+            self.collision_signatures = self.collision_signatures[order]
+        self._nearest_index: Optional[HammingIndex] = None
+
+    @staticmethod
+    def _sort(keys: ArrayLike, sprite_indices: ArrayLike) -> tuple[np.ndarray, np.ndarray]:
+        keys = np.asarray(keys, dtype=np.int64)
+        sprite_indices = np.asarray(sprite_indices, dtype=np.int32)
+        order = np.argsort(keys, kind="stable")
+        return keys[order], sprite_indices[order]
+
+    @staticmethod
+    def _search(keys: np.ndarray, sprite_indices: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """Sprite index stored for each query, -1 if it is not stored"""
+        if not len(keys):
+            return np.full(len(queries), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(keys, queries), len(keys) - 1)
+        return np.where(keys[positions] == queries, sprite_indices[positions], -1).astype(np.int32)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the table's arrays"""
+        arrays = [self.hashes, self.sprite_indices, self.digests, self.digest_sprite_indices, self.collision_hashes,
+                  self.collision_sprite_indices, self.collision_signatures]
+        index_nbytes = self._nearest_index.nbytes if self._nearest_index is not None else 0
+        return sum(array.nbytes for array in arrays) + index_nbytes
+
+    def build_index(self):
+        """Builds the index of near matches now instead of on the first lookup, so `nbytes` includes it"""
+        if self.max_distance:
+            self._hamming_index()
+
+    def _to_infos(self, sprite_indices: np.ndarray) -> list[Optional[ImageInfo]]:
+        return [self.sprites[idx] if idx >= 0 else None for idx in sprite_indices.tolist()]
+
+    def _match_positions(self, phashes: np.ndarray) -> np.ndarray:
+        """Position in `self.hashes` of the hash each hash matched, -1 without a match within `self.max_distance`"""
+        phashes = np.asarray(phashes, dtype=np.int64).reshape(-1)
+        positions = self._search(self.hashes, np.arange(len(self.hashes), dtype=np.int32), phashes)
+        if not self.max_distance:
+            return positions
+
+        missing = np.flatnonzero(positions < 0)
+        if len(missing):
+            positions[missing] = self._hamming_index().query(phashes[missing])
+        return positions
+
+    def get_sprite_indices(self, phashes: np.ndarray) -> np.ndarray:
+        """Index into `self.sprites` of each hash, -1 without a match within `self.max_distance`"""
+        return self._sprite_indices_at(self._match_positions(phashes))
+
+    def _sprite_indices_at(self, positions: np.ndarray) -> np.ndarray:
+        """Sprite index of the hash at each position in `self.hashes`, -1 for -1"""
+        sprite_indices = np.full(len(positions), -1, dtype=np.int32)
+        matched = positions >= 0
+        sprite_indices[matched] = self.sprite_indices[positions[matched]]
+        return sprite_indices
+
+    def _resolve_collisions(self, tiles: np.ndarray, positions: np.ndarray, sprite_indices: np.ndarray):
+        """Tiles which matched a hash shared by several sprites go to the sprite with the closest signature"""
+        if not len(self.collision_hashes):
+            return
+        matched = np.flatnonzero(positions >= 0)
+        matched_hashes = self.hashes[positions[matched]]
+        starts = np.searchsorted(self.collision_hashes, matched_hashes, side="left")
+        ends = np.searchsorted(self.collision_hashes, matched_hashes, side="right")
+        colliding = np.flatnonzero(ends > starts)
+        if not len(colliding):
+            return
+
+        signatures = compute_signatures(tiles[matched[colliding]]).astype(np.int16)
+        for tile_idx, signature, start, end in zip(matched[colliding], signatures, starts[colliding], ends[colliding]):
+            distances = np.abs(self.collision_signatures[start:end].astype(np.int16) - signature).sum(axis=1)
+            sprite_indices[tile_idx] = self.collision_sprite_indices[start + np.argmin(distances)]
+
+    def get_greyscale(self, img_gray: ArrayLike) -> ImageInfo:
+        return self.get_phash(compute_hash(img_gray))
+
+    def get_phash(self, phash: int) -> ImageInfo:
+        img_info = self.get_many(np.asarray([phash], dtype=np.int64))[0]
+        if img_info is None:
+            raise KeyError(phash)
+        return img_info
+
+    def get_many(self, phashes: np.ndarray) -> list[Optional[ImageInfo]]:
+        """Lookup a batch of hashes. None for any hash without a match within `self.max_distance`"""
+        return self._to_infos(self.get_sprite_indices(phashes))
+
+    def get_many_greyscale(self, tiles_gray: np.ndarray, digests: Optional[np.ndarray] = None) \
+            -> list[Optional[ImageInfo]]:
+        """Lookup a batch of (..., 32, 32) grayscale tiles
+        Tiles whose exact pixels are known skip pHashing, the rest are hashed together. Tiles whose hash is shared by
+        several sprites are told apart by their signatures
+        :param digests: `compute_digests` of the tiles if the caller has them already
+        """
+        return self.match_many_greyscale(tiles_gray, digests)[0]
+
+    def match_many_greyscale(self, tiles_gray: np.ndarray, digests: Optional[np.ndarray] = None) \
+            -> tuple[list[Optional[ImageInfo]], np.ndarray]:
+        """`get_many_greyscale`, also telling which tiles matched exactly
+        :return: the matches and whether each tile matched by its digest or by a stored hash, not a near one
+        """
+        tiles = tiles_gray.reshape(-1, TILE_SIZE, TILE_SIZE)
+        if digests is None:
+            digests = compute_digests(tiles)
+        sprite_indices = self._search(self.digests, self.digest_sprite_indices, np.asarray(digests, dtype=np.int64))
+        exact = sprite_indices >= 0
+
+        missing = np.flatnonzero(~exact)
+        if len(missing):
+            phashes = compute_hashes(tiles[missing])
+            positions = self._match_positions(phashes)
+            hashed_sprite_indices = self._sprite_indices_at(positions)
+            self._resolve_collisions(tiles[missing], positions, hashed_sprite_indices)
+            sprite_indices[missing] = hashed_sprite_indices
+            exact[missing] = (positions >= 0) & (self.hashes[np.maximum(positions, 0)] == phashes)
+        return self._to_infos(sprite_indices), exact
+
+    def _hamming_index(self) -> HammingIndex:
+        if self._nearest_index is None:
+            self._nearest_index = HammingIndex(self.hashes, self.max_distance)
+        return self._nearest_index
 
 
 if __name__ == "__main__":
@@ -0,0 +1,112 @@
+import itertools
+
+import numpy as np
+
+# number of set bits in every possible byte
+_POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Number of set bits of each 64 bit integer"""
+    values = np.ascontiguousarray(values, dtype=np.int64)
+    return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(*values.shape, 8).sum(axis=-1, dtype=np.int64)
+
+
+class HammingIndex:
+    """Finds the nearest stored pHash within a maximum Hamming distance
+
+    Uses multi-index hashing. Each 64 bit hash is split into 4 16 bit chunks, by the pigeonhole principle two hashes
+    within distance d share at least one chunk that is within distance d // 4.
+    Each chunk position is kept sorted with the start of every chunk value's bucket, so candidates for a whole batch
+    of queries are found by indexing instead of comparing against every stored hash.
+    """
+    CHUNKS = 4
+    CHUNK_BITS = 16
+    # Enumerating chunk neighbours beyond 1 bit flip generates more candidates than it saves
+    MAX_DISTANCE = 2 * CHUNKS - 1
+
+    def __init__(self, hashes: np.ndarray, max_distance: int):
+        if not 0 <= max_distance <= self.MAX_DISTANCE:
+            raise ValueError(f"max hamming distance must be in [0, {self.MAX_DISTANCE}] {max_distance=}")
+        self.max_distance = max_distance
+        self.hashes: np.ndarray = np.ascontiguousarray(hashes, dtype=np.int64)
+        # memory mapped or already int64 hashes are used as is
+        self._copied_hashes = not np.may_share_memory(self.hashes, hashes)
+
+        chunks = self._split_chunks(self.hashes)
+        # one sorted run per chunk position, stored back to back
+        self._order = np.argsort(chunks, axis=1, kind="stable")
+        sorted_chunks = np.take_along_axis(chunks, self._order, axis=1)
+        # chunks are small enough to keep where every possible chunk value starts in its sorted run
+        # so finding a bucket is an index instead of a binary search
+        all_chunk_values = np.arange((1 << self.CHUNK_BITS) + 1)
+        self._bucket_starts = np.stack([
+            np.searchsorted(sorted_chunk, all_chunk_values, side="left") + chunk * len(self.hashes)
+            for chunk, sorted_chunk in enumerate(sorted_chunks)
+        ])
+
+        # every chunk value within `chunk_flips` bits of the query's chunk
+        chunk_flips = max_distance // self.CHUNKS
+        self._chunk_masks = np.array([sum(1 << bit for bit in bits)
+                                      for flips in range(chunk_flips + 1)
+                                      for bits in itertools.combinations(range(self.CHUNK_BITS), flips)],
+                                     dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the index, the hashes only count if they had to be copied"""
+        hashes_nbytes = self.hashes.nbytes if self._copied_hashes else 0
+        return self._order.nbytes + self._bucket_starts.nbytes + self._chunk_masks.nbytes + hashes_nbytes
+
+    @classmethod
+    def estimate_nbytes(cls, count: int) -> int:
+        """Most bytes an index of `count` hashes uses"""
+        itemsize = np.dtype(np.int64).itemsize
+        return (cls.CHUNKS * count + cls.CHUNKS * ((1 << cls.CHUNK_BITS) + 1) + count) * itemsize
+
+    @classmethod
+    def _split_chunks(cls, hashes: np.ndarray) -> np.ndarray:
+        unsigned = hashes.view(np.uint64)
+        mask = np.uint64((1 << cls.CHUNK_BITS) - 1)
+        return np.stack([((unsigned >> np.uint64(cls.CHUNK_BITS * chunk)) & mask).astype(np.int64)
+                         for chunk in range(cls.CHUNKS)])
+
+    def query(self, hashes: np.ndarray) -> np.ndarray:
+        """Index into `self.hashes` of the nearest stored hash for each query hash
+
+        :return: int64 array with the same shape as `hashes`. -1 if nothing is within `self.max_distance`
+        """
+        queries = np.ascontiguousarray(hashes, dtype=np.int64).reshape(-1)
+        nearest = np.full(len(queries), -1, dtype=np.int64)
+        if len(queries) == 0 or len(self.hashes) == 0:
+            return nearest.reshape(np.shape(hashes))
+
+        # (chunk, query, chunk variant)
+        variants = self._split_chunks(queries)[:, :, np.newaxis] ^ self._chunk_masks
+        chunk_rows = np.arange(self.CHUNKS)[:, np.newaxis, np.newaxis]
+        starts = self._bucket_starts[chunk_rows, variants]
+        ends = self._bucket_starts[chunk_rows, variants + 1]
+
+        # flatten all candidate ranges into one array of (query, stored hash) pairs
+        lengths = (ends - starts).reshape(-1)
+        total = int(lengths.sum())
+        if total == 0:
+            return nearest.reshape(np.shape(hashes))
+        query_ids = np.broadcast_to(np.arange(len(queries))[np.newaxis, :, np.newaxis], variants.shape)
+        owners = np.repeat(query_ids.reshape(-1), lengths)
+        range_starts = np.repeat(starts.reshape(-1), lengths)
+        within_range = np.arange(total) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        candidates = self._order.reshape(-1)[range_starts + within_range]
+
+        distances = popcount64(self.hashes[candidates] ^ queries[owners])
+        close_enough = distances <= self.max_distance
+        owners, candidates, distances = owners[close_enough], candidates[close_enough], distances[close_enough]
+
+        # nearest candidate per query, ties go to the lowest index
+        by_distance = np.lexsort((candidates, distances, owners))
+        matched_queries, first = np.unique(owners[by_distance], return_index=True)
+        nearest[matched_queries] = candidates[by_distance[first]]
+        return nearest.reshape(np.shape(hashes))
@@ -0,0 +1,278 @@
+"""Sprite hashes of each realm and the castle, exported from the database as numpy files
+
+A pack is the sorted arrays of a `SortedSpriteHasher` saved as .npy files plus a JSON table of the sprites they index.
+The JSON also has a stamp of the database the pack was exported from, a pack of another database is not used.
+Packs are memory mapped when loaded, so switching realms does not query the database or copy the hashes,
+and the pages are shared between processes.
+"""
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from threading import Thread
+from typing import Optional
+
+import numpy as np
+
+from subot.enums import Realm, SpriteType
+from subot.hash_image import ImageInfo, SortedSpriteHasher, BackgroundModel, intern_image_info
+from subot.hash_index import HammingIndex
+from subot.lru import LRUCache
+import subot.settings as settings
+from subot.settings import HASH_PACK_PATH, config_file_path
+
+root = logging.getLogger()
+
+CASTLE_PACK_NAME = "castle"
+PACK_ARRAYS = ("hashes", "sprite_indices", "digests", "digest_sprite_indices", "collision_hashes",
+               "collision_sprite_indices", "collision_signatures")
+
+
+def pack_name(realm: Optional[Realm]) -> str:
+    """:param realm: None for the castle"""
+    return realm.name if realm else CASTLE_PACK_NAME
+
+
+def _array_path(directory: Path, name: str, array_name: str) -> Path:
+    return directory.joinpath(f"{name}.{array_name}.npy")
+
+
+def _sprites_path(directory: Path, name: str) -> Path:
+    return directory.joinpath(f"{name}.sprites.json")
+
+
+def database_stamp() -> Optional[str]:
+    """Size and modification time of the asset database, stored in what is exported from it
+    Only the file's metadata is read, so checking an export costs nothing at startup
+    :return: None if there is no database
+    """
+    try:
+        stat = settings.sqlite_path.stat()
+    except FileNotFoundError:
+        return None
+    # whole seconds, some file systems and archives keep nothing finer
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def matches_database(exported_from: Optional[str]) -> bool:
+    """If data exported from the database with stamp `exported_from` is up to date with the database
+    Without a database the exported data is all there is, so it is used as is
+    """
+    current = database_stamp()
+    return current is None or exported_from == current
+
+
+def save_pack(hasher: SortedSpriteHasher, name: str, directory: Path = HASH_PACK_PATH):
+    directory.mkdir(parents=True, exist_ok=True)
+    for array_name in PACK_ARRAYS:
+        np.save(_array_path(directory, name, array_name), np.ascontiguousarray(getattr(hasher, array_name)))
+    sprites = [[sprite.short_name, sprite.long_name, sprite.sprite_type.name, sprite.sprite_id]
+               for sprite in hasher.sprites]
+    with open(_sprites_path(directory, name), "w", encoding="utf8") as f:
+        json.dump({"database": database_stamp(), "sprites": sprites}, f)
+
+
+def load_pack(name: str, max_distance: int = 0, directory: Path = HASH_PACK_PATH) -> Optional[SortedSpriteHasher]:
+    """:return: None if there is no exported pack with the name, or it was exported from another database"""
+    sprites_path = _sprites_path(directory, name)
+    if not sprites_path.exists():
+        return None
+    if not all(_array_path(directory, name, array_name).exists() for array_name in PACK_ARRAYS):
+        root.warning(f"hash pack {name} is missing arrays, it was exported by an older version")
+        return None
+
+    with open(sprites_path, encoding="utf8") as f:
+        pack = json.load(f)
+    if not isinstance(pack, dict):
+        root.warning(f"hash pack {name} was exported by an older version")
+        return None
+    if not matches_database(pack["database"]):
+        root.warning(f"hash pack {name} was exported from another version of the database, reading the database")
+        return None
+    sprites = [intern_image_info(sprite_id, short_name, long_name, SpriteType[sprite_type])
+               if sprite_id is not None else
+               ImageInfo(short_name=short_name, long_name=long_name, sprite_type=SpriteType[sprite_type])
+               for short_name, long_name, sprite_type, sprite_id in pack["sprites"]]
+    arrays = {array_name: np.load(_array_path(directory, name, array_name), mmap_mode='r')
+              for array_name in PACK_ARRAYS}
+    return SortedSpriteHasher(sprites=sprites, max_distance=max_distance, presorted=True, **arrays)
+
+
+def pack_nbytes(name: str, max_distance: int = 0, directory: Path = HASH_PACK_PATH) -> Optional[int]:
+    """Bytes the table of a pack uses once loaded, including its index of near matches. Only the headers are read
+    :return: None if there is no complete pack with the name
+    """
+    nbytes = 0
+    hash_count = 0
+    for array_name in PACK_ARRAYS:
+        path = _array_path(directory, name, array_name)
+        if not path.exists():
+            return None
+        with open(path, "rb") as f:
+            if np.lib.format.read_magic(f) == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        nbytes += int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        if array_name == "hashes":
+            hash_count = shape[0]
+    if max_distance:
+        nbytes += HammingIndex.estimate_nbytes(hash_count)
+    return nbytes
+
+
+def recent_realms_path() -> Path:
+    return config_file_path().parent.joinpath("recent_realms.json")
+
+
+class HashTableRegistry(Thread):
+    """Loads the sprite hash table of every realm and the castle in the background
+
+    Tables are loaded most likely first: the castle, then realms by how recently they were entered, then the rest.
+    Preloading stops at the first table which does not fit in the budget, it never drops a table. Asking for a table
+    which is not ready yet loads it right away on the asking thread, dropping the least recently used past the budget.
+    The `BackgroundModel` of each preloaded realm is loaded along with its table.
+    """
+    MAX_RECENT_REALMS = 10
+
+    def __init__(self, max_distance: int = 0, recent_path: Optional[Path] = None, directory: Path = HASH_PACK_PATH,
+                 budget_bytes: Optional[int] = None, **kwargs):
+        """:param recent_path: where realms entered recently are kept between runs. Not kept if None
+        :param directory: where the exported hash packs are
+        :param budget_bytes: memory loaded tables may use, the least recently used are dropped past it. No limit if None
+        """
+        super().__init__(daemon=True, **kwargs)
+        self.max_distance = max_distance
+        self.directory = directory
+        self.recent_path = recent_path
+        self.recent_realms: list[Realm] = self._read_recent_realms()
+
+        self.tables: LRUCache[Optional[Realm], SortedSpriteHasher] = LRUCache(max_size=budget_bytes,
+                                                                             size_of=lambda table: table.nbytes)
+        # seconds each table took to load
+        self.load_seconds: dict[Optional[Realm], float] = {}
+        self._lock = threading.Lock()
+        self._loading: dict[Optional[Realm], threading.Event] = {}
+        self.stop_event = threading.Event()
+        # a preloaded table did not fit in the budget
+        self.preload_full: bool = False
+        # floor and wall tiles of each realm, kept with the tiles learned while playing. At most 64KB each
+        self.background_models: dict[Optional[Realm], BackgroundModel] = {}
+
+    def _read_recent_realms(self) -> list[Realm]:
+        if not self.recent_path or not self.recent_path.exists():
+            return []
+        try:
+            with open(self.recent_path, encoding="utf8") as f:
+                return [Realm[name] for name in json.load(f) if name in Realm.__members__]
+        except (OSError, ValueError) as e:
+            root.warning(f"unable to read recent realms from {self.recent_path}: {e}")
+            return []
+
+    def load_order(self) -> list[Optional[Realm]]:
+        order: list[Optional[Realm]] = [None]
+        order.extend(self.recent_realms)
+        order.extend(realm for realm in Realm if realm not in self.recent_realms)
+        return order
+
+    def is_ready(self, realm: Optional[Realm]) -> bool:
+        return realm in self.tables
+
+    @property
+    def ready_count(self) -> int:
+        return len(self.tables)
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.tables.max_size is None or self.tables.size + nbytes <= self.tables.max_size
+
+    def _load(self, realm: Optional[Realm], preload: bool = False) -> Optional[SortedSpriteHasher]:
+        """Load a table unless it is loaded already
+        :param preload: only keep the table if it fits in the budget without dropping another
+        :return: the table. None if it is being loaded on another thread
+        """
+        with self._lock:
+            if realm in self.tables:
+                return self.tables[realm]
+            if realm in self._loading:
+                return None
+            loaded = self._loading[realm] = threading.Event()
+
+        start = time.time()
+        try:
+            hasher = load_pack(pack_name(realm), max_distance=self.max_distance, directory=self.directory)
+            if hasher is None:
+                # no exported pack, the database and SQLAlchemy are only loaded now
+                from subot.asset_queries import floor_frame_ids, query_sprite_hasher
+                with settings.RuntimeSession() as session:
+                    hasher = query_sprite_hasher(session, floor_frame_ids(session, realm),
+                                                 max_distance=self.max_distance)
+            # so the budget counts the index too
+            hasher.build_index()
+            with self._lock:
+                if preload and not self._fits(hasher.nbytes):
+                    self.preload_full = True
+                    return hasher
+                self.tables[realm] = hasher
+                self.load_seconds[realm] = time.time() - start
+            return hasher
+        finally:
+            with self._lock:
+                del self._loading[realm]
+            loaded.set()
+
+    def get(self, realm: Optional[Realm]) -> SortedSpriteHasher:
+        """Table of a realm, or the castle if `realm` is None. Blocks until it is loaded"""
+        while (table := self._load(realm)) is None:
+            with self._lock:
+                loading = self._loading.get(realm)
+            if loading:
+                loading.wait()
+        self._mark_recent(realm)
+        return table
+
+    def background_model(self, realm: Optional[Realm]) -> BackgroundModel:
+        """Floor and wall tiles of a realm, or the castle if `realm` is None. Loaded now if not preloaded"""
+        with self._lock:
+            background_model = self.background_models.get(realm)
+        if background_model is not None:
+            return background_model
+        # the runtime bundle imports this module
+        from subot.runtime_bundle import load_background_model
+        background_model = load_background_model(realm)
+        with self._lock:
+            return self.background_models.setdefault(realm, background_model)
+
+    def _mark_recent(self, realm: Optional[Realm]):
+        if realm is None or self.recent_realms[:1] == [realm]:
+            return
+        self.recent_realms = ([realm] + [recent for recent in self.recent_realms if recent is not realm]) \
+            [:self.MAX_RECENT_REALMS]
+        if not self.recent_path:
+            return
+        try:
+            with open(self.recent_path, "w", encoding="utf8") as f:
+                json.dump([recent.name for recent in self.recent_realms], f)
+        except OSError as e:
+            root.warning(f"unable to save recent realms to {self.recent_path}: {e}")
+
+    def run(self):
+        start = time.time()
+        for realm in self.load_order():
+            if self.stop_event.is_set():
+                return
+            # loading more would drop tables more likely to be used
+            nbytes = pack_nbytes(pack_name(realm), max_distance=self.max_distance, directory=self.directory)
+            with self._lock:
+                fits = nbytes is None or self._fits(nbytes)
+            if not fits:
+                break
+            try:
+                self._load(realm, preload=True)
+                self.background_model(realm)
+            except Exception as e:
+                root.warning(f"unable to preload hashes of {pack_name(realm)}: {e}")
+            if self.preload_full:
+                break
+        root.info(f"preloaded {self.ready_count} hash tables using {self.tables.size / 1e6:.1f}MB "
+                  f"in {time.time() - start:.1f}s")
@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from typing import Generic, TypeVar, Hashable, Optional, Callable
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """Mapping that holds at most `max_entries` items or `max_size` total size, dropping the least recently used first
+
+    Keeps hit, miss and eviction counts so callers can report how well the cache is doing.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_size: Optional[int] = None,
+                 size_of: Optional[Callable[[V], int]] = None):
+        """:param max_size: budget for the total `size_of` the values. The most recent item is kept even if it is over
+        :param size_of: size of a value, for example its bytes. Every value is 1 if not given
+        """
+        if max_entries is not None and max_entries <= 0:
+            raise ValueError(f"LRU cache must hold at least one entry {max_entries=}")
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size_of: Callable[[V], int] = size_of if size_of else lambda value: 1
+        self.size: int = 0
+        self._data: OrderedDict[K, tuple[V, int]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def __getitem__(self, key: K) -> V:
+        try:
+            value, _ = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key: K, value: V):
+        if key in self._data:
+            self.size -= self._data[key][1]
+        value_size = self.size_of(value)
+        self._data[key] = (value, value_size)
+        self.size += value_size
+        self._data.move_to_end(key)
+        while self._over_budget():
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def _over_budget(self) -> bool:
+        if self.max_entries is not None and len(self._data) > self.max_entries:
+            return True
+        return self.max_size is not None and self.size > self.max_size and len(self._data) > 1
+
+    def clear(self):
+        self._data.clear()
+        self.size = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
@@ -26,7 +26,7 @@ from pynput.keyboard import KeyCode
 import win32process
 from winrt.windows.media.ocr import OcrResult
 
-from subot import models, ocr
+from subot import ocr
 from subot.ui_areas.AnointmentClaimUI import AnointmentClaimUI
 from subot.ui_areas.CodexGeneric import CodexGeneric, CodexSpells
 from subot.ui_areas.CreatureReorderSelectFirst import OCRCreatureRecorderSelectFirst, OCRCreatureRecorderSwapWith
@@ -53,7 +53,7 @@ from subot.trait_info import TraitData
 import cv2
 import numpy as np
 import mss
-from subot.settings import Session, GameControl
+from subot.settings import GameControl, runtime_query_timer
 import subot.settings as settings
 from subot.ocr import detect_title, OCR, LanguageNotInstalledException, detect_title_resized_text
 from subot.ui_areas.ui_ocr_types import OCR_UI_SYSTEMS
@@ -69,21 +69,30 @@ from subot.datatypes import Rect
 from subot.menu import MenuItem, Menu
 from subot.messageTypes import NewFrame, MessageImpl, WindowDim, ScanForItems, \
     Resume, Pause
+from subot.frame_ring import FrameMailbox, MailboxFrame
+from subot.capture import CaptureRateController, FrameChangeFilter, crop_slices, seconds_until_due
 from subot.pathfinder.map import TileType, Map, Color, Movement
 
 from numpy.typing import ArrayLike
 
-from subot.hash_image import ImageInfo, RealmSpriteHasher, compute_hash
+from subot.hash_image import ImageInfo, RealmSpriteHasher, SortedSpriteHasher, BackgroundModel, compute_hash, \
+    tile_grid_view, interned_image_infos, interned_image_info_count
+from subot.tile_classifier import TileResultCache, TileTypeVoter, TileTypeTable, TILE_TYPE_BY_NUM
+from subot.hash_packs import HashTableRegistry, pack_name, recent_realms_path
+from subot.quests import QuestInfo
+from subot.runtime_bundle import FloorInfo, load_quest_catalog, load_floor_hashes
 
 from dataclasses import dataclass
 
-from subot.models import Sprite, SpriteFrame, Quest, FloorSprite, Realm, RealmLookup, HashFrameWithFloor, \
-    SpriteTypeLookup, SpriteType
+from subot.enums import Realm, SpriteType, UNSUPPORTED_REALMS
 
 from subot.utils import Point, read_version
 import traceback
 
 user32 = windll.user32
+# size of the virtual screen, which spans every monitor
+SM_CXVIRTUALSCREEN = 78
+SM_CYVIRTUALSCREEN = 79
 
 def set_dpi_aware():
     # makes functions return real pixel numbers instead of scaled values
@@ -234,12 +243,6 @@ listener.start()
 player_direction = {GameControl.UP, GameControl.DOWN, GameControl.LEFT, GameControl.RIGHT}
 
 
-@dataclass(frozen=True, eq=True)
-class FloorInfo:
-    realm: Optional[Realm]
-    long_name: str
-
-
 def is_foreground_process(pid: int) -> bool:
     hwnd = win32gui.GetForegroundWindow()
     if not hwnd:
@@ -314,11 +317,9 @@ class Bot:
 
         self.audio_system = audio_system
 
-        self.color_frame_queue: multiprocessing.Queue = multiprocessing.Queue(maxsize=1)
         self.out_quests: multiprocessing.Queue = multiprocessing.Queue()
-        self.rx_color_nearby_queue = multiprocessing.Queue(maxsize=1)
 
-        # queues for communicating with WindowGrabber and NearbyGrabber
+        # queues for communicating with FrameGrabber
         self.rx_queue = multiprocessing.Queue(maxsize=10)
         self.tx_window_queue = multiprocessing.Queue(maxsize=10)
 
@@ -341,6 +342,14 @@ class Bot:
             self.audio_system.speak_blocking("Shutting down")
             sys.exit(1)
 
+        # Performance: frames are passed through shared memory, only the newest is analyzed
+        nearby_frame_bytes = (NEARBY_TILES_WH * TILE_SIZE) ** 2 * 4
+        self.nearby_mailbox: FrameMailbox = FrameMailbox.create("nearby", slot_bytes=nearby_frame_bytes)
+        # the client area fits within the virtual screen spanning every monitor, unless it is partly off screen
+        virtual_screen = user32.GetSystemMetrics(SM_CXVIRTUALSCREEN) * user32.GetSystemMetrics(SM_CYVIRTUALSCREEN)
+        screen_frame_bytes = max(virtual_screen, self.su_client_rect.w * self.su_client_rect.h) * 4
+        self.window_mailbox: FrameMailbox = FrameMailbox.create("whole window", slot_bytes=screen_frame_bytes)
+
         """player tile position in grid"""
         self.player_position: Rect = Bot.compute_player_position(self.su_client_rect)
         self.player_position_tile = TileCoord(x=self.player_position.x // TILE_SIZE,
@@ -364,24 +373,11 @@ class Bot:
 
         self.grid_rect: Rect = Bot.default_grid_rect(self.su_client_rect)
 
-        with Session() as session:
-            floor_ids = [floor_id[0] for floor_id in session.query(HashFrameWithFloor.floor_sprite_frame_id).distinct()]
-            floor_phashes_query = session.query(HashFrameWithFloor.phash, Sprite.long_name, RealmLookup.enum) \
-                .join(SpriteFrame, SpriteFrame.id == HashFrameWithFloor.sprite_frame_id) \
-                .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
-                .join(FloorSprite, Sprite.id == FloorSprite.sprite_id) \
-                .outerjoin(RealmLookup, FloorSprite.realm_id == RealmLookup.id) \
-                .filter(HashFrameWithFloor.sprite_frame_id.in_(floor_ids)) \
-                .group_by(HashFrameWithFloor.phash, Sprite.long_name, RealmLookup.enum)
-            floor_phashes = floor_phashes_query.all()
-            self.floor_hashes: dict[int, FloorInfo] = dict()
-
-            for phash, long_name, realm in floor_phashes:
-                self.floor_hashes[phash] = FloorInfo(realm=realm, long_name=long_name)
-
-            treasure_sprite_sprite_names: Quest = session.query(Quest)\
-                .filter(Quest.title_first_line == "Digging For Treasure").one()
-            self.treasure_map_item_names: set[str] = set(sprite.long_name for sprite in treasure_sprite_sprite_names.sprites)
+        # Performance: read from the exported runtime bundle when there is one instead of the database
+        self.floor_hashes: dict[int, FloorInfo] = load_floor_hashes()
+
+        self.treasure_map_item_names: set[str] = set(
+            load_quest_catalog().by_title("Digging For Treasure").sprite_long_names)
 
         # multiple directions playing previous
         self.all_directions: set[Point] = {Point(1, 0), Point(-1, 0), Point(0, 1), Point(0, -1)}
@@ -398,39 +394,45 @@ class Bot:
 
         # hashes of sprite frames that have matching `self.castle_tile` pixels set to black.
         # This avoids false negative matches if the placed object has matching color pixels in a position
-        self.item_hashes: RealmSpriteHasher = RealmSpriteHasher(floor_tiles=None)
+        self.item_hashes: Union[RealmSpriteHasher, SortedSpriteHasher] = RealmSpriteHasher(floor_tiles=None,
+                                                                max_distance=self.config.hash_match_max_distance)
+
+        # floor and wall tiles of the current realm. Matched before any hashing
+        self.background_model: BackgroundModel = BackgroundModel()
+
+        # sprite hash tables of every realm, loaded in the background castle first then recently entered realms
+        self.hash_tables = HashTableRegistry(max_distance=self.config.hash_match_max_distance,
+                                             recent_path=recent_realms_path(),
+                                             budget_bytes=self.config.hash_table_budget_mb * 1024 * 1024,
+                                             name=HashTableRegistry.__name__)
+        if self.config.sorted_hash_table:
+            self.hash_tables.start()
 
         self.all_found_matches: dict[TileType, list[AssetGridLoc]] = defaultdict(list)
 
         self.stop_event = threading.Event()
-        self.nearby_process = NearbyFrameGrabber(name=NearbyFrameGrabber.__name__,
-                                                 nearby_area=self.nearby_mon, nearby_queue=self.rx_color_nearby_queue,
-                                                 rx_parent=self.tx_nearby_process_queue,
-                                                 hang_notifier=self.crash_notifier)
-        root.debug(f"{self.nearby_process=}")
-        self.nearby_process.start()
+        self.frame_grabber_phandle = FrameGrabber(name=FrameGrabber.__name__,
+                                                  nearby_area=self.nearby_mon, nearby_mailbox=self.nearby_mailbox,
+                                                  rx_nearby_queue=self.tx_nearby_process_queue,
+                                                  window_area=self.mon_full_window,
+                                                  window_mailbox=self.window_mailbox,
+                                                  rx_window_queue=self.tx_window_queue,
+                                                  hang_notifier=self.crash_notifier,
+                                                  config=self.config,
+                                                  )
+        root.debug(f"{self.frame_grabber_phandle=}")
+        self.frame_grabber_phandle.start()
 
         self.nearby_processing_thandle = NearPlayerProcessing(name=NearPlayerProcessing.__name__,
                                                               daemon=True,
-                                                              nearby_frame_queue=self.rx_color_nearby_queue,
+                                                              nearby_mailbox=self.nearby_mailbox,
                                                               nearby_comm_deque=self.nearby_send_deque,
                                                               parent=self, stop_event=self.stop_event,
                                                               )
         self.nearby_processing_thandle.start()
 
-        self.window_framegrabber_phandle = WholeWindowGrabber(name=WholeWindowGrabber.__name__,
-                                                              outgoing_color_frame_queue=self.color_frame_queue,
-                                                              out_quests=self.out_quests,
-                                                              screenshot_area=self.mon_full_window,
-                                                              rx_queue=self.tx_window_queue,
-                                                              hang_notifier=self.crash_notifier,
-                                                              config=self.config,
-                                                              )
-        print(f"{self.window_framegrabber_phandle=}")
-        self.window_framegrabber_phandle.start()
-
         self.whole_window_thandle = WholeWindowAnalyzer(name=WholeWindowAnalyzer.__name__,
-                                                        incoming_frame_queue=self.color_frame_queue,
+                                                        frame_mailbox=self.window_mailbox,
                                                         out_quests_queue=self.out_quests,
                                                         queue_child_comm_send=self.queue_whole_analyzer_comm_send,
                                                         su_client_rect=Rect(x=0, y=0, w=self.mon_full_window["width"],
@@ -524,10 +526,15 @@ class Bot:
         self.speak_menu_entry_name()
 
     def stop(self):
-        self.window_framegrabber_phandle.terminate()
-        self.nearby_process.terminate()
+        self.frame_grabber_phandle.terminate()
         self.stop_event.set()
+        self.nearby_mailbox.unlink()
+        self.window_mailbox.unlink()
+        self.hash_tables.stop_event.set()
         root.info("both should be shut down")
+        root.info(self.nearby_mailbox.report())
+        root.info(self.window_mailbox.report())
+        root.info(runtime_query_timer.report())
         self.audio_system.speak_blocking("Exitting Siralim Access")
         pygame.display.quit()
         pygame.quit()
@@ -604,39 +611,37 @@ class Bot:
         )
 
     def cache_images_using_phashes(self):
-        with Session() as session:
-
-            floor_ids = []
-            if self.mode is BotMode.REALM:
-                if not self.realm:
-                    print("no realm attrib")
-                    return RealmSpriteHasher()
-                realm_id = session.query(RealmLookup).filter_by(enum=self.realm).one().id
-                for floor in session.query(FloorSprite).filter_by(realm_id=realm_id).all():
-                    for floor_tile in floor.frames:
-                        floor_ids.append(floor_tile.id)
-            else:
-                for floor in session.query(FloorSprite).filter_by(long_name="floor_standard1").all():
-                    for floor_tile in floor.frames:
-                        floor_ids.append(floor_tile.id)
-
-            realm_phashes_query = session.query(HashFrameWithFloor.phash, Sprite.short_name, Sprite.long_name,
-                                                SpriteTypeLookup.name) \
-                .join(SpriteFrame, SpriteFrame.id == HashFrameWithFloor.sprite_frame_id) \
-                .join(Sprite, Sprite.id == SpriteFrame.sprite_id) \
-                .join(SpriteTypeLookup, SpriteTypeLookup.id == Sprite.type_id) \
-                .filter(HashFrameWithFloor.floor_sprite_frame_id.in_(floor_ids))
-
-            realm_phashes = realm_phashes_query.all()
-            for realm_phash, short_name, long_name, sprite_type in realm_phashes:
-                img_info = ImageInfo(short_name=short_name, long_name=long_name, sprite_type=sprite_type)
-                self.item_hashes[realm_phash] = img_info
+        if self.mode is BotMode.REALM and not self.realm:
+            print("no realm attrib")
+            return RealmSpriteHasher()
+        realm = self.realm if self.mode is BotMode.REALM else None
+
+        # Performance: kept per realm with the tiles learned on earlier visits, preloaded with the hash tables
+        self.background_model = self.hash_tables.background_model(realm)
+        root.info(f"{len(self.background_model)} background tiles ready")
+        if self.config.sorted_hash_table:
+            # Performance: tables are preloaded in the background, usually only swapping the table is left
+            was_ready = self.hash_tables.is_ready(realm)
+            start = time.time()
+            self.item_hashes = self.hash_tables.get(realm)
+            root.info(f"{pack_name(realm)} hashes {'were ready' if was_ready else 'not ready'}, "
+                      f"waited {math.ceil((time.time() - start) * 1000)}ms. "
+                      f"load took {math.ceil(self.hash_tables.load_seconds.get(realm, 0) * 1000)}ms. "
+                      f"{self.hash_tables.ready_count} tables ready")
+            return
+
+        # the dict table is only built from the database, SQLAlchemy is only imported for it
+        from subot.asset_queries import floor_frame_ids, query_realm_sprite_hasher
+        with settings.RuntimeSession() as session:
+            self.item_hashes = query_realm_sprite_hasher(session, floor_frame_ids(session, realm),
+                                                         max_distance=self.config.hash_match_max_distance)
 
     def cache_image_hashes_of_decorations(self):
         start = time.time()
         self.cache_images_using_phashes()
         end = time.time()
-        root.info(f"Took {math.ceil((end - start) * 1000)}ms to retrieve {len(self.item_hashes)} phashes")
+        root.info(f"Took {math.ceil((end - start) * 1000)}ms to retrieve {len(self.item_hashes)} phashes"
+                  f" and {len(self.item_hashes.digests)} digests")
 
     def reinit_bot(self, new_full_window_rec: Rect):
         self.su_client_rect = new_full_window_rec
@@ -832,72 +837,150 @@ class Minimized:
     pass
 
 
-FrameType = Union[ArrayLike, Minimized]
+FrameType = Union[MailboxFrame, Minimized]
+
+
+class FrameGrabber(multiprocessing.Process):
+    """Screenshots the nearby area for `NearPlayerProcessing` and the whole window for `WholeWindowAnalyzer`
 
+    Performance: a single process captures for both. When both are due, the nearby frame is cropped from the whole
+    window instead of being grabbed again. Each is captured more often while it is changing, see `CaptureRateController`.
+    """
+    # longest wait between checking for messages from the analyzers
+    MESSAGE_CHECK_SECONDS: float = 0.1
+    REPORT_SECONDS: float = 60.0
 
-class WholeWindowGrabber(multiprocessing.Process):
-    def __init__(self, out_quests: Queue, outgoing_color_frame_queue: multiprocessing.Queue, screenshot_area: dict,
-                 rx_queue: multiprocessing.Queue, hang_notifier: queue.Queue[Optional[str]],
-                 config: settings.Config,
-                 **kwargs):
+    def __init__(self, nearby_area: dict, nearby_mailbox: FrameMailbox, rx_nearby_queue: multiprocessing.Queue,
+                 window_area: dict, window_mailbox: FrameMailbox, rx_window_queue: multiprocessing.Queue,
+                 hang_notifier: queue.Queue[Optional[str]], config: settings.Config, **kwargs):
         super().__init__(**kwargs)
         self.config = config
-        self.color_frame_queue: queue.Queue[FrameType] = outgoing_color_frame_queue
-        self.out_quests: Queue = out_quests
-        self.screenshot_area: dict = screenshot_area
-        self.rx_parent_queue = rx_queue
         self.hang_notifier = hang_notifier
-        self.paused: bool = False
 
-    def run(self):
+        self.nearby_area: dict = nearby_area
+        self.nearby_mailbox: FrameMailbox = nearby_mailbox
+        self.rx_nearby_queue = rx_nearby_queue
+        self.nearby_paused: bool = False
+        self.nearby_changes = FrameChangeFilter()
+        nearby_floor = config.nearby_fps_floor if config.adaptive_capture_rate else settings.FPS
+        self.nearby_rate = CaptureRateController(floor_fps=nearby_floor, ceiling_fps=settings.FPS)
+
+        self.window_area: dict = window_area
+        self.window_mailbox: FrameMailbox = window_mailbox
+        self.rx_window_queue = rx_window_queue
+        self.window_paused: bool = False
+        self.window_changes = FrameChangeFilter()
+        window_ceiling = config.whole_window_scanning_frequency
+        window_floor = config.whole_window_fps_floor if config.adaptive_capture_rate else window_ceiling
+        self.window_rate = CaptureRateController(floor_fps=window_floor, ceiling_fps=window_ceiling)
+
+    def check_nearby_messages(self):
+        try:
+            msg = self.rx_nearby_queue.get_nowait()
+            if isinstance(msg, WindowDim):
+                msg: WindowDim
+                print(f"updated nearbyframeGrabber rect. new={msg.mss_dict} old={self.nearby_area}")
+                self.nearby_area = msg.mss_dict
+                self.nearby_changes.reset()
+            elif isinstance(msg, Pause):
+                root.debug("nearby got pause message. Pause grabbing frames")
+                self.nearby_paused = True
+                self.nearby_mailbox.send(Pause())
+            elif isinstance(msg, Resume):
+                root.debug("nearby got resume message. Resume grabbing frames")
+                self.nearby_paused = False
+                self.nearby_changes.reset()
+                self.nearby_mailbox.send(Resume())
+        except queue.Empty:
+            pass
 
+    def check_window_messages(self):
         try:
-            should_stop = False
+            msg = self.rx_window_queue.get_nowait()
+            if isinstance(msg, WindowDim):
+                msg: WindowDim
+                root.info(f"got windowgrabber newmsg = {msg=}")
+                self.window_area = msg.mss_dict
+                self.window_changes.reset()
+            elif isinstance(msg, Pause):
+                root.debug("Pausing capture of whole window frames")
+                self.window_paused = True
+            elif isinstance(msg, Resume):
+                root.debug("Resuming capture of whole window frames")
+                self.window_paused = False
+                self.window_changes.reset()
+        except queue.Empty:
+            pass
 
-            with mss.mss() as sct:
-                TARGET_WINDOW_CAPTURE_MS = 1 / self.config.whole_window_scanning_frequency
-                while not should_stop:
-                    start = time.time()
-                    # check for incoming messages
-                    try:
-                        msg = self.rx_parent_queue.get_nowait()
-                        if isinstance(msg, WindowDim):
-                            msg: WindowDim
-                            root.info(f"got windowgrabber newmsg = {msg=}")
-                            self.screenshot_area = msg.mss_dict
-                        elif isinstance(msg, Pause):
-                            root.debug("Pausing capture of whole window frames")
-                            self.paused = True
-                        elif isinstance(msg, Resume):
-                            root.debug("Resuming capture of whole window frames")
-                            self.paused = False
-                    except queue.Empty:
-                        pass
-
-                    end = time.time()
-                    took = end - start
-                    left = TARGET_WINDOW_CAPTURE_MS - took
-                    time.sleep(max(0.0, left))
+    def send_nearby_frame(self, nearby_shot_np: np.ndarray, captured_at: float):
+        has_no_data = nearby_shot_np.shape[0] == 0 or nearby_shot_np.shape[1] == 0
+        if has_no_data:
+            print("no nearby frame data")
+            self.nearby_mailbox.send(Minimized())
+            self.nearby_changes.reset()
+            self.nearby_rate.update(changed=False, now=captured_at)
+            return
+        publish = self.nearby_changes.changed(nearby_shot_np, captured_at)
+        self.nearby_rate.update(changed=publish and not self.nearby_changes.heartbeat, now=captured_at)
+        if self.config.skip_unchanged_frames and not publish:
+            return
+        root.debug("Sending new nearby frame")
+        self.nearby_mailbox.post(nearby_shot_np, captured_at)
+
+    def send_window_frame(self, frame_np: np.ndarray, captured_at: float):
+        has_no_data = frame_np.shape[0] == 0 or frame_np.shape[1] == 0
+        if has_no_data:
+            root.debug("whole window frame has no data or is minimized")
+            self.window_mailbox.send(Minimized())
+            self.window_changes.reset()
+            self.window_rate.update(changed=False, now=captured_at)
+            return
+        publish = self.window_changes.changed(frame_np, captured_at)
+        self.window_rate.update(changed=publish and not self.window_changes.heartbeat, now=captured_at)
+        if self.config.skip_unchanged_frames and not publish:
+            return
+        root.debug("Sending whole frame")
+        self.window_mailbox.post(frame_np, captured_at)
 
-                    if self.paused:
-                        root.debug("whole window - skipping capture due to being paused")
-                        continue
+    def report(self, now: float) -> str:
+        return f"{self.nearby_rate.report('nearby', now)}\n{self.window_rate.report('whole window', now)}"
 
-                    try:
-
-                        # Performance: copying overhead is not an issue for needing a frame at 1-2 FPS
-                        frame_np: ArrayLike = np.asarray(sct.grab(self.screenshot_area))
-                        has_no_data = frame_np.shape[0] == 0 or frame_np.shape[1] == 0
-                        if has_no_data:
-                            root.debug("whole window frame has no data or is minimized")
-                            self.color_frame_queue.put_nowait(Minimized())
-                            continue
-                        root.debug("Sending whole frame")
-                        self.color_frame_queue.put_nowait(frame_np)
-                    except queue.Full:
-                        continue
+    def run(self):
+        last_report = time.time()
+        try:
+            with mss.mss() as sct:
+                while True:
+                    start = time.time()
+                    self.check_nearby_messages()
+                    self.check_window_messages()
+
+                    capture_window = not self.window_paused and self.window_rate.due(start)
+                    capture_nearby = not self.nearby_paused and self.nearby_rate.due(start)
+                    if capture_window:
+                        # Performance: the frame is written to shared memory instead of being pickled through the queue
+                        frame_np: ArrayLike = np.asarray(sct.grab(self.window_area))
+                        self.send_window_frame(frame_np, start)
+                        if capture_nearby:
+                            crop = crop_slices(self.window_area, self.nearby_area)
+                            if crop and frame_np.size:
+                                self.send_nearby_frame(frame_np[crop], start)
+                            else:
+                                self.send_nearby_frame(np.asarray(sct.grab(self.nearby_area)), start)
+                    elif capture_nearby:
+                        self.send_nearby_frame(np.asarray(sct.grab(self.nearby_area)), start)
+
+                    if start - last_report >= self.REPORT_SECONDS:
+                        root.info(self.report(start))
+                        last_report = start
+
+                    active_rates = [rate for rate, paused in ((self.nearby_rate, self.nearby_paused),
+                                                              (self.window_rate, self.window_paused)) if not paused]
+                    wait = seconds_until_due(time.time(), active_rates) if active_rates else 1 / settings.FPS
+                    time.sleep(min(wait, self.MESSAGE_CHECK_SECONDS))
         except KeyboardInterrupt:
-            self.color_frame_queue.put(None, timeout=10)
+            root.info(self.report(time.time()))
+            self.nearby_mailbox.send(None)
+            self.window_mailbox.send(None)
         except Exception as e:
             root.exception(e)
             self.hang_notifier.put(str(e))
@@ -905,8 +988,8 @@ class WholeWindowGrabber(multiprocessing.Process):
 
 
 class WholeWindowAnalyzer(Thread):
-    def __init__(self, incoming_frame_queue: Queue, queue_child_comm_send: queue.Queue, out_quests_queue: Queue,
-                 su_client_rect: Rect, parent: Bot, stop_event: threading.Event,
+    def __init__(self, frame_mailbox: FrameMailbox, queue_child_comm_send: queue.Queue,
+                 out_quests_queue: Queue, su_client_rect: Rect, parent: Bot, stop_event: threading.Event,
                  config: settings.Config, **kwargs) -> None:
         super().__init__(**kwargs)
         self.creature_data = TraitData()
@@ -920,7 +1003,7 @@ class WholeWindowAnalyzer(Thread):
         self.menu_entry_text_repeat: bool = False
         self.has_dialog_text: bool = False
         self.parent: Bot = parent
-        self.incoming_frame_queue: Queue = incoming_frame_queue
+        self.frame_mailbox: FrameMailbox = frame_mailbox
         self.queue_parent_comm_recv = queue_child_comm_send
         self.out_quests_sprites_queue: Queue = out_quests_queue
         self.stop_event = stop_event
@@ -1102,7 +1185,7 @@ class WholeWindowAnalyzer(Thread):
                         self.paused = True
                         root.info("pause. Pause request")
                         self.parent.tx_window_queue.put(Pause())
-                        clear_queue(self.incoming_frame_queue)
+                        self.frame_mailbox.clear()
                         continue
 
                     elif isinstance(comm_msg, Resume):
@@ -1122,14 +1205,14 @@ class WholeWindowAnalyzer(Thread):
                 else:
                     timeout = 30
                 try:
-                    msg = self.incoming_frame_queue.get(timeout=timeout)
+                    msg: Optional[FrameType] = self.frame_mailbox.get(timeout=timeout)
                     if msg is None:
                         break
                     if isinstance(msg, Minimized):
                         self.paused = True
                         continue
-
-                    shot = msg
+                    if not isinstance(msg, MailboxFrame):
+                        continue
                 except queue.Empty:
                     # is it empty because stuff is shut down?
                     if self.stop_event.is_set():
@@ -1139,10 +1222,12 @@ class WholeWindowAnalyzer(Thread):
 
                     # something is wrong
                     raise Exception(f"No new full frame for {timeout} seconds")
-                if shot is None:
-                    break
-
-                self.frame = np.asarray(shot)[:, :, :3]
+                root.debug(f"whole frame {msg.seq} waited {math.ceil(msg.age * 1000)}ms, {msg.dropped} dropped")
+                # copied, OCR takes long enough for the capture process to wrap around the ring
+                self.frame = msg.frame[:, :, :3].copy()
+                if not self.frame_mailbox.is_valid(msg):
+                    root.debug(f"whole frame {msg.seq} was overwritten while copying it")
+                    continue
                 cv2.cvtColor(self.frame, cv2.COLOR_BGRA2GRAY, dst=self.gray_frame)
                 self.frames_since_last_scan += 1
                 self.got_first_frame = True
@@ -1174,83 +1259,6 @@ class WholeWindowAnalyzer(Thread):
             pass
 
 
-class NearbyFrameGrabber(multiprocessing.Process):
-    def __init__(self, nearby_queue: multiprocessing.Queue, rx_parent: multiprocessing.Queue,
-                 hang_notifier: queue.Queue[Optional[str]],
-                 nearby_area: dict = None,
-                 **kwargs):
-        super().__init__(**kwargs)
-        self.color_nearby_queue: multiprocessing.Queue = nearby_queue
-        self.nearby_area = nearby_area
-        self.rx_parent = rx_parent
-        self.hang_notifier = hang_notifier
-        self.paused: bool = False
-
-    def run(self):
-        """Screenshots the area defined as nearby the player. no more than 8x8 tiles (256pxx256px)
-        :param color_nearby_queue Queue used to send recent nearby screenshot to processing code
-        :param nearby_rect dict used in mss.grab. keys `top`, `left`, `width`, `height`
-        """
-
-        TARGET_MS = 1 / settings.FPS
-
-        try:
-            should_stop = False
-            with mss.mss() as sct:
-                while not should_stop:
-
-                    try:
-                        msg = self.rx_parent.get_nowait()
-                        if isinstance(msg, WindowDim):
-                            msg: WindowDim
-                            print(f"updated nearbyframeGrabber rect. new={msg.mss_dict} old={self.nearby_area}")
-                            self.nearby_area = msg.mss_dict
-                        elif isinstance(msg, Pause):
-                            root.debug("nearby got pause message. Pause grabbing frames")
-                            self.paused = True
-                            self.color_nearby_queue.put(Pause())
-                        elif isinstance(msg, Resume):
-                            root.debug("nearby got resume message. Resume grabbing frames")
-                            self.paused = False
-                            self.color_nearby_queue.put(Resume())
-
-                    except queue.Empty:
-                        pass
-
-                    if self.paused:
-                        time.sleep(TARGET_MS)
-                        continue
-
-                    start = time.time()
-                    # Performance: Unsure if 1MB copying at 60FPS is fine
-                    # Note: Possibly use shared memory if performance is an issue
-                    try:
-                        nearby_shot_np: ArrayLike = np.asarray(sct.grab(self.nearby_area))
-                        has_no_data = nearby_shot_np.shape[0] == 0 or nearby_shot_np.shape[1] == 0
-                        if has_no_data:
-                            print("no nearby frame data")
-                            self.color_nearby_queue.put(Minimized())
-                            continue
-
-                        root.debug("Sending new nearby frame")
-                        self.color_nearby_queue.put(NewFrame(nearby_shot_np), timeout=10)
-                    except queue.Full:
-                        root.debug("color nearby queue full")
-                        pass
-
-                    end = time.time()
-                    took = end - start
-                    left = TARGET_MS - took
-                    time.sleep(max(0, left))
-                    continue
-        except KeyboardInterrupt:
-            self.color_nearby_queue.put(None)
-        except Exception as e:
-            root.exception(e)
-            self.hang_notifier.put(str(e))
-            raise e
-
-
 @dataclass()
 class RealmAlignment:
     """Tells the realm detected"""
@@ -1262,8 +1270,44 @@ class CastleAlignment:
     pass
 
 
+@dataclass()
+class RealmLock:
+    """The area last detected by searching for a floor tile, with the floor tiles seen there
+    While locked, a frame only needs one of the locked floor tiles near the player instead of a new search
+    """
+    alignment: Union[RealmAlignment, CastleAlignment]
+    floor_tiles_gray: np.ndarray
+    failed_checks: int = 0
+
+    MAX_FLOOR_TILES = 8
+    SAMPLE_POINTS = np.arange(0, TILE_SIZE, 4)
+
+    def add_floor_tile(self, tile_gray: np.ndarray):
+        if (self.floor_tiles_gray == tile_gray).all(axis=(1, 2)).any():
+            return
+        self.floor_tiles_gray = np.concatenate([self.floor_tiles_gray, tile_gray[np.newaxis]])[-self.MAX_FLOOR_TILES:]
+
+    def verify(self, tiles_gray: np.ndarray) -> bool:
+        """:param tiles_gray: (..., 32, 32) tiles around the player
+        :return: if any tile is exactly a locked floor tile
+        """
+        tiles = tiles_gray.reshape(-1, TILE_SIZE, TILE_SIZE)
+        # a few pixels on the diagonal rule out most pairs before the full comparison
+        samples = tiles[:, self.SAMPLE_POINTS, self.SAMPLE_POINTS]
+        locked_samples = self.floor_tiles_gray[:, self.SAMPLE_POINTS, self.SAMPLE_POINTS]
+        tile_ids, locked_ids = np.nonzero((samples[:, np.newaxis] == locked_samples[np.newaxis]).all(axis=2))
+        found = bool((tiles[tile_ids] == self.floor_tiles_gray[locked_ids]).all(axis=(1, 2)).any())
+        self.failed_checks = 0 if found else self.failed_checks + 1
+        return found
+
+
 class NearPlayerProcessing(Thread):
-    def __init__(self, nearby_frame_queue: multiprocessing.Queue, nearby_comm_deque: queue.Queue, parent: Bot,
+    # frames in a row without a locked floor tile before searching for the realm again
+    REALM_LOCK_MAX_FAILED_CHECKS = 4
+    # tiles from the player a locked floor tile is looked for
+    REALM_LOCK_RADIUS = 3
+
+    def __init__(self, nearby_mailbox: FrameMailbox, nearby_comm_deque: queue.Queue, parent: Bot,
                  stop_event: threading.Event, **kwargs):
         super().__init__(**kwargs)
 
@@ -1271,7 +1315,7 @@ class NearPlayerProcessing(Thread):
 
         self.parent = parent
         # used for multiprocess communication
-        self.nearby_queue = nearby_frame_queue
+        self.nearby_mailbox: FrameMailbox = nearby_mailbox
 
         # Used for across thread communication
         self.nearby_comm_deque = nearby_comm_deque
@@ -1284,16 +1328,36 @@ class NearPlayerProcessing(Thread):
 
         self.grid_near_rect: Optional[Rect] = parent.nearby_rect_mss
 
+        # results of the last frame's tiles, skips hashing tiles which have not changed
+        self.tile_cache = TileResultCache()
+        # recent tile types of each position, steadies what is announced
+        self.tile_voter: Optional[TileTypeVoter] = None
+        # `tile_cache.resets` the voter's votes were cast after, votes for another realm's sprites are stale
+        self.tile_voter_resets: int = 0
+        # the nearby frame last handled, and the one the voter last voted on
+        self.frame_seq: int = 0
+        self.voted_frame_seq: int = 0
+        # tile type of every sprite for the current realm and quests
+        self.tile_type_table = TileTypeTable()
+
         # The current active quests
-        self.active_quests: list[Quest] = []
+        self.active_quests: list[QuestInfo] = []
 
         self.was_match: bool = False
         self.match_streak: int = 0
+        # frames are only sent when the screen changes, so how long the streak lasted is timed instead of counted
+        self.match_streak_start: float = time.time()
         self.last_match_time: float = time.time()
         self.paused: bool = False
         self.got_first_frame = False
 
-    def bfs_near(self) -> Optional[FloorInfo]:
+        # realm detected by `bfs_near`, verified each frame instead of searching again
+        self.realm_lock: Optional[RealmLock] = None
+
+    def bfs_near(self) -> Optional[tuple[FloorInfo, np.ndarray]]:
+        """Search outwards from the player for a known floor tile
+        :return: the floor found and its grayscale tile
+        """
         DIRECTIONS: list[Movement] = [Movement(x=1, y=0), Movement(x=-1, y=0), Movement(x=0, y=1), Movement(x=0, y=-1)]
         queue: deque[Point] = deque()
         marked: set[Point] = set()
@@ -1326,7 +1390,7 @@ class NearPlayerProcessing(Thread):
             try:
                 computed_hash = compute_hash(tile_gray[:TILE_SIZE, :TILE_SIZE])
                 floor_info = self.parent.floor_hashes[computed_hash]
-                return floor_info
+                return floor_info, tile_gray.copy()
             except KeyError:
                 pass
 
@@ -1342,14 +1406,37 @@ class NearPlayerProcessing(Thread):
         # This area was chosen since the player + 6 creatures are at most this long
         # At least 1 tile will not be dimmed by the fog of war
 
-        floor_type = self.bfs_near()
-        if not floor_type:
+        # Performance: once the realm is known a locked floor tile being nearby is enough to stay in it
+        if self.realm_lock and self.realm_lock.failed_checks < self.REALM_LOCK_MAX_FAILED_CHECKS:
+            if self.realm_lock.verify(self.tiles_near_center()):
+                return self.realm_lock.alignment
+            return
+
+        found_floor = self.bfs_near()
+        if not found_floor:
             return
+        floor_type, floor_tile_gray = found_floor
 
         if not floor_type.realm:
-            return CastleAlignment()
+            alignment = CastleAlignment()
+        else:
+            alignment = RealmAlignment(realm=floor_type.realm)
 
-        return RealmAlignment(realm=floor_type.realm)
+        if self.realm_lock and self.realm_lock.alignment == alignment:
+            self.realm_lock.add_floor_tile(floor_tile_gray)
+            self.realm_lock.failed_checks = 0
+        else:
+            root.debug(f"realm locked to {alignment}")
+            self.realm_lock = RealmLock(alignment=alignment, floor_tiles_gray=floor_tile_gray[np.newaxis])
+        return alignment
+
+    def tiles_near_center(self) -> np.ndarray:
+        """The 7x7 tiles centered on the player, closest of the tiles `bfs_near` searches"""
+        center_x = self.grid_near_rect.w // TILE_SIZE // 2
+        center_y = self.grid_near_rect.h // TILE_SIZE // 2
+        tiles = tile_grid_view(self.near_frame_gray[:self.grid_near_rect.h, :self.grid_near_rect.w])
+        return tiles[max(0, center_y - self.REALM_LOCK_RADIUS):center_y + self.REALM_LOCK_RADIUS + 1,
+                     max(0, center_x - self.REALM_LOCK_RADIUS):center_x + self.REALM_LOCK_RADIUS + 1]
 
     def exclude_from_debug(self, img_info: ImageInfo):
         s = img_info.long_name
@@ -1427,8 +1514,9 @@ class NearPlayerProcessing(Thread):
 
     def scan_for_items(self):
         """Scans for decorations and quests in the castle"""
-        max_stationary_streak = 60 * self.parent.config.required_stationary_seconds
-        if not self.parent.config.repeat_sound_when_stationary and self.match_streak >= max_stationary_streak:
+        stationary_seconds = time.time() - self.match_streak_start if self.match_streak else 0.0
+        if not self.parent.config.repeat_sound_when_stationary and \
+                stationary_seconds >= self.parent.config.required_stationary_seconds:
             self.parent.clear_all_matches()
             self.parent.speak_nearby_objects()
             return
@@ -1437,33 +1525,78 @@ class NearPlayerProcessing(Thread):
         self.map.player_direction = self.parent.player_direction
         self.map.set_center(Point(x=self.grid_near_rect.w // TILE_SIZE // 2, y=self.grid_near_rect.h // TILE_SIZE // 2))
 
+        # Performance: tiles seen pixel for pixel skip hashing, the rest are hashed at once in one pass
+        tile_grid = tile_grid_view(self.near_frame_gray[:self.grid_near_rect.h, :self.grid_near_rect.w])
+        tile_infos = self.tile_cache.get_many_greyscale(tile_grid, self.parent.item_hashes,
+                                                        background=self.parent.background_model)
+        tiles_per_row = tile_grid.shape[1]
+        root.debug(f"nearby tile cache hit rate {self.tile_cache.hit_rate:.1%}, shift {self.tile_cache.last_shift}, "
+                   f"{self.tile_cache.unchanged} unchanged, {self.tile_cache.background} background, "
+                   f"{self.tile_cache.cascade.resolved_uniform} uniform, {self.tile_cache.seen.hits} seen, "
+                   f"{self.tile_cache.hashed} hashed, {self.tile_cache.seen.evictions} evicted")
+
+        # Performance: tile types of every sprite are kept in a table, a frame's tiles are looked up all at once
+        tile_type_inputs = (self.parent.realm, frozenset(self.parent.quest_sprite_long_names),
+                            frozenset(self.parent.treasure_map_item_names), interned_image_info_count())
+        if self.tile_type_table.is_stale(tile_type_inputs):
+            self.tile_type_table.update(tile_type_inputs, interned_image_infos(),
+                                        identify=lambda img_info: self.identify_type(img_info, None))
+        frame_codes = self.tile_type_table.lookup(tile_infos).reshape(tile_grid.shape[:2])
+        for y, x in zip(*np.nonzero(frame_codes == TileTypeTable.MISSING)):
+            frame_codes[y, x] = self.identify_type(tile_infos[y * tiles_per_row + x], None).num
+
+        player_tile = Point(x=self.parent.player_position_tile.x - self.parent.nearby_tile_top_left.x,
+                            y=self.parent.player_position_tile.y - self.parent.nearby_tile_top_left.y)
+        player_in_view = 0 <= player_tile.y < frame_codes.shape[0] and 0 <= player_tile.x < frame_codes.shape[1]
+        if player_in_view:
+            frame_codes[player_tile.y, player_tile.x] = TileType.PLAYER.num
+
+        if root.isEnabledFor(logging.DEBUG):
+            for idx, img_info in enumerate(tile_infos):
+                if img_info is None or self.exclude_from_debug(img_info):
+                    continue
+                asset_point = Point(x=idx % tiles_per_row - player_tile.x, y=idx // tiles_per_row - player_tile.y)
+                root.debug(f"matched: {img_info.long_name} - asset coord = {asset_point}, "
+                           f"{TILE_TYPE_BY_NUM[frame_codes.flat[idx]]}")
+
+        # only tiles which kept their type for most of the last few frames are announced
+        new_voter = self.tile_voter is None or self.tile_voter.shape != frame_codes.shape
+        if new_voter:
+            self.tile_voter = TileTypeVoter(frame_codes.shape)
+            self.tile_voter_resets = self.tile_cache.resets
+        elif self.tile_voter_resets != self.tile_cache.resets:
+            self.tile_voter.clear()
+            self.tile_voter_resets = self.tile_cache.resets
+        # scans repeat for the same frame, each frame only gets one vote
+        if new_voter or self.voted_frame_seq != self.frame_seq:
+            if self.tile_cache.last_shift != (0, 0):
+                self.tile_voter.shift(*self.tile_cache.last_shift)
+            steady_codes = self.tile_voter.update(frame_codes)
+            self.voted_frame_seq = self.frame_seq
+        else:
+            steady_codes = self.tile_voter.reported.copy()
+        # the player is always where it is drawn, it is not voted on
+        if player_in_view:
+            steady_codes[player_tile.y, player_tile.x] = TileType.PLAYER.num
+
         for row in range(0, self.grid_near_rect.w, TILE_SIZE):
             for col in range(0, self.grid_near_rect.h, TILE_SIZE):
-                tile_gray = self.near_frame_gray[col:col + TILE_SIZE, row:row + TILE_SIZE]
                 start_point = (row + self.grid_near_rect.x, col + self.grid_near_rect.y)
                 end_point = (start_point[0] + TILE_SIZE, start_point[1] + TILE_SIZE)
                 asset_location = AssetGridLoc(
                     x=self.parent.nearby_tile_top_left.x + row // TILE_SIZE - self.parent.player_position_tile.x,
                     y=self.parent.nearby_tile_top_left.y + col // TILE_SIZE - self.parent.player_position_tile.y,
                 )
-                if asset_location.point() == Point(0, 0):
-                    self.map.set(asset_location.point(), TileType.PLAYER)
+                tile_type = TILE_TYPE_BY_NUM[steady_codes[col // TILE_SIZE, row // TILE_SIZE]]
+                if tile_type is TileType.UNFILLED:
+                    tile_type = TileType.UNKNOWN
+                self.map.set(asset_location.point(), tile_type)
+                if tile_type is TileType.PLAYER or tile_type is TileType.UNKNOWN:
                     continue
 
-                try:
-                    img_info = self.parent.item_hashes.get_greyscale(tile_gray[:TILE_SIZE, :TILE_SIZE])
-
-                    tile_type = self.identify_type(img_info, asset_location)
-                    if not self.exclude_from_debug(img_info):
-                        root.debug(f"matched: {img_info.long_name} - asset coord = {asset_location.point()}, {tile_type}")
-                    if settings.DEBUG:
-                        self.draw_debug(start_point, end_point, tile_type, "")
-                    self.parent.all_found_matches[tile_type].append(asset_location)
-
-                    self.map.set(asset_location.point(), tile_type)
-
-                except KeyError:
-                    self.map.set(asset_location.point(), TileType.UNKNOWN)
+                if settings.DEBUG:
+                    self.draw_debug(start_point, end_point, tile_type, "")
+                self.parent.all_found_matches[tile_type].append(asset_location)
         start = time.time()
         self.map.find_reachable_blocks()
         try:
@@ -1493,6 +1626,8 @@ class NearPlayerProcessing(Thread):
             return
         else:
             self.was_match = True
+            if not self.match_streak:
+                self.match_streak_start = time.time()
             self.match_streak += 1
             self.last_match_time = time.time()
 
@@ -1503,7 +1638,6 @@ class NearPlayerProcessing(Thread):
             self.parent.mode = BotMode.CASTLE
             self.parent.realm = None
 
-            self.parent.item_hashes = RealmSpriteHasher(floor_tiles=None)
             start = time.time()
             self.parent.cache_image_hashes_of_decorations()
             end = time.time()
@@ -1517,11 +1651,10 @@ class NearPlayerProcessing(Thread):
             self.parent.mode = BotMode.REALM
             if realm_alignment.realm != self.parent.realm:
                 new_realm = realm_alignment.realm
-                if new_realm in models.UNSUPPORTED_REALMS:
+                if new_realm in UNSUPPORTED_REALMS:
                     self.parent.audio_system.speak_blocking(f"Realm unsupported. {new_realm.realm_name}")
                 self.parent.realm = realm_alignment.realm
 
-                self.parent.item_hashes = RealmSpriteHasher(floor_tiles=None)
                 start = time.time()
                 self.parent.cache_image_hashes_of_decorations()
                 end = time.time()
@@ -1532,7 +1665,8 @@ class NearPlayerProcessing(Thread):
                 root.info(f"new realm alignment = {realm_alignment.realm.name}")
                 print(f"new item hashes = {len(self.parent.item_hashes)}")
 
-    def handle_new_frame(self, data: NewFrame):
+    def handle_new_frame(self, data: NewFrame, seq: Optional[int] = None):
+        """:param seq: the frame is a view of `seq` in the mailbox's ring"""
         self.got_first_frame = True
         self.near_frame_color = data.frame
         if settings.DEBUG:
@@ -1543,6 +1677,10 @@ class NearPlayerProcessing(Thread):
 
         # make grayscale version
         cv2.cvtColor(self.near_frame_color, cv2.COLOR_BGRA2GRAY, dst=self.near_frame_gray)
+        if seq is not None and not self.nearby_mailbox.ring.is_valid(seq):
+            root.debug(f"nearby frame {seq} was overwritten while reading it")
+            return
+        self.frame_seq = seq if seq is not None else self.frame_seq + 1
         self.grid_near_rect = Bot.default_grid_rect(self.parent.nearby_rect_mss)
 
         if self.paused:
@@ -1577,7 +1715,9 @@ class NearPlayerProcessing(Thread):
                         self.parent.tx_nearby_process_queue.put(Pause())
                         self.parent.clear_all_matches()
                         self.parent.speak_nearby_objects()
-                        clear_queue(self.nearby_queue)
+                        self.nearby_mailbox.clear()
+                        if self.tile_voter is not None:
+                            self.tile_voter.clear()
                         root.debug("paused nearby analysis")
 
                     elif isinstance(comm_msg, Resume):
@@ -1603,7 +1743,7 @@ class NearPlayerProcessing(Thread):
                 else:
                     timeout = 30
                 try:
-                    msg: MessageImpl = self.nearby_queue.get(timeout=timeout)
+                    msg = self.nearby_mailbox.get(timeout=timeout)
                 except queue.Empty:
                     empty_text = f"No nearby frame for {timeout} seconds"
                     root.warning(empty_text)
@@ -1612,8 +1752,9 @@ class NearPlayerProcessing(Thread):
                 if msg is None:
                     return
                 start = time.time()
-                if isinstance(msg, NewFrame):
-                    self.handle_new_frame(msg)
+                if isinstance(msg, MailboxFrame):
+                    root.debug(f"nearby frame {msg.seq} waited {math.ceil(msg.age * 1000)}ms, {msg.dropped} dropped")
+                    self.handle_new_frame(NewFrame(msg.frame), seq=msg.seq)
                 end = time.time()
                 latency = end - start
                 root.debug(f"realm scanning took {math.ceil(latency * 1000)}ms")
@@ -33,6 +33,12 @@ class NewFrame:
     frame: np.ndarray
 
 
+@dataclass(frozen=True)
+class FrameReady:
+    """Frame `seq` was written to the capture process's `FrameRing`"""
+    seq: int
+
+
 MessageImpl = Union[NewFrame, ScanForItems]
 
 
@@ -1,17 +1,14 @@
 from __future__ import annotations
-from functools import cache
 
-import cv2
-from numpy.typing import ArrayLike
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy import ForeignKey, String, Integer, Column, create_engine, Boolean
 import sqlalchemy as db
-import enum
-from enum import auto
 
 from sqlalchemy.engine import Engine
 from sqlalchemy import event
-from subot.settings import DATABASE_CONFIG, IMAGE_PATH, engine
+from subot.settings import DATABASE_CONFIG, IMAGE_PATH
+from subot.enums import SpriteType, QuestType, Realm, UNSUPPORTED_REALMS, ChestType, ProjectType
+from subot.hash_image import read_data_color, read_data_gray
 
 Base = declarative_base()
 
@@ -23,45 +20,10 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor.close()
 
 
-class SpriteType(enum.Enum):
-    """How is the sprite commonly used in the game"""
-    # all sprites in the game that could be inspected
-    CREATURE = 1
-    # A catch-all for every other graphic asset in the game
-    DECORATION = 2
-    ENEMY = 3
-    # Decoration that only appears in the castle
-    CASTLE_DECORATION = 4
-    NPC = 5
-    FLOOR = 6
-    ALTAR = 7
-    # Sprite of each creature race's master
-    MASTER_NPC = 8
-    # Sprite for an item of a project
-    PROJ_ITEM = 9
-
-    # sprite used to overlay onto a rendered realm (rare)
-    OVERLAY = 10
-    RESOURCE_NODE = 11
-    WALL = 12
-    CHEST = 13
-
-
-@cache
-def read_data_color(filepath: str) -> ArrayLike:
-    return cv2.imread(filepath, cv2.IMREAD_UNCHANGED)
-
-
-@cache
-def read_data_gray(filepath: str) -> ArrayLike:
-    img_color = read_data_color(filepath)
-    return cv2.cvtColor(img_color, cv2.COLOR_BGRA2GRAY)
-
-
 class SpriteFrame(Base):
     __tablename__ = "sprite_frame"
     id = Column(Integer, primary_key=True, nullable=False)
-    sprite_id = Column(Integer, ForeignKey('sprite.id'), nullable=False)
+    sprite_id = Column(Integer, ForeignKey('sprite.id'), nullable=False, index=True)
     meta_extra = Column(String, nullable=True)
     _filepath = Column('filepath', String, nullable=False, unique=True)
 
@@ -109,7 +71,7 @@ class Sprite(Base):
     long_name = Column(String, nullable=False, unique=True)
     # todo: add relationship for RealmSprite table
 
-    type_id = Column(Integer, ForeignKey('sprite_type.id'))
+    type_id = Column(Integer, ForeignKey('sprite_type.id'), index=True)
     type = relationship('SpriteTypeLookup', backref='sprites', uselist=False)
     frames: list[SpriteFrame] = relationship("SpriteFrame", lazy='joined', cascade='all, delete-orphan')
 
@@ -124,89 +86,6 @@ class Sprite(Base):
     # Todo: Add collision rect in tiles from top-left (x, y, w, h)
 
 
-class QuestType(enum.Enum):
-    """What type of object is the quest looking for"""
-    # Just asks to collect a set of decorations in any order
-    decoration = "decoration"
-    enemy = "normal enemy"
-    nemesis = "nemesis"
-    rescue = "rescue"
-    false_god = "false god"
-    nether_boss = "nether boss"
-    story = "story"
-    renegade = "renegade"
-    rebel = "rebel"
-    citizen = "citizen"
-    resource_node = "resource node"
-    # Defeat enemies that invade the realm by intereating with a cursed/haunted item
-    invasion = "invasion"
-    # stationary creatures must be found
-    creature = "creature"
-
-    # one of the chest in the realm is cursed
-    cursed_chest = "cursed chest"
-
-
-class Realm(enum.Enum):
-    ARACHNID_NEST = ('Arachnid Nest', 'Cave', 'Regalis')
-    AZURE_DREAM = ('Azure Dream', 'Life', "Surathli")
-    BASTION_OF_THE_VOID = ('Bastion of the Void', 'Void', 'Tenebris')
-    CAUSTIC_REACTOR = ('Caustic Reactor', 'Reactor', 'Venedon')
-    CUTTHROAT_JUNGLE = ('Cutthroat Jungle', "Jungle", "Torun")
-    BLOOD_GROVE = ('Blood Grove', "Autumn", "Apocranox")
-    DEAD_SHIPS = ('Where the Dead Ships Dwell', "Underwater", "Friden")
-    ETERNITY_END = ("Eternity's End", "Space", "Vertraag")
-    FARAWAY_ENCLAVE = ('Faraway Enclave', "Island", "Lister")
-    FROSTBITE_CAVERNS = ('Frostbite Caverns', "Snow", "Azural")
-    GREAT_PANDEMONIUM = ('Great Pandemonium', "Chaos", "Vulcanar")
-    KINGDOM_OF_HERETICS = ('Kingdom of Heretics', "Haunted", "Gonfurian")
-    PATH_OF_THE_DAMNED = ('Path of the Damned', "Death", "Erebyss")
-    REFUGE_OF_THE_MAGI = ('Refuge of the Magi', "Sorcery", "Zonte")
-    SANCTUM_UMBRA = ('Sanctum Umbra', "Purgatory", "Perdition")
-    TEMPLE_OF_LIES = ('Temple of Lies', "Gem", "Aurum")
-    THE_BARRENS = ('The Barrens', "Desert", "Yseros")
-    THE_SWAMPLANDS = ('The Swamplands', "Nature", "Meraxis")
-    TITAN_WOUND = ("Titan's Wound", "BloodBone", "Mortem")
-    TORTURE_CHAMBER = ('Torture Chamber', "Dungeon", "Tartarith")
-    UNSULLIED_MEADOWS = ('Unsullied Meadows', "Grassland", "Aeolian")
-
-    # new realms
-    THE_FAE_LANDS = ('Fae Lands', 'Fairy', 'Shallan')
-    AMALGAM_GARDENS = ('Amalgum Gardens', 'Amalgam', 'TMere Mrgo')
-    ASTRAL_GALLERY = ('Astral Gallery', "Astral", "Muse")
-    DAMAREL = ('Damarel', 'Damarel', "Alexandria")
-    FORBIDDEN_DEPTHS = ('Forbidden Depths', "ForbiddenDepths", "Anneltha")
-    FORGOTTEN_LAB = ('Forgotten Lab', "ForgottenLab", "Robo")
-    GAMBLERS_HIVE = ("Gambler's Hive", 'Beehive', "Reclusa")
-    LAND_OF_BALANCE = ('Land of Breath & Balance', "LandOfBalance", "Ariamaki")
-    OVERGROWN_TEMPLE = ('Overgrown Temple', "OvergrownTemple", "Genaros")
-
-    _ignore_ = ['god_to_realm_mapping', 'internal_realm_name_to_god_mapping', 'from_ingame_realm_name']
-    god_to_realm_mapping: dict[str, Realm] = {}
-    internal_realm_name_to_god_mapping: dict[str, Realm] = {}
-    from_ingame_realm_name: dict[str, Realm] = {}
-
-    def __init__(self, realm_name: str, internal_realm_name: str, god_name: str):
-        self.realm_name = realm_name
-        self.internal_realm_name = internal_realm_name
-        self.god_name = god_name
-
-    @classmethod
-    def generic_realm_name_to_ingame_realm(cls, generic_realm_name: str) -> Realm:
-        god_name = cls.internal_realm_name_to_god_mapping[generic_realm_name]
-        return cls.god_to_realm_mapping[god_name]
-
-
-Realm.god_to_realm_mapping = {realm.god_name: realm for realm in Realm}
-
-Realm.internal_realm_name_to_god_mapping = {realm.internal_realm_name: realm for realm in Realm}
-Realm.from_ingame_realm_name = {realm.realm_name: realm for realm in Realm}
-
-UNSUPPORTED_REALMS = {
-
-}
-
-
 class RealmLookup(Base):
     __tablename__ = 'realm'
     id = Column(Integer, primary_key=True, nullable=False)
@@ -230,18 +109,6 @@ class AltarSprite(Sprite):
     }
 
 
-class ChestType(enum.Enum):
-    """Type of chest a sprite is"""
-    # Normal chest placed on realm creation
-    NORMAL = 1
-    # Spawned from enemy defeat
-    SPAWNED = 2
-    # Large chest in realm
-    LARGE = 3
-    # A haunted/cursed chest that is part of a specific quest
-    HAUNTED = 4
-
-
 class ChestTypeLookup(Base):
     __tablename__ = "chest_type"
     id = Column(Integer, primary_key=True, nullable=False)
@@ -294,11 +161,6 @@ class FloorSprite(Sprite):
     }
 
 
-class ProjectType(enum.Enum):
-    MISSION = "mission"
-    SPECIAL_PROJECT = "special_project"
-
-
 class Project(Base):
     """Info about a project, projects are started by talking to the NPC named Everett
 
@@ -370,6 +232,9 @@ class Quest(Base):
                            doc="returns 0 or more sprites associated with a realm quest")
     specific_realm = relationship('RealmLookup', uselist=False)
 
+    # title lookups only read the id
+    __table_args__ = (db.Index('ix_quest_title_first_line_id', 'title_first_line', 'id'),)
+
     def __repr__(self):
         return f"Quest({self.id=}, {self.title=}, {self.quest_type=}, {self.specific_realm_id=}, {self.sprites=}"
 
@@ -458,7 +323,7 @@ class HashFrameWithFloor(Base):
     """Perceptual hashes using phash algorithm for all sprite frame + floortile combinations"""
     __tablename__ = "sprite_frame_hash"
 
-    sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False)
+    sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False, index=True)
     floor_sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False, primary_key=True)
     phash = Column(Integer, nullable=False, primary_key=True)
 
@@ -469,6 +334,28 @@ class HashFrameWithFloor(Base):
                           innerjoin=True)
 
 
+class DigestFrameWithFloor(Base):
+    """Exact digests of the grayscale pixels for all sprite frame + floortile combinations
+    Lets an exact tile match skip computing its phash"""
+    __tablename__ = "sprite_frame_digest"
+
+    sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False)
+    floor_sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False, primary_key=True)
+    digest = Column(Integer, nullable=False, primary_key=True)
+
+
+class HashCollisionWithFloor(Base):
+    """Sprite frames whose tiles composed on the same floor tile share a phash, one row per sprite
+    `signature` (see `compute_signatures`) tells them apart. A sprite with a shared phash on one floor frame also has a
+    row on the other floor frames it has that phash on, so the rows of a realm's floor frames form complete buckets"""
+    __tablename__ = "sprite_frame_hash_collision"
+
+    floor_sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False, primary_key=True)
+    phash = Column(Integer, nullable=False, primary_key=True)
+    sprite_frame_id = Column(Integer, ForeignKey('sprite_frame.id'), nullable=False, primary_key=True)
+    signature = Column(db.LargeBinary, nullable=False)
+
+
 if __name__ == "__main__":
     engine = create_engine(DATABASE_CONFIG.uri, echo=True)
     Base.metadata.create_all(engine)
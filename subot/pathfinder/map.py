@@ -175,6 +175,18 @@ dead_ends.add(WallSet2(east=True, southeast=True, south=True, southwest=True, we
 
 Link = NewType('Link', Point)
 
+
+def shift_grid(grid: np.ndarray, dx: int, dy: int, fill) -> np.ndarray:
+    """Copy of `grid` with its contents moved `dx` columns and `dy` rows. Uncovered cells are set to `fill`"""
+    shifted = np.full_like(grid, fill)
+    height, width = grid.shape[:2]
+    if abs(dx) >= width or abs(dy) >= height:
+        return shifted
+    shifted[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+        grid[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+    return shifted
+
+
 @dataclass()
 class FloorDirections:
     up: bool = False
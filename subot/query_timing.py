@@ -0,0 +1,52 @@
+from __future__ import annotations
+import threading
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from sqlalchemy.engine import Engine
+
+
+@dataclass
+class QueryStats:
+    count: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+class QueryTimer:
+    """Times every statement run on the engines it is attached to, grouped by the SQL text
+    Statements run on several threads, `stats` is only changed and read while holding `lock`
+    """
+
+    def __init__(self):
+        self.stats: dict[str, QueryStats] = {}
+        self.lock = threading.Lock()
+
+    def attach(self, engine: Engine):
+        from sqlalchemy import event
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        with self.lock:
+            stats = self.stats.setdefault(statement, QueryStats())
+            stats.count += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+
+    def report(self, top: int = 10) -> str:
+        """Statements which took the longest in total, slowest first"""
+        with self.lock:
+            snapshot = [(statement, QueryStats(stats.count, stats.total_seconds, stats.max_seconds))
+                        for statement, stats in self.stats.items()]
+        slowest = sorted(snapshot, key=lambda item: item[1].total_seconds, reverse=True)[:top]
+        lines = [f"{stats.total_seconds * 1000:8.1f}ms total {stats.max_seconds * 1000:7.1f}ms max "
+                 f"{stats.count:5}x {' '.join(statement.split())[:120]}"
+                 for statement, stats in slowest]
+        return "\n".join(["slowest queries:"] + lines)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Optional, Iterable
+
+from subot.enums import QuestType
+
+
+@dataclass(frozen=True)
+class QuestInfo:
+    """The parts of a `Quest` used while the bot runs, detached from the database"""
+    id: int
+    title: str
+    title_first_line: str
+    quest_type: QuestType
+    supported: bool
+    description: Optional[str]
+    sprite_long_names: frozenset[str]
+
+
+def normalize_title(text: str) -> str:
+    return " ".join(text.casefold().split())
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[idx:idx + 3] for idx in range(len(padded) - 2)}
+
+
+def within_edit_distance(a: str, b: str, max_edits: int) -> bool:
+    """If `a` can be turned into `b` with at most `max_edits` insertions, deletions or substitutions"""
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for row, char_a in enumerate(a, start=1):
+        current = [row]
+        for col, char_b in enumerate(b, start=1):
+            current.append(min(previous[col] + 1, current[col - 1] + 1, previous[col - 1] + (char_a != char_b)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+
+class QuestCatalog:
+    """Finds quests by the first line of their title, tolerating a few OCR mistakes
+
+    Exact titles are found in a dict. Near misses are narrowed down by shared trigrams before comparing edit distances.
+    """
+    # shorter lines are not fuzzy matched, a single edit turns too many of them into a quest title
+    MIN_FUZZY_LENGTH: int = 8
+
+    def __init__(self, quests: Iterable[QuestInfo], quest_type_sprites: Optional[dict[QuestType, frozenset[str]]] = None,
+                 max_edits: int = 1):
+        """:param quest_type_sprites: sprites any quest of a type looks for, instead of the sprites of the quest"""
+        self.max_edits = max_edits
+        self.quest_type_sprites: dict[QuestType, frozenset[str]] = quest_type_sprites or {}
+        self.quests: list[QuestInfo] = list(quests)
+        self._titles: list[str] = [normalize_title(quest.title_first_line) for quest in self.quests]
+        self._by_title: dict[str, QuestInfo] = {}
+        self._by_trigram: dict[str, list[int]] = defaultdict(list)
+        for idx, title in enumerate(self._titles):
+            self._by_title.setdefault(title, self.quests[idx])
+            for trigram in trigrams(title):
+                self._by_trigram[trigram].append(idx)
+
+    def __len__(self) -> int:
+        return len(self.quests)
+
+    def match(self, line: str) -> Optional[QuestInfo]:
+        """:return: the quest whose title's first line is `line`, or the closest within `max_edits`"""
+        title = normalize_title(line)
+        if quest := self._by_title.get(title):
+            return quest
+        if len(title) < self.MIN_FUZZY_LENGTH or self.max_edits == 0:
+            return None
+
+        shared: dict[int, int] = defaultdict(int)
+        for trigram in trigrams(title):
+            for idx in self._by_trigram.get(trigram, ()):
+                shared[idx] += 1
+        # each edit changes at most 3 trigrams
+        required = len(trigrams(title)) - 3 * self.max_edits
+        candidates = sorted((idx for idx, count in shared.items() if count >= required),
+                            key=lambda idx: shared[idx], reverse=True)
+        for idx in candidates:
+            if within_edit_distance(title, self._titles[idx], self.max_edits):
+                return self.quests[idx]
+        return None
+
+    def match_lines(self, lines: Iterable[str]) -> list[QuestInfo]:
+        """Quests whose titles appear in `lines`, each quest once in the order found"""
+        quests: dict[int, QuestInfo] = {}
+        for line in lines:
+            if quest := self.match(line):
+                quests.setdefault(quest.id, quest)
+        return list(quests.values())
+
+    def sprite_long_names(self, quests: Iterable[QuestInfo]) -> frozenset[str]:
+        """Sprites to look for while `quests` are active"""
+        long_names: set[str] = set()
+        for quest in quests:
+            long_names.update(self.quest_type_sprites.get(quest.quest_type, quest.sprite_long_names))
+        return frozenset(long_names)
+
+    def by_title(self, title_first_line: str) -> QuestInfo:
+        """:raises KeyError: no quest has exactly that title"""
+        return self._by_title[normalize_title(title_first_line)]
+
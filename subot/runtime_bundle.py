@@ -0,0 +1,175 @@
+"""Everything the bot reads from the asset database, exported so it runs without the database or SQLAlchemy
+
+The bundle is the hash packs (see `subot.hash_packs`) plus a JSON manifest of the quests, floor tiles and background
+frames, and numpy arrays of the floor tile hashes. A bundle of another `BUNDLE_VERSION`, or exported from another
+version of the database, is ignored and the database is read instead. Export it with
+`subot.asset_queries.export_runtime_bundle`.
+"""
+from __future__ import annotations
+import json
+import logging
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from subot.enums import Realm, QuestType, SpriteType
+from subot.hash_image import ImageInfo, BackgroundModel, intern_image_info, read_data_gray
+from subot.hash_packs import pack_name, database_stamp, matches_database
+from subot.quests import QuestInfo, QuestCatalog
+import subot.settings as settings
+from subot.settings import HASH_PACK_PATH, IMAGE_PATH
+
+root = logging.getLogger()
+
+BUNDLE_VERSION = 2
+MANIFEST_NAME = "bundle.json"
+
+
+@dataclass(frozen=True, eq=True)
+class FloorInfo:
+    realm: Optional[Realm]
+    long_name: str
+
+
+@dataclass(frozen=True)
+class BackgroundFrame:
+    """A floor or wall frame preloaded into the `BackgroundModel`"""
+    # relative to `IMAGE_PATH`
+    filepath: str
+    img_info: ImageInfo
+
+    @property
+    def path(self) -> Path:
+        return IMAGE_PATH.joinpath(self.filepath)
+
+
+@dataclass
+class RuntimeBundle:
+    floor_hashes: dict[int, FloorInfo]
+    quests: list[QuestInfo]
+    quest_type_sprites: dict[QuestType, frozenset[str]]
+    # by hash pack name
+    background_frames: dict[str, list[BackgroundFrame]]
+    version: int = BUNDLE_VERSION
+
+
+def _img_info_row(img_info: ImageInfo) -> list:
+    return [img_info.short_name, img_info.long_name, img_info.sprite_type.name, img_info.sprite_id]
+
+
+def _img_info_from_row(short_name: str, long_name: str, sprite_type: str, sprite_id: Optional[int]) -> ImageInfo:
+    if sprite_id is None:
+        return ImageInfo(short_name=short_name, long_name=long_name, sprite_type=SpriteType[sprite_type])
+    return intern_image_info(sprite_id, short_name, long_name, SpriteType[sprite_type])
+
+
+def save_runtime_bundle(bundle: RuntimeBundle, directory: Path = HASH_PACK_PATH):
+    directory.mkdir(parents=True, exist_ok=True)
+    floor_infos = list(dict.fromkeys(bundle.floor_hashes.values()))
+    floor_info_indices = {floor_info: idx for idx, floor_info in enumerate(floor_infos)}
+    np.save(directory.joinpath("floor_hashes.npy"), np.fromiter(bundle.floor_hashes.keys(), dtype=np.int64))
+    np.save(directory.joinpath("floor_sprite_indices.npy"),
+            np.array([floor_info_indices[floor_info] for floor_info in bundle.floor_hashes.values()], dtype=np.int32))
+
+    manifest = {
+        "version": bundle.version,
+        "database": database_stamp(),
+        "floor_sprites": [[floor_info.long_name, floor_info.realm.name if floor_info.realm else None]
+                          for floor_info in floor_infos],
+        "quests": [{"id": quest.id, "title": quest.title, "title_first_line": quest.title_first_line,
+                    "quest_type": quest.quest_type.name, "supported": quest.supported,
+                    "description": quest.description, "sprite_long_names": sorted(quest.sprite_long_names)}
+                   for quest in bundle.quests],
+        "quest_type_sprites": {quest_type.name: sorted(long_names)
+                               for quest_type, long_names in bundle.quest_type_sprites.items()},
+        "background_frames": {name: [[frame.filepath, *_img_info_row(frame.img_info)] for frame in frames]
+                              for name, frames in bundle.background_frames.items()},
+    }
+    with open(directory.joinpath(MANIFEST_NAME), "w", encoding="utf8") as f:
+        json.dump(manifest, f)
+
+
+def read_runtime_bundle(directory: Path = HASH_PACK_PATH) -> Optional[RuntimeBundle]:
+    """:return: None if there is no bundle, it is from another version or it was exported from another database"""
+    manifest_path = directory.joinpath(MANIFEST_NAME)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path, encoding="utf8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != BUNDLE_VERSION:
+        root.warning(f"ignoring runtime bundle version {manifest.get('version')}, expected {BUNDLE_VERSION}")
+        return None
+    if not matches_database(manifest["database"]):
+        root.warning("ignoring runtime bundle exported from another version of the database")
+        return None
+
+    floor_infos = [FloorInfo(realm=Realm[realm] if realm else None, long_name=long_name)
+                   for long_name, realm in manifest["floor_sprites"]]
+    floor_hashes = np.load(directory.joinpath("floor_hashes.npy")).tolist()
+    floor_sprite_indices = np.load(directory.joinpath("floor_sprite_indices.npy")).tolist()
+    quests = [QuestInfo(id=quest["id"], title=quest["title"], title_first_line=quest["title_first_line"],
+                        quest_type=QuestType[quest["quest_type"]], supported=quest["supported"],
+                        description=quest["description"], sprite_long_names=frozenset(quest["sprite_long_names"]))
+              for quest in manifest["quests"]]
+    return RuntimeBundle(
+        floor_hashes={phash: floor_infos[idx] for phash, idx in zip(floor_hashes, floor_sprite_indices)},
+        quests=quests,
+        quest_type_sprites={QuestType[quest_type]: frozenset(long_names)
+                            for quest_type, long_names in manifest["quest_type_sprites"].items()},
+        background_frames={name: [BackgroundFrame(filepath=filepath, img_info=_img_info_from_row(*img_info_row))
+                                  for filepath, *img_info_row in frames]
+                           for name, frames in manifest["background_frames"].items()},
+    )
+
+
+@cache
+def runtime_bundle() -> Optional[RuntimeBundle]:
+    """The exported bundle the bot runs from. None if the bot has to read the database"""
+    bundle = read_runtime_bundle()
+    root.info(f"runtime bundle {'loaded' if bundle else 'not found, reading the database'}")
+    return bundle
+
+
+# The loaders below fall back to the database when there is no bundle. SQLAlchemy is only imported then
+
+@cache
+def load_quest_catalog() -> QuestCatalog:
+    """The catalog of every quest, loaded once"""
+    if bundle := runtime_bundle():
+        return QuestCatalog(bundle.quests, quest_type_sprites=bundle.quest_type_sprites)
+    from subot.asset_queries import query_quests, query_quest_type_sprites
+    with settings.RuntimeSession() as session:
+        return QuestCatalog(query_quests(session), quest_type_sprites=query_quest_type_sprites(session))
+
+
+def load_floor_hashes() -> dict[int, FloorInfo]:
+    """Floor tile of each floor tile hash, used to detect the realm"""
+    if bundle := runtime_bundle():
+        return bundle.floor_hashes
+    from subot.asset_queries import query_floor_hashes
+    with settings.RuntimeSession() as session:
+        return query_floor_hashes(session)
+
+
+def load_background_frames(realm: Optional[Realm]) -> list[BackgroundFrame]:
+    """Floor and wall frames of a realm, or the castle's floor if `realm` is None"""
+    if bundle := runtime_bundle():
+        return bundle.background_frames.get(pack_name(realm), [])
+    from subot.asset_queries import query_background_frames
+    with settings.RuntimeSession() as session:
+        return query_background_frames(session, realm)
+
+
+def load_background_model(realm: Optional[Realm]) -> BackgroundModel:
+    """Floor and wall frames of a realm or the castle
+    Frames without an image on disk are learned from matched tiles while playing instead
+    """
+    background_model = BackgroundModel()
+    for frame in load_background_frames(realm):
+        if not frame.path.exists():
+            continue
+        background_model.add(read_data_gray(frame.path.as_posix()), frame.img_info)
+    return background_model
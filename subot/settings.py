@@ -3,10 +3,11 @@ import configparser
 from dataclasses import dataclass
 from enum import Enum, auto
 import os
+import threading
 from pathlib import Path
+from urllib.parse import quote
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from subot.query_timing import QueryTimer
 
 sqlite_path = (Path.cwd() / __file__).parent.parent.joinpath('assets.db')
 
@@ -16,10 +17,63 @@ class DatabaseConfig:
     uri: str = f"sqlite:///{sqlite_path.as_posix()}"
 
 
+def runtime_database_uri(path: Path) -> str:
+    """Read-only, immutable URI of the sqlite database at `path`
+    sqlite reads the path as part of a URI, so characters such as ? # % in it are quoted
+    """
+    return f"sqlite:///file:{quote(path.as_posix(), safe='/:')}?mode=ro&immutable=1&uri=true"
+
+
+@dataclass()
+class RuntimeDatabaseConfig:
+    """The bot only reads the database. Opened read-only and immutable so sqlite skips locking and change checks"""
+    uri: str = runtime_database_uri(sqlite_path)
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size_kib: int = 64 * 1024
+
+
 DATABASE_CONFIG = DatabaseConfig()
-engine = create_engine(DATABASE_CONFIG.uri, echo=False, connect_args={'timeout': 2})
-Session = sessionmaker(engine)
+RUNTIME_DATABASE_CONFIG = RuntimeDatabaseConfig()
+runtime_query_timer = QueryTimer()
+
+# created on first use by `__getattr__`. The bot doesn't import SQLAlchemy when it runs from the runtime bundle
+_DATABASE_NAMES = {"engine", "Session", "runtime_engine", "RuntimeSession"}
+_database_lock = threading.Lock()
+
+
+def _create_engines():
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(DATABASE_CONFIG.uri, echo=False, connect_args={'timeout': 2})
+    runtime_engine = create_engine(RUNTIME_DATABASE_CONFIG.uri, echo=False)
+    runtime_query_timer.attach(runtime_engine)
+
+    @event.listens_for(runtime_engine, "connect")
+    def set_runtime_sqlite_pragma(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA mmap_size = {RUNTIME_DATABASE_CONFIG.mmap_size}")
+        cursor.execute(f"PRAGMA cache_size = -{RUNTIME_DATABASE_CONFIG.cache_size_kib}")
+        cursor.execute("PRAGMA query_only = ON")
+        cursor.close()
+
+    globals().update(engine=engine, Session=sessionmaker(engine), runtime_engine=runtime_engine,
+                     # Sessions used while the bot runs. Scripts which change the database use `Session`
+                     RuntimeSession=sessionmaker(runtime_engine))
+
+
+def __getattr__(name: str):
+    if name not in _DATABASE_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _database_lock:
+        if name not in globals():
+            _create_engines()
+    return globals()[name]
+
+
 IMAGE_PATH = Path(__file__).parent.parent.joinpath('resources')
+# data the bot runs from, exported from the database. See `subot.runtime_bundle` and `subot.hash_packs`
+HASH_PACK_PATH = sqlite_path.parent.joinpath('hash_packs')
 
 
 @dataclass
@@ -28,6 +82,13 @@ class Config:
     map_viewer: bool = False
     show_ui: bool = True
     whole_window_scanning_frequency: int = 7
+    # only send a captured frame on when the screen changed, or once a second
+    skip_unchanged_frames: bool = True
+    # capture less often while the screen stays the same, down to the floors below.
+    # The most often is 60 times a second nearby the player and `whole_window_scanning_frequency` for the whole window
+    adaptive_capture_rate: bool = True
+    nearby_fps_floor: float = 15
+    whole_window_fps_floor: float = 2
     update_popup_browser: bool = True
     open_config_key: str = "C"
     help_key: str = "?"
@@ -62,6 +123,12 @@ class Config:
     wardrobe: int = 100
 
     detect_objects_through_walls: bool = True
+    # tiles whose hash is this many bits from a known sprite's hash still match it (fog dimming, overlays, animation)
+    hash_match_max_distance: int = 0
+    # keep sprite hashes in sorted numpy arrays instead of a dict. Quicker to load and smaller
+    sorted_hash_table: bool = True
+    # memory the realm hash tables kept loaded may use. The least recently entered realms are dropped first
+    hash_table_budget_mb: int = 256
 
     # repeat detected object sounds. If false, stops playing the sound if play has not moved
     repeat_sound_when_stationary: bool = False
@@ -73,6 +140,10 @@ class Config:
         ini["GENERAL"] = {
             "show_ui": self.show_ui,
             "whole_window_fps": self.whole_window_scanning_frequency,
+            "skip_unchanged_frames": self.skip_unchanged_frames,
+            "adaptive_capture_rate": self.adaptive_capture_rate,
+            "nearby_fps_floor": self.nearby_fps_floor,
+            "whole_window_fps_floor": self.whole_window_fps_floor,
             "repeat_sound_when_stationary": self.repeat_sound_when_stationary,
             "repeat_sound_seconds": self.required_stationary_seconds,
             'update_popup_browser': self.update_popup_browser,
@@ -113,6 +184,9 @@ class Config:
 
         ini["REALM_OBJECT_DETECTION"] = {
             "detect_objects_through_walls": self.detect_objects_through_walls,
+            "max_hash_distance": self.hash_match_max_distance,
+            "sorted_hash_table": self.sorted_hash_table,
+            "hash_table_budget_mb": self.hash_table_budget_mb,
         }
 
         with open(path, "w+", encoding="utf8") as f:
@@ -128,6 +202,10 @@ class Config:
         default_config.show_ui = general.getboolean("show_ui", fallback=default_config.show_ui)
 
         default_config.whole_window_scanning_frequency = general.getfloat("whole_window_fps", fallback=default_config.whole_window_scanning_frequency)
+        default_config.skip_unchanged_frames = general.getboolean("skip_unchanged_frames", fallback=default_config.skip_unchanged_frames)
+        default_config.adaptive_capture_rate = general.getboolean("adaptive_capture_rate", fallback=default_config.adaptive_capture_rate)
+        default_config.nearby_fps_floor = general.getfloat("nearby_fps_floor", fallback=default_config.nearby_fps_floor)
+        default_config.whole_window_fps_floor = general.getfloat("whole_window_fps_floor", fallback=default_config.whole_window_fps_floor)
         default_config.repeat_sound_when_stationary = general.getboolean('repeat_sound_when_stationary', fallback=default_config.repeat_sound_when_stationary)
         default_config.required_stationary_seconds = general.getfloat('repeat_sound_seconds', fallback=default_config.required_stationary_seconds)
         default_config.update_popup_browser = general.getboolean('update_popup_browser', fallback=default_config.update_popup_browser)
@@ -167,6 +245,9 @@ class Config:
 
         object_detection = ini["REALM_OBJECT_DETECTION"]
         default_config.detect_objects_through_walls = object_detection.getboolean("detect_objects_through_walls", fallback=default_config.detect_objects_through_walls)
+        default_config.hash_match_max_distance = object_detection.getint("max_hash_distance", fallback=default_config.hash_match_max_distance)
+        default_config.sorted_hash_table = object_detection.getboolean("sorted_hash_table", fallback=default_config.sorted_hash_table)
+        default_config.hash_table_budget_mb = object_detection.getint("hash_table_budget_mb", fallback=default_config.hash_table_budget_mb)
 
         print(f"{default_config=}")
         return default_config
@@ -0,0 +1,324 @@
+from dataclasses import dataclass
+from typing import Optional, Callable
+
+import numpy as np
+
+from subot.hash_image import ImageInfo, RealmSpriteHasher, BackgroundModel, compute_digests, TILE_SIZE
+from subot.lru import LRUCache
+from subot.pathfinder.map import TileType, shift_grid
+
+
+def _best_offset(prev_profile: np.ndarray, profile: np.ndarray, max_tiles: int) -> int:
+    """Whole tile offset which best lines up the previous intensity profile with the current one"""
+    best_offset = 0
+    best_error = None
+    for tiles in range(-max_tiles, max_tiles + 1):
+        offset = tiles * TILE_SIZE
+        if offset >= 0:
+            overlap, prev_overlap = profile[offset:], prev_profile[:len(prev_profile) - offset]
+        else:
+            overlap, prev_overlap = profile[:offset], prev_profile[-offset:]
+        if not len(overlap):
+            continue
+        error = np.abs(overlap - prev_overlap).mean()
+        if best_error is None or error < best_error:
+            best_offset, best_error = tiles, error
+    return best_offset
+
+
+def estimate_tile_shift(prev_grid: np.ndarray, grid: np.ndarray, max_tiles: int = 1) -> tuple[int, int]:
+    """Estimate how many whole tiles the view scrolled between two (rows, cols, 32, 32) tile grids
+
+    Compares the row and column intensity sums of both frames, which is much cheaper than comparing every tile at
+    every candidate offset.
+    :return: (dx, dy) the previous contents moved by. The player stepping right moves contents left, (-1, 0)
+    """
+    rows, cols = grid.shape[:2]
+    dy = _best_offset(prev_grid.sum(axis=(1, 3), dtype=np.int64).reshape(rows * TILE_SIZE),
+                      grid.sum(axis=(1, 3), dtype=np.int64).reshape(rows * TILE_SIZE), max_tiles)
+    dx = _best_offset(prev_grid.sum(axis=(0, 2), dtype=np.int64).reshape(cols * TILE_SIZE),
+                      grid.sum(axis=(0, 2), dtype=np.int64).reshape(cols * TILE_SIZE), max_tiles)
+    return dx, dy
+
+
+@dataclass
+class TileFeatures:
+    """Per tile statistics of a batch of tiles, computed together"""
+    # min == max, every pixel is the same value
+    uniform: np.ndarray
+    minimum: np.ndarray
+
+
+class TileCascade:
+    """Resolves tiles from cheap features before they are looked up by hash
+
+    Blank tiles, like the black past the edge of the map, are a single value which fully describes the tile.
+    Unresolved tiles go through the full hash path and the results of uniform tiles are learned for next time.
+    """
+
+    def __init__(self):
+        self.uniform: dict[int, Optional[ImageInfo]] = {}
+
+        self.resolved_uniform: int = 0
+
+    def clear(self):
+        self.uniform.clear()
+
+    @classmethod
+    def features(cls, tiles: np.ndarray) -> TileFeatures:
+        """:param tiles: (N, 32, 32) grayscale tiles"""
+        minimum = tiles.min(axis=(1, 2))
+        return TileFeatures(uniform=minimum == tiles.max(axis=(1, 2)), minimum=minimum)
+
+    def resolve(self, features: TileFeatures, idx: int) -> tuple[bool, Optional[ImageInfo]]:
+        """:return: (resolved, matched sprite) of tile `idx`. The sprite is None for an unknown tile"""
+        if not features.uniform[idx]:
+            return False, None
+        try:
+            img_info = self.uniform[int(features.minimum[idx])]
+        except KeyError:
+            return False, None
+        self.resolved_uniform += 1
+        return True, img_info
+
+    def learn(self, features: TileFeatures, img_infos: list[Optional[ImageInfo]]):
+        """Remember the hash path's results of uniform tiles"""
+        for idx, img_info in enumerate(img_infos):
+            if features.uniform[idx]:
+                self.uniform[int(features.minimum[idx])] = img_info
+
+
+class TileResultCache:
+    """Remembers what the nearby tiles matched between frames
+
+    Most tiles are byte for byte the same as the previous frame when the player stands still.
+    Those reuse the previous frame's result without being looked at again.
+    Changed tiles are matched against the realm's floor and wall tiles, go through `TileCascade`, then are looked up
+    by a digest of their pixels in an LRU of recently seen tiles. Only new pixels are hashed.
+
+    Results are the matched `ImageInfo` (None for unknown tiles). The tile type is left to the caller since it
+    depends on the active quests, which change independently of the pixels.
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        self.seen: LRUCache[int, Optional[ImageInfo]] = LRUCache(max_entries)
+        self._hasher: Optional[RealmSpriteHasher] = None
+        self._prev_tiles: Optional[np.ndarray] = None
+        self._prev_infos: Optional[np.ndarray] = None
+        # (dx, dy) whole tiles the view scrolled since the previous frame
+        self.last_shift: tuple[int, int] = (0, 0)
+
+        # cheap per tile features which resolve the common backgrounds
+        self.cascade = TileCascade()
+
+        # number of tiles resolved at each stage
+        self.unchanged: int = 0
+        self.background: int = 0
+        self.hashed: int = 0
+        self.lookups: int = 0
+        # times the remembered results were thrown away, lets callers drop state built from them
+        self.resets: int = 0
+
+    def clear(self):
+        self.resets += 1
+        self.seen.clear()
+        self.cascade.clear()
+        self._prev_tiles = None
+        self._prev_infos = None
+        self.last_shift = (0, 0)
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of tiles which did not need hashing"""
+        if not self.lookups:
+            return 0.0
+        return 1 - self.hashed / self.lookups
+
+    def _unchanged_since_last_frame(self, tiles: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Which tiles are identical to the previous frame, following the view if it scrolled by whole tiles
+
+        :return: (rows, cols) mask of unchanged tiles and the previous results lined up with the current tiles
+        """
+        grid_shape = tiles.shape[:2]
+        if self._prev_tiles is None or self._prev_tiles.shape != tiles.shape:
+            self.last_shift = (0, 0)
+            return np.zeros(grid_shape, dtype=bool), np.full(grid_shape, None, dtype=object)
+
+        unchanged = (tiles == self._prev_tiles).all(axis=(2, 3))
+        self.last_shift = (0, 0)
+        prev_infos = self._prev_infos
+
+        # a still view needs no motion estimate
+        if unchanged.mean() >= 0.5:
+            return unchanged, prev_infos
+
+        dx, dy = estimate_tile_shift(self._prev_tiles, tiles)
+        if (dx, dy) != (0, 0):
+            shifted_tiles = shift_grid(self._prev_tiles, dx, dy, 0)
+            # uncovered tiles have nothing to compare against
+            covered = shift_grid(np.ones(grid_shape, dtype=bool), dx, dy, False)
+            unchanged_shifted = (tiles == shifted_tiles).all(axis=(2, 3)) & covered
+            # the projections are only an estimate, follow the shift if it lines up more tiles than standing still
+            if unchanged_shifted.sum() > unchanged.sum():
+                # tiles fixed to the screen, like the player, still line up with the same position
+                prev_infos = np.where(unchanged, self._prev_infos, shift_grid(self._prev_infos, dx, dy, None))
+                unchanged = unchanged | unchanged_shifted
+                self.last_shift = (dx, dy)
+        return unchanged, prev_infos
+
+    def get_many_greyscale(self, tiles_gray: np.ndarray, hasher: RealmSpriteHasher,
+                           background: Optional[BackgroundModel] = None) -> list[Optional[ImageInfo]]:
+        """Lookup a (rows, cols, 32, 32) grid of grayscale tiles, in the same order as
+        `RealmSpriteHasher.get_many_greyscale`
+        :param background: floor and wall tiles of the realm, matched before anything else. Learns from hashed tiles
+        """
+        # sprites are different on realm change
+        if hasher is not self._hasher:
+            self.clear()
+            self._hasher = hasher
+
+        tiles = np.array(tiles_gray, dtype=np.uint8).reshape(-1, tiles_gray.shape[-3], TILE_SIZE, TILE_SIZE)
+        self.lookups += tiles.shape[0] * tiles.shape[1]
+        unchanged, prev_infos = self._unchanged_since_last_frame(tiles)
+
+        flat_tiles = tiles.reshape(-1, TILE_SIZE, TILE_SIZE)
+        found = np.where(unchanged, prev_infos, None).reshape(-1)
+        self.unchanged += int(unchanged.sum())
+
+        changed = np.flatnonzero(~unchanged.reshape(-1))
+        if background is not None:
+            background_ids = background.match(flat_tiles[changed])
+            is_background = background_ids >= 0
+            for idx, background_idx in zip(changed[is_background].tolist(), background_ids[is_background].tolist()):
+                found[idx] = background.infos[background_idx]
+            self.background += int(is_background.sum())
+            changed = changed[~is_background]
+
+        features = self.cascade.features(flat_tiles[changed])
+        unresolved: list[int] = []
+        for changed_idx, idx in enumerate(changed.tolist()):
+            resolved, img_info = self.cascade.resolve(features, changed_idx)
+            if resolved:
+                found[idx] = img_info
+            else:
+                unresolved.append(idx)
+
+        # digested once, the hasher reuses them for its own digest lookup
+        unresolved_digests = compute_digests(flat_tiles[unresolved])
+        missing: list[int] = []
+        missing_digests: list[int] = []
+        for idx, digest in zip(unresolved, unresolved_digests.tolist()):
+            try:
+                found[idx] = self.seen[digest]
+            except KeyError:
+                missing.append(idx)
+                missing_digests.append(digest)
+
+        if missing:
+            missing_infos, missing_exact = hasher.match_many_greyscale(
+                flat_tiles[missing], digests=np.asarray(missing_digests, dtype=np.int64))
+            for idx, digest, img_info in zip(missing, missing_digests, missing_infos):
+                found[idx] = img_info
+                self.seen[digest] = img_info
+            self.cascade.learn(self.cascade.features(flat_tiles[missing]), missing_infos)
+            if background is not None:
+                # a near hash match could be a lookalike, only tiles known for sure are matched before hashing
+                for idx, img_info, exact in zip(missing, missing_infos, missing_exact.tolist()):
+                    if exact and img_info is not None and img_info.sprite_type in BackgroundModel.SPRITE_TYPES:
+                        background.add(flat_tiles[idx], img_info)
+        self.hashed += len(missing)
+
+        self._prev_tiles = tiles
+        self._prev_infos = found.reshape(tiles.shape[:2])
+        return found.tolist()
+
+
+TILE_TYPE_BY_NUM: dict[int, TileType] = {tile_type.num: tile_type for tile_type in TileType}
+
+
+class TileTypeVoter:
+    """Steadies the tile type of each nearby position over the last few frames
+
+    A position's reported type only changes once `required` of the last `history` frames agree on the new type.
+    Positions which never agreed yet are reported as `TileType.UNFILLED`.
+    Keeps single frame flickers from animations and scrolling from reaching the audio.
+    """
+
+    def __init__(self, shape: tuple[int, int], history: int = 4, required: int = 3):
+        if not 0 < required <= history:
+            raise ValueError(f"required agreeing frames must be in [1, {history=}] {required=}")
+        self.required = required
+        self.history: np.ndarray = np.full((history, *shape), TileType.UNFILLED.num, dtype=np.int8)
+        self.reported: np.ndarray = np.full(shape, TileType.UNFILLED.num, dtype=np.int8)
+        self._frame = 0
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.reported.shape
+
+    def clear(self):
+        self.history[:] = TileType.UNFILLED.num
+        self.reported[:] = TileType.UNFILLED.num
+
+    def shift(self, dx: int, dy: int):
+        """Keep the votes with the tiles when the view scrolls by whole tiles"""
+        for frame in range(len(self.history)):
+            self.history[frame] = shift_grid(self.history[frame], dx, dy, TileType.UNFILLED.num)
+        self.reported = shift_grid(self.reported, dx, dy, TileType.UNFILLED.num)
+
+    def update(self, codes: np.ndarray) -> np.ndarray:
+        """Add a frame's tile types
+        :param codes: grid of `TileType.num`
+        :return: grid of the steadied `TileType.num` of each position
+        """
+        self.history[self._frame % len(self.history)] = codes
+        self._frame += 1
+
+        agreeing = (self.history == codes[np.newaxis]).sum(axis=0)
+        confident = agreeing >= self.required
+        self.reported[confident] = codes[confident]
+        return self.reported.copy()
+
+
+class TileTypeTable:
+    """`TileType.num` of every sprite indexed by sprite id, so a whole frame's sprites map to tile types at once
+
+    The tile type of a sprite depends on the realm and the active quests, the table is rebuilt when those change.
+    """
+    # sprite has no entry, it has to be identified on its own
+    MISSING = -1
+
+    def __init__(self):
+        self.codes: np.ndarray = np.empty(0, dtype=np.int8)
+        self._inputs = None
+        self.rebuilds: int = 0
+
+    def is_stale(self, inputs) -> bool:
+        """:param inputs: everything the tile type of a sprite depends on besides the sprite"""
+        return inputs != self._inputs
+
+    def update(self, inputs, img_infos: list[ImageInfo], identify: Callable[[ImageInfo], TileType]):
+        """Rebuild the table
+        :param inputs: everything the tile type of a sprite depends on besides the sprite
+        :param img_infos: every sprite which can be looked up
+        :param identify: tile type of a single sprite
+        """
+        sprite_ids = [img_info.sprite_id for img_info in img_infos if img_info.sprite_id is not None]
+        codes = np.full(max(sprite_ids, default=-1) + 1, self.MISSING, dtype=np.int8)
+        for img_info in img_infos:
+            if img_info.sprite_id is not None:
+                codes[img_info.sprite_id] = identify(img_info).num
+        self.codes = codes
+        self._inputs = inputs
+        self.rebuilds += 1
+
+    def lookup(self, img_infos: list[Optional[ImageInfo]]) -> np.ndarray:
+        """:return: `TileType.num` of each sprite. `TileType.UNKNOWN` for None, `MISSING` for sprites not in the table"""
+        sprite_ids = np.fromiter((self.MISSING if img_info is None or img_info.sprite_id is None
+                                  else img_info.sprite_id for img_info in img_infos),
+                                 dtype=np.int64, count=len(img_infos))
+        in_table = (sprite_ids >= 0) & (sprite_ids < len(self.codes))
+        codes = np.full(len(img_infos), self.MISSING, dtype=np.int8)
+        codes[in_table] = self.codes[sprite_ids[in_table]]
+        codes[[img_info is None for img_info in img_infos]] = TileType.UNKNOWN.num
+        return codes
@@ -5,9 +5,10 @@ from typing import Optional
 import cv2
 from numpy.typing import NDArray
 
-from subot.models import Quest, QuestType, ChestSprite, ResourceNodeSprite, NPCSprite
+from subot.quests import QuestInfo
+from subot.runtime_bundle import load_quest_catalog
 from subot.ocr import OCR, detect_dialog_text_both_frames, detect_green_text, OCRResult
-from subot.settings import Config, Session
+from subot.settings import Config
 from subot.ui_areas.CodexGeneric import detect_any_text
 from subot.ui_areas.base import SpeakAuto, FrameInfo, OCRMode, SpeakCapability
 import numpy as np
@@ -30,7 +31,7 @@ class OcrUnknownArea(SpeakAuto):
         self.current_selected_text: str = ""
         self.current_selected_text_result: Optional[OCRResult] = None
         self.quest_sprite_long_names: set[str] = set()
-        self.current_quests: list[Quest] = []
+        self.current_quests: list[QuestInfo] = []
         self.current_quest_ids: set[int] = set()
         self.quest_text: str = ""
         self.menu_entry_text_repeat = False
@@ -42,7 +43,7 @@ class OcrUnknownArea(SpeakAuto):
             t1 = time.time()
             quests = self.extract_quest_name_from_quest_area(parent.gray_frame)
             current_quests = [quest.title for quest in quests]
-            quest_items = [sprite.long_name for quest in quests for sprite in quest.sprites]
+            quest_items = [long_name for quest in quests for long_name in quest.sprite_long_names]
             root.debug(f"quests = {current_quests}")
             root.debug(f"quest items = {quest_items}")
 
@@ -118,7 +119,7 @@ class OcrUnknownArea(SpeakAuto):
             self.audio_system.speak_nonblocking(text)
             return text
 
-    def update_quests(self, new_quests: list[Quest]):
+    def update_quests(self, new_quests: list[QuestInfo]):
         self.current_quests = new_quests
         if len(new_quests) == 0:
             return
@@ -135,25 +136,11 @@ class OcrUnknownArea(SpeakAuto):
             if self.program_config.ocr_enabled:
                 self.audio_system.speak_nonblocking(self.quest_text)
 
-        self.quest_sprite_long_names.clear()
-        with Session() as session:
-            for quest in new_quests:
-                if quest.quest_type == QuestType.rescue:
-                    self.quest_sprite_long_names = set(
-                        sprite.long_name for sprite in session.query(NPCSprite).all())
-                elif quest.quest_type == QuestType.resource_node:
-                    self.quest_sprite_long_names = set(
-                        sprite.long_name for sprite in session.query(ResourceNodeSprite).all())
-                elif quest.quest_type == QuestType.cursed_chest:
-                    self.quest_sprite_long_names = set(sprite.long_name for sprite in
-                                                       session.query(ChestSprite).filter(
-                                                           ChestSprite.realm_id.is_not(None)).all())
-                else:
-                    for sprite in quest.sprites:
-                        self.quest_sprite_long_names.add(sprite.long_name)
-
-                if not quest.supported:
-                    self.audio_system.speak_nonblocking(f"Unsupported quest: {quest.title} {quest.description}")
+        # Performance: the sprites of every quest type were loaded with the catalog
+        self.quest_sprite_long_names = set(load_quest_catalog().sprite_long_names(new_quests))
+        for quest in new_quests:
+            if not quest.supported:
+                self.audio_system.speak_nonblocking(f"Unsupported quest: {quest.title} {quest.description}")
 
         self.current_quest_ids = new_quest_ids
 
@@ -211,13 +198,12 @@ class OcrUnknownArea(SpeakAuto):
         self.current_selected_text_result = ocr_result
         self.current_selected_text = selected_text
 
-    def extract_quest_name_from_quest_area(self, gray_frame: np.typing.ArrayLike) -> list[Quest]:
+    def extract_quest_name_from_quest_area(self, gray_frame: np.typing.ArrayLike) -> list[QuestInfo]:
         """
 
         :param gray_frame: greyscale full-windowed frame that the bot captured
         :return: List of quests that appeared in the quest area. an empty list is returned if no quests were found
         """
-        quests: list[Quest] = []
         y_text_dim = int(gray_frame.shape[0] * 0.55)
         x_text_dim = int(gray_frame.shape[1] * 0.30)
         quest_area = gray_frame[:y_text_dim, -x_text_dim:]
@@ -226,20 +212,8 @@ class OcrUnknownArea(SpeakAuto):
         text = self.ocr_engine.recognize_cv2_image(threshold_white)
 
         self.quest_text = text.merged_text
-        # see if any lines match a quest title
-        with Session() as session:
-            for line_info in text.lines:
-                line_text = line_info.merged_text.strip()
-                quest_obj: Quest
-                # fast check - no changes
-                if quest_res := session.query(Quest.id).filter_by(title_first_line=line_text).first():
-                    (quest_id,) = quest_res
-                    if quest_id in self.current_quest_ids:
-                        # return existing quests since no change
-                        return self.current_quests
-                if quest_obj := session.query(Quest).filter_by(title_first_line=line_text).first():
-                    quests.append(quest_obj)
-        return quests
+        # see if any lines match a quest title. Performance: matched in memory, tolerating OCR mistakes
+        return load_quest_catalog().match_lines(line_info.merged_text for line_info in text.lines)
 
     def gen_help_text(self) -> str:
         if self.current_dialog_text:
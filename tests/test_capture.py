@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from subot.capture import CaptureRateController, FrameChangeFilter, crop_slices, seconds_until_due
+
+
+def test_nearby_area_is_cropped_from_the_whole_window():
+    window = {"top": 100, "left": 50, "width": 640, "height": 480}
+    nearby = {"top": 150, "left": 250, "width": 256, "height": 256}
+    assert crop_slices(window, nearby) == (slice(50, 306), slice(200, 456))
+
+    outside = {"top": 350, "left": 250, "width": 256, "height": 256}
+    assert crop_slices(window, outside) is None
+
+
+def test_capture_rate_decays_while_nothing_changes():
+    rate = CaptureRateController(floor_fps=10, ceiling_fps=60, half_life_seconds=1.0)
+    assert rate.due(0.0)
+    rate.update(changed=True, now=0.0)
+    assert rate.fps == 60
+    assert not rate.due(0.01) and rate.due(1 / 60)
+
+    rate.update(changed=False, now=1.0)
+    assert rate.fps == 35
+    for second in range(2, 20):
+        rate.update(changed=False, now=float(second))
+    assert 10 <= rate.fps < 10.01
+
+    rate.update(changed=True, now=20.0)
+    assert rate.fps == 60
+    assert rate.captures == 21 and rate.changes == 2
+
+
+def test_capture_rate_after_a_stall():
+    rate = CaptureRateController(floor_fps=2, ceiling_fps=4)
+    rate.update(changed=True, now=0.0)
+    # after a long stall only one frame is captured, not every missed one
+    rate.update(changed=True, now=10.0)
+    assert not rate.due(10.1)
+    assert seconds_until_due(10.1, [rate]) == pytest.approx(0.15)
+
+
+def test_capture_rate_stays_above_the_heartbeat():
+    rate = CaptureRateController(floor_fps=0, ceiling_fps=60)
+    assert rate.floor_fps == 1 / FrameChangeFilter.HEARTBEAT_SECONDS
+    rate = CaptureRateController(floor_fps=-5, ceiling_fps=0)
+    assert rate.floor_fps == rate.ceiling_fps == 1 / FrameChangeFilter.HEARTBEAT_SECONDS
+
+
+def test_unchanged_frames_are_only_published_as_a_heartbeat():
+    changes = FrameChangeFilter(heartbeat_seconds=1.0)
+    frame = np.zeros((64, 64, 4), dtype=np.uint8)
+    assert changes.changed(frame, now=0.0)
+    assert not changes.changed(frame.copy(), now=0.5)
+    assert changes.changed(frame, now=1.0)
+    assert changes.heartbeat
+
+    moved = frame.copy()
+    moved[10:20, 30:40] = 255
+    assert changes.changed(moved, now=1.1)
+    assert not changes.heartbeat
+    # a crop of the same pixels but another shape is a new frame
+    assert changes.changed(moved[:32], now=1.2)
+    assert changes.published == 4 and changes.skipped == 1
+
+    changes.reset()
+    assert changes.changed(moved[:32], now=1.3)
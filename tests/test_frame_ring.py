@@ -0,0 +1,110 @@
+import multiprocessing
+import queue
+import time
+
+import numpy as np
+import pytest
+
+from subot.frame_ring import FrameRing, FrameMailbox
+
+
+def _write_frames(ring: FrameRing, count: int):
+    for value in range(1, count + 1):
+        ring.write(np.full((4, 6, 4), value, dtype=np.uint8))
+    ring.close()
+
+
+def test_latest_frame_is_a_view_of_the_newest_slot():
+    ring = FrameRing.create(slot_bytes=4 * 6 * 4, slots=3)
+    try:
+        assert ring.latest() is None
+        for value in range(1, 5):
+            seq = ring.write(np.full((4, 6, 4), value, dtype=np.uint8))
+        seq, frame = ring.latest()
+        assert seq == 4
+        assert frame.shape == (4, 6, 4)
+        assert (frame == 4).all()
+        assert ring.read(3) is not None
+        # the first frame's slot was rewritten by the fourth
+        assert ring.read(1) is None
+        view = ring.read(2)
+        assert ring.is_valid(2)
+        ring.write(np.full((4, 6, 4), 5, dtype=np.uint8))
+        # the view was overwritten after it was read
+        assert not ring.is_valid(2) and (view == 5).all()
+        del view
+
+        seq = ring.write(np.full((2, 3), 9, dtype=np.uint8))
+        assert ring.read(seq).shape == (2, 3)
+        del frame
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_frame_larger_than_a_slot_is_rejected():
+    ring = FrameRing.create(slot_bytes=16, slots=2)
+    try:
+        with pytest.raises(ValueError):
+            ring.write(np.zeros((4, 5), dtype=np.uint8))
+        assert ring.latest_seq == 0
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_frames_written_by_another_process():
+    ring = FrameRing.create(slot_bytes=4 * 6 * 4, slots=3)
+    try:
+        # the ring is attached to again by name when the process is started
+        writer = multiprocessing.get_context("spawn").Process(target=_write_frames, args=(ring, 5))
+        writer.start()
+        writer.join(timeout=30)
+        assert writer.exitcode == 0
+
+        seq, frame = ring.latest()
+        assert seq == 5
+        assert (frame == 5).all()
+        del frame
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_mailbox_hands_out_the_newest_frame_and_counts_drops():
+    mailbox = FrameMailbox.create("test", slot_bytes=4 * 6 * 4)
+    try:
+        mailbox.post(np.full((4, 6, 4), 1, dtype=np.uint8), captured_at=time.time() - 0.5)
+        msg = mailbox.get(timeout=5)
+        assert msg.seq == 1 and msg.dropped == 0
+        assert msg.age >= 0.5
+
+        for value in range(2, 6):
+            mailbox.post(np.full((4, 6, 4), value, dtype=np.uint8))
+        msg = mailbox.get(timeout=5)
+        assert msg.seq == 5 and (msg.frame == 5).all()
+        assert msg.dropped == 3
+        assert mailbox.frames == 2 and mailbox.dropped == 3
+
+        # the notification left for an already taken frame is skipped
+        with pytest.raises(queue.Empty):
+            mailbox.get(timeout=0.2)
+
+        mailbox.send("minimized")
+        assert mailbox.get(timeout=5) == "minimized"
+
+        # messages are not dropped when frame notifications fill the queue
+        for value in range(6, 9):
+            mailbox.post(np.full((4, 6, 4), value, dtype=np.uint8))
+        mailbox.send("pause")
+        mailbox.send("resume")
+        received = [mailbox.get(timeout=5) for _ in range(3)]
+        assert [msg for msg in received if isinstance(msg, str)] == ["pause", "resume"]
+        del received
+        mailbox.clear()
+        mailbox.send(None)
+        assert mailbox.get(timeout=5) is None
+        del msg
+    finally:
+        mailbox.ring.close()
+        mailbox.unlink()
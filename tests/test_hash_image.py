@@ -0,0 +1,69 @@
+import cv2
+import numpy as np
+import pytest
+
+from subot import hash_image
+from subot.hash_image import compute_hash, compute_hashes, compute_digest, tile_grid_view, TILE_SIZE, \
+    RealmSpriteHasher, ImageInfo
+from subot.lru import LRUCache
+from subot.models import SpriteType
+
+
+@pytest.fixture
+def tiles() -> np.ndarray:
+    rng = np.random.default_rng(1)
+    noise = rng.integers(0, 256, size=(200, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    # large flat areas like real sprites produce many tied DCT coefficients
+    blocky = np.repeat(np.repeat(rng.integers(0, 256, size=(200, 4, 4), dtype=np.uint8), 8, axis=1), 8, axis=2)
+    flat = np.stack([np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8),
+                     np.full((TILE_SIZE, TILE_SIZE), 77, dtype=np.uint8)])
+    return np.concatenate([noise, blocky, flat])
+
+
+def test_batch_hashes_match_single_tile_hashes(tiles):
+    batch_hashes = compute_hashes(tiles)
+
+    assert batch_hashes.dtype == np.int64
+    assert [int(h) for h in batch_hashes] == [compute_hash(tile) for tile in tiles]
+
+
+def test_tile_grid_view_hashes_in_grid_order():
+    rng = np.random.default_rng(2)
+    img = rng.integers(0, 256, size=(3 * TILE_SIZE, 2 * TILE_SIZE + 5), dtype=np.uint8)
+
+    grid = tile_grid_view(img)
+    hashes = compute_hashes(grid)
+
+    assert grid.shape == (3, 2, TILE_SIZE, TILE_SIZE)
+    assert hashes.shape == (3, 2)
+    assert hashes[2, 1] == compute_hash(img[2 * TILE_SIZE:3 * TILE_SIZE, TILE_SIZE:2 * TILE_SIZE])
+
+
+def test_known_digest_skips_phash(tiles):
+    fow = ImageInfo(short_name="bck_FOW_Tile", long_name="bck_FOW_Tile", sprite_type=SpriteType.DECORATION)
+    chest = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST)
+    hasher = RealmSpriteHasher()
+    hasher.digests[compute_digest(tiles[0])] = fow
+    # the digest wins over a stored phash for the same pixels
+    hasher[compute_hash(tiles[0])] = chest
+    hasher[compute_hash(tiles[1])] = chest
+
+    assert hasher.get_many_greyscale(tiles[:3]) == [fow, chest, None]
+    assert compute_digest(tiles[0]) == compute_digest(tiles[0].copy())
+    assert compute_digest(tiles[0]) != compute_digest(tiles[1])
+
+
+def test_image_cache_stays_in_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(hash_image, "image_cache", LRUCache(max_size=2 * 32 * 32 * 4, size_of=lambda img: img.nbytes))
+    paths = []
+    for idx in range(3):
+        path = tmp_path.joinpath(f"{idx}.png").as_posix()
+        cv2.imwrite(path, np.full((32, 32, 4), idx, dtype=np.uint8))
+        paths.append(path)
+
+    for path in paths:
+        hash_image.read_data_color(path)
+    assert hash_image.read_data_color(paths[2]) is hash_image.read_data_color(paths[2])
+    assert len(hash_image.image_cache) == 2
+    assert hash_image.image_cache.evictions == 1
+    assert hash_image.read_data_gray(paths[1]).shape == (32, 32)
@@ -0,0 +1,139 @@
+import numpy as np
+import pytest
+
+from subot.hash_image import RealmSpriteHasher, SortedSpriteHasher, ImageInfo, compute_digest, compute_digests, \
+    compute_hash, compute_signatures
+from subot.hash_index import HammingIndex, popcount64
+from subot.models import SpriteType
+
+
+def flip_bits(value: int, *bits: int) -> int:
+    value &= (1 << 64) - 1
+    for bit in bits:
+        value ^= 1 << bit
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+@pytest.fixture
+def stored_hashes() -> np.ndarray:
+    rng = np.random.default_rng(3)
+    return rng.integers(-2 ** 63, 2 ** 63 - 1, size=5000, dtype=np.int64)
+
+
+@pytest.mark.parametrize("max_distance", [0, 2, 5])
+def test_nearest_matches_brute_force(stored_hashes, max_distance):
+    rng = np.random.default_rng(max_distance)
+    queries = []
+    for stored in stored_hashes[:100].tolist():
+        bits = rng.choice(64, size=rng.integers(0, max_distance + 2), replace=False)
+        queries.append(flip_bits(stored, *bits.tolist()))
+    queries = np.asarray(queries, dtype=np.int64)
+
+    nearest = HammingIndex(stored_hashes, max_distance).query(queries)
+
+    for query, found in zip(queries, nearest):
+        distances = popcount64(stored_hashes ^ query)
+        expected = int(np.argmin(distances)) if distances.min() <= max_distance else -1
+        assert found == expected
+
+
+def test_chunks_flipped_by_several_bits_are_candidates(stored_hashes):
+    class WideHammingIndex(HammingIndex):
+        MAX_DISTANCE = 3 * HammingIndex.CHUNKS - 1
+
+    # 2 bits off in every chunk, only found by trying 2 bit flips of a chunk
+    query = flip_bits(int(stored_hashes[7]), 0, 1, 16, 17, 32, 33, 48, 49)
+    index = WideHammingIndex(stored_hashes, 8)
+    assert len(index._chunk_masks) == 1 + 16 + 16 * 15 // 2
+    assert index.query(np.asarray([query], dtype=np.int64)).tolist() == [7]
+
+
+def test_hasher_matches_hash_off_by_a_bit():
+    fow = ImageInfo(short_name="bck_FOW_Tile", long_name="bck_FOW_Tile", sprite_type=SpriteType.DECORATION)
+    hasher = RealmSpriteHasher(max_distance=2)
+    hasher[0x0F0F_0F0F_0F0F_0F0F] = fow
+
+    found = hasher.get_many(np.asarray([0x0F0F_0F0F_0F0F_0F0F, flip_bits(0x0F0F_0F0F_0F0F_0F0F, 3, 40), -1]))
+
+    assert found == [fow, fow, None]
+    with pytest.raises(KeyError):
+        RealmSpriteHasher(max_distance=0).get_phash(1)
+
+
+def test_sorted_hasher_matches_dict_hasher(stored_hashes):
+    sprites = [ImageInfo(short_name=f"sprite{idx}", long_name=f"sprite{idx}", sprite_type=SpriteType.DECORATION)
+               for idx in range(10)]
+    sprite_indices = np.arange(len(stored_hashes)) % len(sprites)
+    dict_hasher = RealmSpriteHasher(max_distance=2)
+    for phash, sprite_idx in zip(stored_hashes.tolist(), sprite_indices.tolist()):
+        dict_hasher[phash] = sprites[sprite_idx]
+    sorted_hasher = SortedSpriteHasher(stored_hashes, sprite_indices, sprites, max_distance=2)
+
+    queries = np.concatenate([stored_hashes[:50], [flip_bits(h, 7) for h in stored_hashes[50:60].tolist()],
+                              [flip_bits(h, 1, 20, 33) for h in stored_hashes[60:70].tolist()]])
+
+    assert sorted_hasher.get_many(queries) == dict_hasher.get_many(queries)
+    assert sorted_hasher.get_phash(int(stored_hashes[3])) == sprites[3]
+    with pytest.raises(KeyError):
+        SortedSpriteHasher([], [], []).get_phash(1)
+
+
+def test_sorted_hasher_digest_skips_phash():
+    rng = np.random.default_rng(6)
+    tiles = rng.integers(0, 256, size=(3, 32, 32), dtype=np.uint8)
+    fow = ImageInfo(short_name="bck_FOW_Tile", long_name="bck_FOW_Tile", sprite_type=SpriteType.DECORATION)
+    chest = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST)
+    hasher = SortedSpriteHasher(hashes=[compute_hash(tiles[0]), compute_hash(tiles[1])], sprite_indices=[1, 1],
+                                sprites=[fow, chest], digests=[compute_digest(tiles[0])], digest_sprite_indices=[0])
+
+    assert hasher.get_many_greyscale(tiles) == [fow, chest, None]
+    digests = compute_digests(tiles)
+    assert digests.tolist() == [compute_digest(tile) for tile in tiles]
+    assert hasher.get_many_greyscale(tiles, digests=digests) == [fow, chest, None]
+    assert len(compute_digests(tiles[:0])) == 0
+
+    near = SortedSpriteHasher(hashes=[compute_hash(tiles[1]) ^ 1, compute_hash(tiles[2])], sprite_indices=[1, 1],
+                              sprites=[fow, chest], max_distance=1)
+    found, exact = near.match_many_greyscale(tiles)
+    assert found == [None, chest, chest]
+    assert exact.tolist() == [False, False, True]
+
+
+def test_sorted_hasher_tells_apart_sprites_sharing_a_hash():
+    rng = np.random.default_rng(9)
+    chest_tile = rng.integers(0, 256, size=(32, 32), dtype=np.uint8)
+    haunted_tile = rng.integers(0, 256, size=(32, 32), dtype=np.uint8)
+    dimmed_haunted_tile = (haunted_tile * 0.9).astype(np.uint8)
+    chest = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST)
+    haunted = ImageInfo(short_name="haunted", long_name="haunted chest", sprite_type=SpriteType.CHEST)
+    # the table kept the chest for a hash both chests share
+    shared_hash = compute_hash(dimmed_haunted_tile)
+    table = dict(hashes=[shared_hash], sprite_indices=[0], sprites=[chest, haunted])
+
+    assert SortedSpriteHasher(**table).get_many_greyscale(dimmed_haunted_tile[np.newaxis]) == [chest]
+    hasher = SortedSpriteHasher(**table, collision_hashes=[shared_hash, shared_hash], collision_sprite_indices=[0, 1],
+                                collision_signatures=compute_signatures(np.stack([chest_tile, haunted_tile])))
+    assert hasher.get_many_greyscale(np.stack([dimmed_haunted_tile, chest_tile])) == [haunted, None]
+
+
+def test_dict_hasher_tells_apart_sprites_sharing_a_hash():
+    rng = np.random.default_rng(9)
+    chest_tile = rng.integers(0, 256, size=(32, 32), dtype=np.uint8)
+    haunted_tile = rng.integers(0, 256, size=(32, 32), dtype=np.uint8)
+    dimmed_haunted_tile = (haunted_tile * 0.9).astype(np.uint8)
+    chest = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST)
+    haunted = ImageInfo(short_name="haunted", long_name="haunted chest", sprite_type=SpriteType.CHEST)
+    shared_hash = compute_hash(dimmed_haunted_tile)
+    hasher = RealmSpriteHasher(max_distance=2)
+    hasher[shared_hash] = chest
+    hasher.collisions[shared_hash] = list(zip(compute_signatures(np.stack([chest_tile, haunted_tile])),
+                                              [chest, haunted]))
+
+    found, exact = hasher.match_many_greyscale(np.stack([dimmed_haunted_tile, chest_tile]))
+    assert found == [haunted, None]
+    assert exact.tolist() == [True, False]
+    # a near match of the shared hash is told apart the same way
+    near_hasher = RealmSpriteHasher(max_distance=2)
+    near_hasher[flip_bits(shared_hash, 0)] = chest
+    near_hasher.collisions[flip_bits(shared_hash, 0)] = hasher.collisions[shared_hash]
+    assert near_hasher.match_many_greyscale(dimmed_haunted_tile[np.newaxis])[0] == [haunted]
@@ -0,0 +1,106 @@
+import numpy as np
+
+from subot.hash_image import ImageInfo, SortedSpriteHasher, intern_image_info
+from subot.hash_index import HammingIndex
+from subot.hash_packs import save_pack, load_pack, pack_name, pack_nbytes, CASTLE_PACK_NAME, HashTableRegistry
+import subot.settings as settings
+from subot.models import SpriteType, Realm
+
+
+def test_saved_pack_loads_memory_mapped(tmp_path):
+    rng = np.random.default_rng(7)
+    hashes = rng.integers(-2 ** 63, 2 ** 63 - 1, size=1000, dtype=np.int64)
+    sprites = [ImageInfo(short_name="chest", long_name="spr_chest", sprite_type=SpriteType.CHEST),
+               ImageInfo(short_name="floor", long_name="floor_standard1", sprite_type=SpriteType.FLOOR)]
+    hasher = SortedSpriteHasher(hashes, np.arange(1000) % 2, sprites, digests=[5, -3], digest_sprite_indices=[1, 0])
+
+    save_pack(hasher, pack_name(Realm.ARACHNID_NEST), tmp_path)
+    loaded = load_pack(pack_name(Realm.ARACHNID_NEST), max_distance=2, directory=tmp_path)
+
+    assert isinstance(loaded.hashes, np.memmap)
+    assert loaded.sprites == sprites
+    assert loaded.get_many(hashes[:20]) == hasher.get_many(hashes[:20])
+    assert list(loaded.digests) == [-3, 5]
+    assert load_pack(CASTLE_PACK_NAME, directory=tmp_path) is None
+
+
+def test_pack_of_another_database_is_not_loaded(tmp_path, monkeypatch):
+    database_path = tmp_path.joinpath("assets.db")
+    monkeypatch.setattr(settings, "sqlite_path", database_path)
+    hasher = SortedSpriteHasher([3, 1], [0, 0], [ImageInfo(short_name="chest", long_name="spr_chest",
+                                                           sprite_type=SpriteType.CHEST)])
+
+    # without a database the pack is all there is
+    save_pack(hasher, CASTLE_PACK_NAME, tmp_path)
+    assert load_pack(CASTLE_PACK_NAME, directory=tmp_path) is not None
+
+    database_path.write_bytes(b"sprites v1")
+    assert load_pack(CASTLE_PACK_NAME, directory=tmp_path) is None
+    save_pack(hasher, CASTLE_PACK_NAME, tmp_path)
+    assert load_pack(CASTLE_PACK_NAME, directory=tmp_path) is not None
+
+    database_path.write_bytes(b"sprites v2, changed")
+    assert load_pack(CASTLE_PACK_NAME, directory=tmp_path) is None
+
+
+def test_registry_prefers_recent_realms(tmp_path):
+    recent_path = tmp_path.joinpath("recent_realms.json")
+    registry = HashTableRegistry(recent_path=recent_path)
+    assert registry.load_order()[:2] == [None, list(Realm)[0]]
+
+    registry._mark_recent(Realm.AZURE_DREAM)
+    registry._mark_recent(Realm.ARACHNID_NEST)
+
+    reloaded = HashTableRegistry(recent_path=recent_path)
+    assert reloaded.load_order()[:3] == [None, Realm.ARACHNID_NEST, Realm.AZURE_DREAM]
+    assert len(reloaded.load_order()) == len(Realm) + 1
+
+
+def test_registry_loads_exported_pack_on_request(tmp_path):
+    hasher = SortedSpriteHasher([3, 1], [0, 0], [ImageInfo(short_name="chest", long_name="spr_chest",
+                                                           sprite_type=SpriteType.CHEST)])
+    save_pack(hasher, CASTLE_PACK_NAME, tmp_path)
+
+    registry = HashTableRegistry(directory=tmp_path)
+    assert not registry.is_ready(None)
+    assert registry.get(None).get_phash(3).long_name == "spr_chest"
+    assert registry.is_ready(None)
+    assert registry.ready_count == 1
+
+
+def test_registry_drops_least_recent_table_past_budget(tmp_path):
+    sprites = [intern_image_info(1, "chest", "spr_chest", SpriteType.CHEST)]
+    for name in (CASTLE_PACK_NAME, pack_name(Realm.ARACHNID_NEST), pack_name(Realm.AZURE_DREAM)):
+        save_pack(SortedSpriteHasher(np.arange(100), np.zeros(100), sprites), name, tmp_path)
+
+    # room for two tables
+    registry = HashTableRegistry(directory=tmp_path, budget_bytes=2 * (100 * 8 + 100 * 4))
+    castle = registry.get(None)
+    registry.get(Realm.ARACHNID_NEST)
+    registry.get(None)
+    registry.get(Realm.AZURE_DREAM)
+
+    assert registry.is_ready(None) and registry.is_ready(Realm.AZURE_DREAM)
+    assert not registry.is_ready(Realm.ARACHNID_NEST)
+    assert registry.get(Realm.AZURE_DREAM).sprites[0] is castle.sprites[0]
+
+
+def test_preloading_stops_at_the_first_table_past_budget(tmp_path):
+    sprites = [intern_image_info(1, "chest", "spr_chest", SpriteType.CHEST)]
+    realms = [None, Realm.ARACHNID_NEST, Realm.AZURE_DREAM, Realm.BLOOD_GROVE]
+    for count, realm in zip((100, 100, 300, 100), realms):
+        save_pack(SortedSpriteHasher(np.arange(count), np.zeros(count), sprites), pack_name(realm), tmp_path)
+    assert pack_nbytes(pack_name(None), max_distance=1, directory=tmp_path) == \
+        100 * 8 + 100 * 4 + HammingIndex.estimate_nbytes(100)
+
+    # room for the castle and arachnid nest with their indexes, but not azure dream's
+    table_nbytes = pack_nbytes(pack_name(None), max_distance=1, directory=tmp_path)
+    registry = HashTableRegistry(max_distance=1, directory=tmp_path, budget_bytes=int(2.5 * table_nbytes))
+    registry.load_order = lambda: realms
+    registry.run()
+
+    assert registry.is_ready(None) and registry.is_ready(Realm.ARACHNID_NEST)
+    assert not registry.is_ready(Realm.AZURE_DREAM) and not registry.is_ready(Realm.BLOOD_GROVE)
+    assert registry.tables.evictions == 0
+    assert registry.tables.size <= registry.tables.max_size
+    assert registry.get(None).nbytes == registry.tables.size // 2
@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+from sqlalchemy import create_engine, text
+
+from subot.query_timing import QueryTimer
+from subot.settings import runtime_database_uri
+
+
+def test_timer_groups_statements():
+    engine = create_engine("sqlite://")
+    timer = QueryTimer()
+    timer.attach(engine)
+
+    with engine.connect() as conn:
+        for value in range(3):
+            conn.execute(text("SELECT :value"), {"value": value})
+        conn.execute(text("SELECT 1 + 1"))
+
+    assert timer.stats["SELECT ?"].count == 3
+    assert timer.stats["SELECT 1 + 1"].count == 1
+    assert timer.stats["SELECT ?"].max_seconds <= timer.stats["SELECT ?"].total_seconds
+    assert "SELECT ?" in timer.report()
+
+
+def test_report_while_statements_run_on_other_threads():
+    engine = create_engine("sqlite://")
+    timer = QueryTimer()
+    timer.attach(engine)
+
+    def run_statements(thread: int):
+        with engine.connect() as conn:
+            for value in range(200):
+                conn.execute(text(f"SELECT {thread} + :value"), {"value": value})
+
+    threads = [threading.Thread(target=run_statements, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        timer.report()
+    for thread in threads:
+        thread.join()
+    assert sum(stats.count for stats in timer.stats.values()) == 800
+
+
+def test_runtime_uri_quotes_the_path(tmp_path):
+    directory = tmp_path.joinpath("saves #1 100%?")
+    directory.mkdir()
+    path = directory.joinpath("assets.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE sprite (id INTEGER)")
+        conn.execute("INSERT INTO sprite VALUES (7)")
+    conn.close()
+
+    with create_engine(runtime_database_uri(path)).connect() as conn:
+        assert conn.execute(text("SELECT id FROM sprite")).scalar() == 7
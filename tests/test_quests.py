@@ -0,0 +1,46 @@
+from subot.models import QuestType
+from subot.quests import QuestCatalog, QuestInfo, within_edit_distance
+
+
+def quest(quest_id: int, title: str, quest_type: QuestType = QuestType.decoration,
+          sprite_long_names: frozenset[str] = frozenset()) -> QuestInfo:
+    return QuestInfo(id=quest_id, title=title, title_first_line=title.split("\r\n")[0], quest_type=quest_type,
+                     supported=True, description=None, sprite_long_names=sprite_long_names)
+
+
+CATALOG = QuestCatalog([quest(1, "Digging For Treasure\r\nFind the buried items"), quest(2, "A Lost Soul"),
+                        quest(3, "Spider Eggs")])
+
+
+def test_exact_titles_ignore_case_and_spacing():
+    assert CATALOG.match("digging  for treasure").id == 1
+    assert CATALOG.match("Spider Eggs").id == 3
+
+
+def test_one_ocr_mistake_still_matches():
+    assert CATALOG.match("Digging F0r Treasure").id == 1
+    assert CATALOG.match("A Lost Sou1").id == 2
+    assert CATALOG.match("Diggin For Treasure").id == 1
+    assert CATALOG.match("Digging For Pleasure") is None
+    # too short to guess
+    assert CATALOG.match("Eggs") is None
+
+
+def test_lines_match_each_quest_once():
+    quests = CATALOG.match_lines(["Quests", "Spider Eggs", "Collect 3", "Spider Egg5"])
+
+    assert [quest.id for quest in quests] == [3]
+
+
+def test_edit_distance_bound():
+    assert within_edit_distance("kitten", "sitten", 1)
+    assert not within_edit_distance("kitten", "sitting", 1)
+    assert within_edit_distance("kitten", "sitting", 3)
+
+
+def test_quest_type_sprites_replace_quest_sprites():
+    catalog = QuestCatalog([], quest_type_sprites={QuestType.rescue: frozenset({"npc_a", "npc_b"})})
+    rescue = quest(4, "Rescue The Lost", QuestType.rescue, frozenset({"unused"}))
+    eggs = quest(5, "Spider Eggs", sprite_long_names=frozenset({"egg"}))
+
+    assert catalog.sprite_long_names([rescue, eggs]) == {"npc_a", "npc_b", "egg"}
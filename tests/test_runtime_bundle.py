@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+from subot.enums import Realm, QuestType, SpriteType
+from subot.hash_image import intern_image_info
+from subot.quests import QuestInfo
+import subot.settings as settings
+from subot.runtime_bundle import RuntimeBundle, FloorInfo, BackgroundFrame, save_runtime_bundle, read_runtime_bundle, \
+    MANIFEST_NAME
+
+
+def test_bundle_round_trip(tmp_path):
+    floor = intern_image_info(90001, "floor", "Arachnid Nest floor", SpriteType.FLOOR)
+    bundle = RuntimeBundle(
+        floor_hashes={-5: FloorInfo(realm=Realm.ARACHNID_NEST, long_name="Arachnid Nest floor"),
+                      7: FloorInfo(realm=None, long_name="floor_standard1")},
+        quests=[QuestInfo(id=1, title="Spider Eggs\r\nFind them", title_first_line="Spider Eggs",
+                          quest_type=QuestType.decoration, supported=True, description=None,
+                          sprite_long_names=frozenset({"egg"}))],
+        quest_type_sprites={QuestType.rescue: frozenset({"npc"})},
+        background_frames={"ARACHNID_NEST": [BackgroundFrame(filepath="floors/nest.png", img_info=floor)]},
+    )
+
+    save_runtime_bundle(bundle, tmp_path)
+
+    assert read_runtime_bundle(tmp_path) == bundle
+    assert read_runtime_bundle(tmp_path.joinpath("missing")) is None
+
+
+def test_old_bundle_version_is_ignored(tmp_path):
+    tmp_path.joinpath(MANIFEST_NAME).write_text('{"version": 0}', encoding="utf8")
+
+    assert read_runtime_bundle(tmp_path) is None
+
+
+def test_bundle_of_another_database_is_ignored(tmp_path, monkeypatch):
+    database_path = tmp_path.joinpath("assets.db")
+    monkeypatch.setattr(settings, "sqlite_path", database_path)
+    database_path.write_bytes(b"quests v1")
+    bundle = RuntimeBundle(floor_hashes={}, quests=[], quest_type_sprites={}, background_frames={})
+    save_runtime_bundle(bundle, tmp_path)
+    assert read_runtime_bundle(tmp_path) == bundle
+
+    database_path.write_bytes(b"quests v2, changed")
+    assert read_runtime_bundle(tmp_path) is None
+
+
+def test_runtime_modules_do_not_import_sqlalchemy():
+    code = "import sys, subot.runtime_bundle, subot.tile_classifier; assert 'sqlalchemy' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True)
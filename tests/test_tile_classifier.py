@@ -0,0 +1,186 @@
+import numpy as np
+import pytest
+
+from subot.hash_image import RealmSpriteHasher, ImageInfo, BackgroundModel, compute_hash, TILE_SIZE
+from subot.lru import LRUCache
+from subot.models import SpriteType
+from subot.pathfinder.map import TileType
+from subot.tile_classifier import TileResultCache, TileTypeVoter, TileTypeTable, estimate_tile_shift
+
+
+@pytest.fixture
+def tiles() -> np.ndarray:
+    rng = np.random.default_rng(4)
+    return rng.integers(0, 256, size=(3, 2, TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+
+
+@pytest.fixture
+def hasher(tiles) -> RealmSpriteHasher:
+    hasher = RealmSpriteHasher()
+    hasher[compute_hash(tiles[0, 0])] = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST)
+    return hasher
+
+
+def test_unchanged_tiles_reuse_previous_result(tiles, hasher):
+    cache = TileResultCache()
+    first = cache.get_many_greyscale(tiles, hasher)
+
+    changed = tiles.copy()
+    changed[2, 1] = tiles[0, 0]
+    second = cache.get_many_greyscale(changed, hasher)
+
+    assert first[0].long_name == "chest"
+    assert first[1:] == [None] * 5
+    assert second == first[:5] + [first[0]]
+    assert cache.unchanged == 5
+    assert cache.seen.hits == 1
+    assert cache.hit_rate == 6 / 12
+
+
+def test_new_hasher_drops_cached_results(tiles, hasher):
+    cache = TileResultCache()
+    cache.get_many_greyscale(tiles, hasher)
+
+    resets = cache.resets
+    assert cache.get_many_greyscale(tiles, RealmSpriteHasher()) == [None] * 6
+    assert cache.unchanged == 0
+    assert cache.resets == resets + 1
+
+
+def test_scrolled_view_only_hashes_uncovered_tiles(tiles, hasher):
+    rng = np.random.default_rng(5)
+    cache = TileResultCache()
+    first = cache.get_many_greyscale(tiles, hasher)
+
+    # player stepped down, everything moves up a row and a new bottom row is uncovered
+    scrolled = np.concatenate([tiles[1:], rng.integers(0, 256, size=(1, 2, TILE_SIZE, TILE_SIZE), dtype=np.uint8)])
+    assert estimate_tile_shift(tiles, scrolled) == (0, -1)
+
+    second = cache.get_many_greyscale(scrolled, hasher)
+    assert cache.last_shift == (0, -1)
+    assert cache.unchanged == 4
+    assert second[:4] == first[2:]
+
+
+def test_scrolled_view_keeps_tiles_fixed_to_the_screen(tiles, hasher):
+    rng = np.random.default_rng(5)
+    player = ImageInfo(short_name="player", long_name="player", sprite_type=SpriteType.DECORATION)
+    hasher[compute_hash(tiles[1, 0])] = player
+    cache = TileResultCache()
+    cache.get_many_greyscale(tiles, hasher)
+
+    # the view scrolls up a row while the player stays in the middle of the screen
+    scrolled = np.concatenate([tiles[1:], rng.integers(0, 256, size=(1, 2, TILE_SIZE, TILE_SIZE), dtype=np.uint8)])
+    scrolled[1, 0] = tiles[1, 0]
+    second = cache.get_many_greyscale(scrolled, hasher)
+    assert cache.last_shift == (0, -1)
+    assert cache.unchanged == 4
+    assert second[2] is player and second[0] is player
+
+
+def test_cascade_resolves_uniform_tiles_without_hashing(tiles):
+    fow_tile = np.zeros((TILE_SIZE, TILE_SIZE), dtype=np.uint8)
+    floor_tile = tiles[0, 0]
+    fow = ImageInfo(short_name="bck_FOW_Tile", long_name="bck_FOW_Tile", sprite_type=SpriteType.DECORATION)
+    floor = ImageInfo(short_name="floor", long_name="floor", sprite_type=SpriteType.FLOOR)
+    hasher = RealmSpriteHasher()
+    hasher[compute_hash(fow_tile)] = fow
+    hasher[compute_hash(floor_tile)] = floor
+
+    cache = TileResultCache()
+    cache.get_many_greyscale(np.stack([fow_tile, floor_tile])[np.newaxis], hasher)
+    assert cache.hashed == 2
+
+    # same tiles in new positions, the blank one from its value and the floor from its digest
+    found = cache.get_many_greyscale(np.stack([floor_tile, fow_tile, tiles[1, 1]])[np.newaxis], hasher)
+    assert found == [floor, fow, None]
+    assert cache.cascade.resolved_uniform == 1
+    assert cache.seen.hits == 1
+    assert cache.hashed == 3
+
+
+def test_background_model_learns_floor_tiles(tiles):
+    floor = ImageInfo(short_name="floor", long_name="floor", sprite_type=SpriteType.FLOOR)
+    hasher = RealmSpriteHasher()
+    hasher[compute_hash(tiles[0, 0])] = floor
+    background = BackgroundModel()
+
+    cache = TileResultCache()
+    cache.get_many_greyscale(tiles[:1, :1], hasher, background=background)
+    assert len(background) == 1
+
+    nearly_floor = tiles[0, 0].copy()
+    nearly_floor[31, 31] ^= 1
+    found = cache.get_many_greyscale(np.stack([nearly_floor, tiles[0, 0]])[np.newaxis], hasher, background=background)
+    assert found[1] == floor
+    assert cache.background == 1
+    assert not background.add(tiles[0, 0], floor)
+    assert list(background.match(np.stack([tiles[0, 0], tiles[1, 1]]))) == [0, -1]
+
+
+def test_background_model_only_learns_exact_matches(tiles):
+    floor = ImageInfo(short_name="floor", long_name="floor", sprite_type=SpriteType.FLOOR)
+    hasher = RealmSpriteHasher(max_distance=1)
+    hasher[compute_hash(tiles[0, 0]) ^ 1] = floor
+    background = BackgroundModel()
+
+    cache = TileResultCache()
+    assert cache.get_many_greyscale(tiles[:1, :1], hasher, background=background) == [floor]
+    assert len(background) == 0
+    assert hasher.match_many_greyscale(tiles[0, :1])[1].tolist() == [False]
+
+
+def codes(*tile_types: TileType) -> np.ndarray:
+    return np.array([[tile_type.num for tile_type in tile_types]], dtype=np.int8)
+
+
+def test_voter_needs_agreeing_frames_to_change_type():
+    voter = TileTypeVoter((1, 2), history=4, required=3)
+    chest_floor = codes(TileType.CHEST, TileType.FLOOR)
+    flicker = codes(TileType.DECORATION, TileType.FLOOR)
+
+    assert voter.update(chest_floor).tolist() == codes(TileType.UNFILLED, TileType.UNFILLED).tolist()
+    voter.update(chest_floor)
+    assert voter.update(chest_floor).tolist() == chest_floor.tolist()
+    # a one frame flicker keeps the steady type
+    assert voter.update(flicker).tolist() == chest_floor.tolist()
+
+    voter.shift(1, 0)
+    assert voter.update(codes(TileType.WALL, TileType.CHEST)).tolist() == \
+           codes(TileType.UNFILLED, TileType.CHEST).tolist()
+
+    # after a realm change nothing is reported until the new realm's tiles agree
+    voter.clear()
+    assert voter.update(chest_floor).tolist() == codes(TileType.UNFILLED, TileType.UNFILLED).tolist()
+
+
+def test_tile_type_table_maps_sprites_by_id():
+    chest = ImageInfo(short_name="chest", long_name="chest", sprite_type=SpriteType.CHEST, sprite_id=2)
+    floor = ImageInfo(short_name="floor", long_name="floor", sprite_type=SpriteType.FLOOR, sprite_id=0)
+    unseen = ImageInfo(short_name="new", long_name="new", sprite_type=SpriteType.DECORATION, sprite_id=9)
+    tile_types = {SpriteType.CHEST: TileType.CHEST, SpriteType.FLOOR: TileType.FLOOR}
+    table = TileTypeTable()
+
+    inputs = ("realm", frozenset())
+    assert table.is_stale(inputs)
+    table.update(inputs, [chest, floor], identify=lambda img_info: tile_types[img_info.sprite_type])
+    assert not table.is_stale(inputs)
+    assert table.is_stale(("other realm", frozenset()))
+
+    assert table.lookup([floor, None, chest, unseen]).tolist() == \
+           [TileType.FLOOR.num, TileType.UNKNOWN.num, TileType.CHEST.num, TileTypeTable.MISSING]
+
+
+def test_lru_evicts_least_recently_used():
+    cache: LRUCache[int, str] = LRUCache(2)
+    cache[1] = "a"
+    cache[2] = "b"
+    assert cache[1] == "a"
+    cache[3] = "c"
+
+    assert 2 not in cache
+    assert 1 in cache and 3 in cache
+    assert cache.evictions == 1
+    with pytest.raises(KeyError):
+        cache[2]
+    assert cache.hit_rate == 0.5